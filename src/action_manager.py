@@ -1,19 +1,78 @@
 """Module to send actions to the turtlebot.
 
+Actions reach the :py:class:`ActionManager` either on the ``action_cmd``
+topic or, to skip serialization and a process hop, through an
+:py:class:`ActionChannel` in shared memory. The manager publishes a new
+action as soon as it arrives and otherwise repeats the current one at
+40Hz, so the turtlebot keeps moving between learning timesteps.
+
 Authors:
     Shibhansh Dohare, Banafsheh Rafiee, Parash Rahman, Niko Yasui.
 """
+from __future__ import division
+
+import multiprocessing as mp
+import threading
 
-import rospy
 from geometry_msgs.msg import Twist, Vector3
 from std_msgs.msg import Bool
 
 from tools import topic_format
+from transport import ROSInterruptException, RosTransport, logdebug, loginfo
+
+
+class ActionChannel:
+    """Single-slot mailbox for the newest action, in shared memory.
+
+    Can be shared with an :py:class:`ActionManager` in a thread of the
+    same process or in a process started after the channel is created.
+
+    Attributes:
+        changed (multiprocessing Event): Set whenever a new action is
+            written.
+    """
+
+    def __init__(self):
+        self._values = mp.RawArray('d', 6)
+        self._seq = mp.RawValue('l', 0)
+        self._lock = mp.Lock()
+        self.changed = mp.Event()
+
+    def write(self, action):
+        """Replaces the action in the slot.
+
+        Args:
+            action (geometry_msgs Twist): Action to send.
+        """
+        values = (action.linear.x, action.linear.y, action.linear.z,
+                  action.angular.x, action.angular.y, action.angular.z)
+        with self._lock:
+            self._values[:] = values
+            self._seq.value += 1
+        self.changed.set()
+
+    def read(self):
+        """Gets the newest action.
+
+        Returns:
+            (int, geometry_msgs Twist): Number of actions written so far,
+                and the newest of them.
+        """
+        with self._lock:
+            seq = self._seq.value
+            values = self._values[:]
+        return seq, Twist(Vector3(*values[:3]), Vector3(*values[3:]))
 
 
 class ActionManager():
     """Class that communicates directly with the turtlebot.
 
+    Args:
+        channel (ActionChannel, optional): Channel to read actions from.
+            If ``None``, actions are read from the ``action_cmd`` topic.
+        transport (optional): Topics and clock to run on (see
+            :doc:`transport`). Defaults to ROS.
+
     Attributes:
         action (action): The action to send to the turtlebot.
         base_state: The current reading from the turtlebot's 'core'
@@ -22,25 +81,33 @@ class ActionManager():
         pause_flag (bool): Stop sending actions if this is true.
         stop_once (bool): Send one stop action and resume sending
             ``action``.
+        changed (Event): Set when ``action`` changes, to publish it
+            without waiting for the next 40Hz tick.
     """
 
-    def __init__(self):
+    def __init__(self, channel=None, transport=None):
+        self.transport = transport or RosTransport()
         self.STOP_ACTION = Twist(Vector3(0, 0, 0), Vector3(0, 0, 0))
 
         self.action = Twist(Vector3(0, 0, 0), Vector3(0, 0, 0))
         self.base_state = None
-        rospy.Subscriber("/mobile_base/sensors/core",
-                         topic_format["/mobile_base/sensors/core"],
-                         self.update_base_state)
+        self.transport.subscribe("/mobile_base/sensors/core",
+                                 topic_format["/mobile_base/sensors/core"],
+                                 self.update_base_state)
         self.termination_flag = False
         self.pause_flag = False
         self.stop_once = False
 
+        self.channel = channel
+        self.last_seq = 0
+        self.changed = channel.changed if channel else threading.Event()
+
     def update_base_state(self, val):
         """Set ``action`` to ``STOP_ACTION`` if the bumper is on."""
         self.base_state = val
         if self.action.linear.x and self.base_state.bumper:
             self.action = self.STOP_ACTION
+            self.changed.set()
 
     def set_termination_flag(self, termination_flag):
         self.termination_flag = termination_flag
@@ -49,10 +116,16 @@ class ActionManager():
         self.pause_flag = pause_flag.data
 
     def update_action(self, action_cmd):
+        """Sets a new action and publishes it right away."""
+        self.set_action(action_cmd)
+        self.changed.set()
+
+    def set_action(self, action_cmd):
         """Don't go forward if bumping and wait before going forward 
         after turning.
         """
-        if action_cmd.linear.x and self.base_state.bumper:
+        bumping = self.base_state is not None and self.base_state.bumper
+        if action_cmd.linear.x and bumping:
             self.action = self.STOP_ACTION
         elif action_cmd.linear.x and self.action.angular.z:
             self.stop_once = True
@@ -60,27 +133,46 @@ class ActionManager():
         else:
             self.action = action_cmd
 
+    def read_channel(self):
+        """Takes a new action from :py:attr:`channel` if there is one."""
+        seq, action_cmd = self.channel.read()
+        if seq != self.last_seq:
+            self.last_seq = seq
+            self.set_action(action_cmd)
+
     def run(self):
-        """Send an action at a 40Hz cycle."""
-        rospy.init_node('action_manager', anonymous=True)
-        rospy.Subscriber('action_cmd', Twist, self.update_action)
-        rospy.Subscriber('termination', Bool, self.set_termination_flag)
-        rospy.Subscriber('pause', Bool, self.set_pause_flag)
+        """Send each new action at once, and repeat it at a 40Hz cycle.
+
+        Expects the ROS node to be initialized already.
+        """
+        transport = self.transport
+        if self.channel is None:
+            transport.subscribe('action_cmd', Twist, self.update_action)
+        transport.subscribe('termination', Bool, self.set_termination_flag)
+        transport.subscribe('pause', Bool, self.set_pause_flag)
 
-        action_publisher = rospy.Publisher('cmd_vel_mux/input/teleop',
-                                           Twist,
-                                           queue_size=1)
+        action_publisher = transport.publisher('cmd_vel_mux/input/teleop',
+                                               Twist,
+                                               queue_size=1)
 
-        action_pub_rate = rospy.Rate(40)
+        # watchdog that repeats the action if nothing new arrives
+        action_pub_rate = transport.rate(1 / 40, name='action_manager')
 
-        while not rospy.is_shutdown():
+        while not transport.is_shutdown():
             if self.termination_flag:
                 break
+
+            # wake up for a new action or the next tick, whichever is first
+            if action_pub_rate.sleep(self.changed):
+                self.changed.clear()
+            if self.channel is not None:
+                self.read_channel()
+
             if self.pause_flag is False:
                 # log action
                 speeds = (self.action.linear.x, self.action.angular.z)
                 actn = "linear: {}, angular: {}".format(*speeds)
-                rospy.logdebug("Sending action to Turtlebot: {}".format(actn))
+                logdebug("Sending action to Turtlebot: {}".format(actn))
 
                 # send new actions
                 if self.stop_once:
@@ -88,13 +180,48 @@ class ActionManager():
                     self.stop_once = False
                 else:
                     action_publisher.publish(self.action)
-            action_pub_rate.sleep()
 
 
-def start_action_manager():
-    """Runs the action manager"""
+def start_action_manager(channel=None):
+    """Runs the action manager in its own ROS node.
+
+    Args:
+        channel (ActionChannel, optional): Channel shared with the
+            learning foreground. If ``None``, actions are read from the
+            ``action_cmd`` topic.
+    """
     try:
-        action_manager = ActionManager()
+        transport = RosTransport()
+        transport.init_node('action_manager')
+        action_manager = ActionManager(channel, transport)
         action_manager.run()
-    except rospy.ROSInterruptException as detail:
-        rospy.loginfo("Handling: {}".format(detail))
+    except ROSInterruptException as detail:
+        loginfo("Handling: {}".format(detail))
+
+
+def start_action_thread(channel=None, transport=None):
+    """Runs an action manager on a daemon thread of the current node.
+
+    Args:
+        channel (ActionChannel, optional): Channel to read actions from.
+        transport (optional): Transport of the current node. Defaults to
+            ROS.
+
+    Returns:
+        ActionManager: The running action manager.
+
+    Raises:
+        ValueError: If the transport is not asynchronous. The watchdog
+            would sleep on the same virtual clock as the learning loop,
+            advancing the simulation from a second thread.
+    """
+    action_manager = ActionManager(channel, transport)
+    if not action_manager.transport.asynchronous:
+        raise ValueError("An action thread needs an asynchronous "
+                         "transport; publish actions on the "
+                         "'action_cmd' topic instead.")
+    thread = threading.Thread(target=action_manager.run,
+                              name='action_manager')
+    thread.daemon = True
+    thread.start()
+    return action_manager
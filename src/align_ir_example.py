@@ -18,7 +18,6 @@ Authors:
 import multiprocessing as mp
 import numpy as np
 import random
-import rospy
 
 from action_manager import start_action_manager
 from auto_docking_policies import EGreedy
@@ -27,6 +26,7 @@ from greedy_gq import GreedyGQ
 from gvf import GVF
 from learning_foreground import start_learning_foreground
 from state_representation import StateConstants
+from transport import ROSInterruptException, loginfo
 
 if __name__ == '__main__':
     try:
@@ -93,7 +93,7 @@ if __name__ == '__main__':
                             learner=learner,
                             target_policy=target_policy,
                             name='auto_docking',
-                            logger=rospy.loginfo,
+                            logger=loginfo,
                             feature_indices=feature_indices,
                             **parameters)
 
@@ -121,8 +121,8 @@ if __name__ == '__main__':
         foreground_process.start()
         action_manager_process.start()
 
-    except rospy.ROSInterruptException as detail:
-        rospy.loginfo("Handling: {}".format(detail))
+    except ROSInterruptException as detail:
+        loginfo("Handling: {}".format(detail))
     finally:
         try:
             foreground_process.join()
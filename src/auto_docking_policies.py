@@ -8,9 +8,9 @@ Authors:
 from __future__ import division
 
 import numpy as np
-import rospy
 
 from policy import Policy
+from transport import loginfo
 
 
 class EGreedy(Policy):
@@ -43,10 +43,7 @@ class EGreedy(Policy):
         Policy.__init__(self, *args, **kwargs)
 
     def update(self, phi, *args, **kwargs):
-        phi = phi[self.feature_indices]
-
-        q_fun = np.vectorize(lambda action: self.value_function(phi, action))
-        q_values = q_fun(self.action_space)
+        q_values = self.action_values(phi[self.feature_indices])
 
         best_q = np.max(q_values)
         max_indices = (q_values == best_q)
@@ -163,14 +160,14 @@ class Switch:
         self.t %= self.num_timesteps_explore
         if self.t > self.num_timesteps_explore:
             self.exploiter.update(*args, **kwargs)
-            rospy.loginfo(
+            loginfo(
                 'Greedy policy is the behaviour policy, no learning now')
             to_return = 'target_policy'
 
             self.last_index = self.exploiter.last_index
         else:
             self.explorer.update(*args, **kwargs)
-            rospy.loginfo('Explorer policy is the behaviour policy')
+            loginfo('Explorer policy is the behaviour policy')
             to_return = 'behavior_policy'
 
             self.last_index = self.explorer.last_index
@@ -183,9 +180,19 @@ class Switch:
             prob = self.explorer.get_probability(*args, **kwargs)
         return prob
 
-    def choose_action(self, *args, **kwargs):
+    def get_action_id(self, *args, **kwargs):
         if self.t > self.num_timesteps_explore:
-            action = self.exploiter.choose_action(*args, **kwargs)
+            index = self.exploiter.get_action_id(*args, **kwargs)
         else:
-            action = self.explorer.choose_action(*args, **kwargs)
-        return action
+            index = self.explorer.get_action_id(*args, **kwargs)
+        return index
+
+    def choose_action_id(self, *args, **kwargs):
+        if self.t > self.num_timesteps_explore:
+            self.last_index = self.exploiter.choose_action_id(*args, **kwargs)
+        else:
+            self.last_index = self.explorer.choose_action_id(*args, **kwargs)
+        return self.last_index
+
+    def choose_action(self, *args, **kwargs):
+        return self.action_space[self.choose_action_id(*args, **kwargs)]
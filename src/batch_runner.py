@@ -0,0 +1,243 @@
+"""Steps many simulated robots, each with its own learner, as one batch.
+
+A :py:class:`BatchRunner` drives a :py:class:`~simulator.TurtlebotBatch`
+the way :py:class:`~learning_foreground.LearningForeground` drives one
+robot: each step it builds every robot's state, lets a batched behavior
+policy choose every robot's action, updates every robot's learner with
+its last transition, and moves the robots one timestep. Observations,
+feature vectors, action selection and learner updates are computed for
+the whole batch in array operations rather than robot by robot, and
+simulated time does not wait for the wall clock.
+
+Batches are independent, so :py:func:`run_batches` spreads several of
+them over a process pool to use every core.
+
+Example::
+
+    def make_runner(seed):
+        robots = TurtlebotBatch(64, seed=seed)
+        learner = GTDBatch(64, **hyperparameters)
+        ...
+        return BatchRunner(robots, features_to_use, behavior_policy,
+                           target_policy, learner, cumulant, gamma,
+                           feature_indices)
+
+    results = run_batches(make_runner, num_batches=8, num_steps=5000)
+"""
+from __future__ import division
+
+import multiprocessing as mp
+import time
+
+import numpy as np
+
+from profiler import profiler
+from state_representation import StateManager
+
+
+class BatchRunner:
+    """Runs a batch of independent agents on simulated robots.
+
+    Args:
+        robots (TurtlebotBatch): The simulated robots, one per agent.
+        features_to_use (set of str): Feature groups of the state.
+        behavior_policy (BatchPolicy): Policy the robots follow.
+        target_policy (BatchPolicy): Policy the learners learn about.
+        learner: Batched learner, such as :py:class:`~gtd.GTDBatch`, with
+            one row of weights per agent.
+        cumulant (fun): Function of the batched observations that gives
+            each agent's cumulant.
+        gamma (fun): Function of the batched observations that gives
+            each agent's discount.
+        feature_indices (numpy array of int): Indices of the features the
+            learner uses.
+        time_scale (float): Simulated seconds per step.
+        state_manager (StateManager, optional): Tile coder shared by the
+            agents, so that they all see the same features.
+
+    Attributes:
+        steps (int): Number of steps taken.
+        cumulants (numpy array of float): Total cumulant of each agent.
+    """
+
+    # bumper constants from
+    # http://docs.ros.org/hydro/api/kobuki_msgs/html/msg/SensorState.html
+    BUMP_CODES = np.array([1, 4, 2])
+
+    def __init__(self,
+                 robots,
+                 features_to_use,
+                 behavior_policy,
+                 target_policy,
+                 learner,
+                 cumulant,
+                 gamma,
+                 feature_indices,
+                 time_scale=0.06,
+                 state_manager=None):
+        self.robots = robots
+        self.features_to_use = set(features_to_use)
+        self.behavior_policy = behavior_policy
+        self.target_policy = target_policy
+        self.learner = learner
+        self.cumulant = cumulant
+        self.gamma = gamma
+        self.feature_indices = feature_indices
+        self.time_scale = time_scale
+        self.state_manager = state_manager or StateManager(features_to_use)
+
+        # speeds of each action
+        action_space = behavior_policy.action_space
+        self.linear = np.array([action.linear.x for action in action_space])
+        self.angular = np.array([action.angular.z
+                                 for action in action_space])
+
+        # only the chosen pixels of each camera view are ray cast
+        self.pixel_rows, self.pixel_columns = np.nonzero(
+                self.state_manager.pixel_mask)
+        image_groups = {'image', 'cimage', 'pixel_pairs'}
+        self.uses_image = bool(self.features_to_use & image_groups)
+
+        # previous timestep information
+        self.last_phi = None
+        self.last_observations = None
+        self.last_action_ids = None
+        self.last_mu = None
+
+        self.steps = 0
+        self.cumulants = np.zeros(robots.num_robots)
+
+    def create_state(self):
+        """Builds every robot's feature vector and observations.
+
+        Returns:
+            (numpy array, dict): Feature vectors, one row per robot, and
+                a dictionary mapping each observation name to an array
+                with one entry per robot.
+        """
+        robots = self.robots
+
+        with profiler.stage('sensor_read'):
+            bump = (robots.bumper[:, np.newaxis] & self.BUMP_CODES) > 0
+            ir = robots.dock_ir()
+            imu = np.sin(robots.heading / 2)
+            odom = np.column_stack([robots.x, robots.y,
+                                    robots.linear, robots.angular])
+            pixels = None
+            if self.uses_image:
+                pixels = robots.camera_pixels(self.pixel_rows,
+                                              self.pixel_columns)
+
+        phi = self.state_manager.get_phi_batch(pixels, bump, ir, imu, odom)
+        if 'last_action' in self.features_to_use:
+            last_action = np.zeros((robots.num_robots,
+                                    self.linear.size), dtype=bool)
+            last_action[self.behavior_policy.agents,
+                        self.behavior_policy.last_index] = True
+            phi = np.hstack([phi, last_action])
+
+        observations = {'bump': bump.any(axis=1),
+                        'ir': ir,
+                        'charging': (robots.charger & 2) > 0,
+                        'speed': robots.angular,
+                        'imu': imu}
+        return phi, observations
+
+    def step(self):
+        """Steps every robot: observe, act, learn and move."""
+        phi_prime, observations = self.create_state()
+
+        with profiler.stage('policy'):
+            self.behavior_policy.update(phi_prime, observations)
+            action_ids = self.behavior_policy.choose_action_ids()
+            mu = self.behavior_policy.get_probabilities(action_ids)
+
+        cumulant = self.cumulant(observations)
+        if self.last_phi is not None:
+            with profiler.stage('target_policies'):
+                self.target_policy.update(self.last_phi,
+                                          self.last_observations)
+                rho = self.target_policy.get_probabilities(
+                        self.last_action_ids) / self.last_mu
+
+            with profiler.stage('learner'):
+                self.learner.update(
+                        phi=self.last_phi[:, self.feature_indices],
+                        phi_prime=phi_prime[:, self.feature_indices],
+                        cumulant=cumulant,
+                        gamma=self.gamma(observations),
+                        rho=rho)
+            self.cumulants += cumulant
+
+        self.last_phi = phi_prime
+        self.last_observations = observations
+        self.last_action_ids = action_ids
+        self.last_mu = mu
+
+        with profiler.stage('simulate'):
+            self.robots.step(self.linear[action_ids],
+                             self.angular[action_ids],
+                             self.time_scale)
+        self.steps += 1
+
+    def run(self, num_steps):
+        """Takes ``num_steps`` steps.
+
+        Returns:
+            dict: Number of steps, robot steps per second, total cumulant
+                of each agent and the final weights of each learner.
+        """
+        start_time = time.time()
+        for _ in range(num_steps):
+            self.step()
+        elapsed = time.time() - start_time
+
+        robot_steps = num_steps * self.robots.num_robots
+        return {'steps': num_steps,
+                'robots': self.robots.num_robots,
+                'seconds': elapsed,
+                'robot_steps_per_sec': robot_steps / elapsed if elapsed
+                                       else float('inf'),
+                'cumulants': self.cumulants,
+                'theta': self.learner.theta}
+
+
+def run_batch(args):
+    """Builds a runner with ``make_runner(seed)`` and runs it.
+
+    Args:
+        args (tuple): ``(make_runner, seed, num_steps)``, packed for
+            ``Pool.map``.
+
+    Returns:
+        dict: Results of :py:meth:`BatchRunner.run`.
+    """
+    make_runner, seed, num_steps = args
+    np.random.seed(seed)
+    return make_runner(seed).run(num_steps)
+
+
+def run_batches(make_runner, num_batches, num_steps, processes=None):
+    """Runs independent batches in a process pool.
+
+    Args:
+        make_runner (fun): Module level function of a seed that builds a
+            :py:class:`BatchRunner`. It is sent to the worker processes,
+            so it has to be picklable.
+        num_batches (int): Number of batches to run. Batch ``i`` is built
+            with seed ``i``.
+        num_steps (int): Steps to take in each batch.
+        processes (int, optional): Number of worker processes; defaults
+            to the number of cores.
+
+    Returns:
+        list of dict: Results of each batch, in seed order.
+    """
+    pool = mp.Pool(processes)
+    try:
+        return pool.map(run_batch,
+                        [(make_runner, seed, num_steps)
+                         for seed in range(num_batches)])
+    finally:
+        pool.close()
+        pool.join()
@@ -0,0 +1,578 @@
+"""End-to-end throughput benchmark of the example agents.
+
+Runs the learning loops of :doc:`wall_demo_example` (GTD on image
+features), :doc:`align_ir_example` (GreedyGQ on imu, ir and last action
+features) and :doc:`calculate_return_example` (return calculation) for a
+fixed number of timesteps on a :py:class:`~transport.LocalTransport`, so
+the loops never sleep. Sensor data comes from a
+:py:class:`~simulator.SimulatedRobot`, driving either the synthetic
+:py:class:`~simulator.TurtlebotSimulator` or a
+:py:class:`~simulator.RecordedTurtlebot` replaying a :doc:`recorder`
+recording.
+
+For each configuration it reports the startup time, timesteps per
+second, the :doc:`profiler` latency summary of every stage, the peak
+resident set size and the memory retained while running: traced by
+``tracemalloc`` where it is available (Python 3), and otherwise estimated
+from the growth of the number of objects the garbage collector tracks
+and of the resident set size. Results are written as JSON; given a
+baseline written by an earlier run, any configuration that got slower or
+bigger by more than the tolerance is reported and the script exits with
+status 1. It does the same if a configuration takes longer to start than
+its target in :py:data:`STARTUP_TARGETS`.
+
+Each configuration runs in its own process, so that peak memory and the
+profiler are not shared between them.
+
+Example::
+
+    python benchmark.py --steps 2000 --save-baseline baseline.json
+    python benchmark.py --steps 2000 --baseline baseline.json \\
+        --output results.json
+"""
+from __future__ import division, print_function
+
+import argparse
+import gc
+import json
+import multiprocessing as mp
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+import traceback
+
+import numpy as np
+
+from profiler import profiler
+from transport import LocalTransport
+
+CONFIGS = ['wall_demo', 'align_ir', 'return_calculation']
+
+""" metrics compared against the baseline, mapped to whether larger values
+are better
+"""
+REGRESSION_METRICS = {'steps_per_sec': True,
+                      'step_p95': False,
+                      'peak_rss_kb': False,
+                      'startup_seconds': False,
+                      }
+
+""" seconds each configuration may take to start: to import its modules,
+which none of the configurations run before, and to build its loop and
+simulated robot
+"""
+STARTUP_TARGETS = {'wall_demo': 2.0,
+                   'align_ir': 2.0,
+                   'return_calculation': 2.0,
+                   }
+
+
+def wall_demo(transport):
+    """Builds the learning loop of :doc:`wall_demo_example`."""
+    from geometry_msgs.msg import Twist, Vector3
+
+    from gtd import GTD
+    from gvf import GVF
+    from learning_foreground import LearningForeground
+    from state_representation import StateConstants
+    from wall_demo_example import GoForward, PavlovSoftmax
+
+    time_scale = 0.06
+    action_space = np.array([Twist(Vector3(0.2, 0, 0), Vector3(0, 0, 0)),
+                             Twist(Vector3(0, 0, 0),
+                                   Vector3(0, 0, 25. / 9))])
+    alpha0 = 0.05
+    discount = 0.97
+
+    features_to_use = {'image', 'bias'}
+    feature_indices = np.concatenate(
+            [StateConstants.indices_in_phi[f] for f in features_to_use])
+    num_active_features = sum(
+            StateConstants.num_active_features[f] for f in features_to_use)
+
+    hyperparameters = {'alpha': alpha0 / num_active_features,
+                       'beta': alpha0 / 1000 / num_active_features,
+                       'lmbda': 0.9,
+                       'alpha0': alpha0,
+                       'num_features': feature_indices.size,
+                       'feature_indices': feature_indices,
+                       }
+    learner = GTD(**hyperparameters)
+    behavior_policy = PavlovSoftmax(action_space=action_space,
+                                    feature_indices=feature_indices,
+                                    value_function=learner.predict,
+                                    time_scale=time_scale)
+    distance_to_bump = GVF(
+            cumulant=lambda obs: int(obs['bump']) if obs is not None else 0,
+            gamma=lambda obs: 0 if obs['bump'] else discount,
+            target_policy=GoForward(action_space=action_space,
+                                    fwd_action_index=0),
+            learner=learner,
+            name='DistanceToBump',
+            **hyperparameters)
+
+    return LearningForeground(time_scale,
+                              [distance_to_bump],
+                              features_to_use,
+                              behavior_policy,
+                              ['cumulant', 'prediction'],
+                              transport=transport)
+
+
+def align_ir(transport):
+    """Builds the learning loop of :doc:`align_ir_example`."""
+    from geometry_msgs.msg import Twist, Vector3
+
+    from auto_docking_policies import EGreedy
+    from greedy_gq import GreedyGQ
+    from gvf import GVF
+    from learning_foreground import LearningForeground
+    from state_representation import StateConstants
+
+    time_scale = 0.3
+    features_to_use = ['imu', 'bias', 'ir', 'last_action']
+    feature_indices = np.concatenate(
+            [StateConstants.indices_in_phi[f] for f in features_to_use])
+    num_features = feature_indices.size
+    num_active_features = sum(
+            StateConstants.num_active_features[f] for f in features_to_use)
+    alpha = 0.1 / num_active_features
+
+    action_space = np.array([Twist(Vector3(0, 0, 0), Vector3(0, 0, 0.3)),
+                             Twist(Vector3(0, 0, 0), Vector3(0, 0, -0.3))])
+
+    def cumulant(observation):
+        ir_data_center = observation['ir'][1]
+        return 1 if ir_data_center & 2 or ir_data_center & 8 else 0
+
+    def reset_episode():
+        random_action = random.choice(action_space)
+        return [random_action for i in range(random.randint(1, 80))]
+
+    learner = GreedyGQ(alpha=alpha,
+                       beta=alpha / 10,
+                       lmbda=0.9,
+                       num_features=num_features * action_space.size,
+                       action_space=action_space,
+                       finished_episode=lambda cum: cum == 1)
+    target_policy = EGreedy(epsilon=0,
+                            feature_indices=feature_indices,
+                            action_space=action_space,
+                            value_function=learner.predict)
+    behavior_gvf = GVF(num_features=num_features * action_space.size,
+                       gamma=lambda observation: 0.9,
+                       cumulant=cumulant,
+                       learner=learner,
+                       target_policy=target_policy,
+                       name='auto_docking',
+                       feature_indices=feature_indices,
+                       alpha=alpha,
+                       beta=0.01 * alpha,
+                       lmbda=0.9,
+                       alpha0=0.1)
+    behavior_policy = EGreedy(epsilon=0.1,
+                              value_function=learner.predict,
+                              action_space=action_space,
+                              feature_indices=feature_indices)
+
+    return LearningForeground(time_scale,
+                              [behavior_gvf],
+                              features_to_use,
+                              behavior_policy,
+                              ['cumulant', 'prediction'],
+                              control_gvf=behavior_gvf,
+                              reset_episode=reset_episode,
+                              transport=transport)
+
+
+def return_calculation(transport):
+    """Builds the loop of :doc:`calculate_return_example`."""
+    from geometry_msgs.msg import Twist, Vector3
+
+    from calculate_return_example import GoForwardIfNotBump, TurnIfBump
+    from gvf import GVF
+    from return_calculator import ReturnCalculator
+    from state_representation import StateConstants
+
+    time_scale = 0.2
+    features_to_use = ['image', 'bias']
+    feature_indices = np.concatenate(
+            [StateConstants.indices_in_phi[f] for f in features_to_use])
+    num_features = feature_indices.size
+
+    def bumped(observations):
+        return bool(np.any(observations['bump']))
+
+    action_space = np.array([Twist(Vector3(0, 0, 0), Vector3(0, 0, 0)),
+                             Twist(Vector3(0.2, 0, 0), Vector3(0, 0, 0)),
+                             Twist(Vector3(0, 0, 0), Vector3(0, 0, 1.0))])
+    distance_to_bump = GVF(cumulant=lambda obs: int(bumped(obs)),
+                           gamma=lambda obs: 0 if bumped(obs) else 0.9,
+                           target_policy=None,
+                           num_features=num_features,
+                           learner=None,
+                           name='DistanceToBump',
+                           feature_indices=feature_indices,
+                           alpha=0,
+                           alpha0=0,
+                           lmbda=0)
+    behavior_policy = TurnIfBump(turn_repeat_percentage=0.5,
+                                 action_space=action_space,
+                                 feature_indices=feature_indices)
+    target_policy = GoForwardIfNotBump(action_space=action_space,
+                                       feature_indices=feature_indices)
+
+    return ReturnCalculator(time_scale,
+                            distance_to_bump,
+                            num_features,
+                            features_to_use,
+                            behavior_policy,
+                            target_policy,
+                            transport=transport)
+
+
+class TimedRate:
+    """Wraps a loop's rate to time the work between its sleeps.
+
+    On a local transport the loop's sleep is where the simulated robot
+    drives and publishes, so the time spent in it is recorded as the
+    ``simulate`` stage, and the time between sleeps as the ``tick``
+    stage.
+    """
+
+    def __init__(self, rate):
+        self.rate = rate
+        self.last_wake = time.time()
+
+    def sleep(self):
+        start = time.time()
+        profiler.record('tick', start - self.last_wake)
+        result = self.rate.sleep()
+        self.last_wake = time.time()
+        profiler.record('simulate', self.last_wake - start)
+        return result
+
+    def __getattr__(self, name):
+        return getattr(self.rate, name)
+
+
+def make_loop(config, num_steps, stream, recording=None, seed=0):
+    """Builds a configuration's loop on a simulated robot.
+
+    Args:
+        config (str): One of :py:data:`CONFIGS`.
+        num_steps (int): Number of timesteps to run before shutting down.
+        stream (str): ``'synthetic'`` or ``'recorded'``.
+        recording (str, optional): Path prefix of the recording to replay.
+        seed (int): Seed of the random number generators.
+
+    Returns:
+        The loop, ready to :py:meth:`run`.
+    """
+    from simulator import (RecordedTurtlebot, SimulatedRobot,
+                           TurtlebotSimulator)
+
+    random.seed(seed)
+    np.random.seed(seed)
+
+    transport = LocalTransport()
+    loop = globals()[config](transport)
+    transport.max_time = num_steps * loop.time_scale
+    loop.r = TimedRate(loop.r)
+
+    if stream == 'recorded':
+        simulator = RecordedTurtlebot(recording)
+        simulator.pixel_mask = loop.state_manager.pixel_mask
+    else:
+        simulator = TurtlebotSimulator(seed=seed)
+    loop.robot = SimulatedRobot(transport, loop.recent.keys(), simulator)
+    return loop
+
+
+def peak_rss_kb():
+    """Peak resident set size of this process in kilobytes."""
+    import resource
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # bytes on OS X, kilobytes elsewhere
+    return peak // 1024 if sys.platform == 'darwin' else peak
+
+
+def rss_kb():
+    """Current resident set size of this process in kilobytes, or
+    ``None`` where ``/proc`` is not available.
+    """
+    try:
+        with open('/proc/self/statm') as f:
+            pages = int(f.read().split()[1])
+    except (IOError, OSError):
+        return None
+    return pages * os.sysconf('SC_PAGE_SIZE') // 1024
+
+
+def count_allocations(loop):
+    """Estimates the memory a loop retains without ``tracemalloc``.
+
+    Counts the objects tracked by the garbage collector, which include
+    every container but not e.g. floats or numpy arrays, and measures
+    the resident set size, which also grows with numpy buffers.
+
+    Returns:
+        dict: Objects and kilobytes of RSS gained per timestep.
+    """
+    gc.collect()
+    objects_before = len(gc.get_objects())
+    rss_before = rss_kb()
+    loop.run()
+    gc.collect()
+    objects_after = len(gc.get_objects())
+    rss_after = rss_kb()
+
+    steps = max(loop.r.ticks, 1)
+    rss_growth = None
+    if rss_before is not None:
+        rss_growth = (rss_after - rss_before) / steps
+    return {'method': 'gc',
+            'steps': loop.r.ticks,
+            'retained_objects_per_step':
+                (objects_after - objects_before) / steps,
+            'rss_growth_kb_per_step': rss_growth}
+
+
+def measure_allocations(config, num_steps, stream, recording):
+    """Measures the memory allocated while a fresh loop runs.
+
+    Returns:
+        dict: Peak traced bytes, and bytes and blocks still allocated
+            per timestep afterwards, or the estimates of
+            :py:func:`count_allocations` if ``tracemalloc`` is not
+            available.
+    """
+    loop = make_loop(config, num_steps, stream, recording)
+    try:
+        import tracemalloc
+    except ImportError:
+        return count_allocations(loop)
+
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    loop.run()
+    after = tracemalloc.take_snapshot()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    steps = max(loop.r.ticks, 1)
+    differences = after.compare_to(before, 'filename')
+    return {'method': 'tracemalloc',
+            'steps': loop.r.ticks,
+            'peak_bytes': peak,
+            'retained_bytes_per_step':
+                sum(d.size_diff for d in differences) / steps,
+            'retained_blocks_per_step':
+                sum(d.count_diff for d in differences) / steps}
+
+
+def benchmark(config, num_steps, stream, recording=None,
+              allocation_steps=0):
+    """Runs one configuration and measures it.
+
+    Returns:
+        dict: Seconds to start, timesteps, seconds, timesteps per second,
+            95th percentile timestep latency, latency summary of each
+            stage, peak RSS and allocations.
+    """
+    start_time = time.time()
+    loop = make_loop(config, num_steps, stream, recording)
+    startup = time.time() - start_time
+
+    profiler.enable(deadline=loop.time_scale,
+                    report_every=sys.maxsize,
+                    path=None)
+
+    start_time = time.time()
+    loop.run()
+    elapsed = time.time() - start_time
+
+    stages = profiler.summary()
+    profiler.disable()
+    # the return calculator does not time its whole timestep
+    step = stages.get('step', stages['tick'])
+
+    allocations = None
+    if allocation_steps:
+        allocations = measure_allocations(config,
+                                          allocation_steps,
+                                          stream,
+                                          recording)
+
+    return {'config': config,
+            'stream': stream,
+            'startup_seconds': startup,
+            'steps': loop.r.ticks,
+            'seconds': elapsed,
+            'steps_per_sec': loop.r.ticks / elapsed if elapsed
+                             else float('inf'),
+            'step_p95': step['p95'],
+            'stages': stages,
+            'peak_rss_kb': peak_rss_kb(),
+            'allocations': allocations}
+
+
+def run_in_process(args, connection):
+    """Runs :py:func:`benchmark` and sends back its result.
+
+    The return calculation writes its samples to the working directory,
+    so every configuration runs in a temporary one.
+    """
+    directory = tempfile.mkdtemp(prefix='benchmark_')
+    os.chdir(directory)
+    try:
+        connection.send(benchmark(*args))
+    except Exception:
+        connection.send({'config': args[0],
+                         'error': traceback.format_exc()})
+    finally:
+        connection.close()
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def run_config(config, num_steps, stream, recording, allocation_steps):
+    """Benchmarks a configuration in a process of its own."""
+    receiver, sender = mp.Pipe(duplex=False)
+    process = mp.Process(target=run_in_process,
+                         name='benchmark_' + config,
+                         args=((config, num_steps, stream, recording,
+                                allocation_steps),
+                               sender))
+    process.start()
+    result = receiver.recv()
+    process.join()
+    return result
+
+
+def find_regressions(results, baseline, tolerance):
+    """Compares results with a baseline.
+
+    Args:
+        results (dict): Maps configurations to their results.
+        baseline (dict): Results of an earlier run, in the same form.
+        tolerance (float): Fraction by which a metric may get worse.
+
+    Returns:
+        list of str: Description of each metric that got worse by more
+            than ``tolerance``.
+    """
+    regressions = []
+    for config, result in sorted(results.items()):
+        if config not in baseline or 'error' in result:
+            continue
+        for metric, larger_is_better in sorted(REGRESSION_METRICS.items()):
+            old = baseline[config].get(metric)
+            new = result.get(metric)
+            if not old or new is None:
+                continue
+            change = (new - old) / old
+            if larger_is_better:
+                change = -change
+            if change > tolerance:
+                regressions.append('{}: {} {:.4g} -> {:.4g} ({:+.1%})'.format(
+                        config, metric, old, new, (new - old) / old))
+    return regressions
+
+
+def slow_startups(results):
+    """Lists the configurations that missed their startup target.
+
+    Returns:
+        list of str: Each configuration that took longer to start than
+            its target in :py:data:`STARTUP_TARGETS`.
+    """
+    slow = []
+    for config, result in sorted(results.items()):
+        if 'error' in result:
+            continue
+        target = STARTUP_TARGETS[config]
+        if result['startup_seconds'] > target:
+            slow.append('{}: {:.2f} sec, target {:.2f} sec'.format(
+                    config, result['startup_seconds'], target))
+    return slow
+
+
+def print_results(results):
+    row = '{:<20}{:>12}{:>12}{:>14}{:>14}{:>14}'
+    print(row.format('config', 'startup s', 'steps', 'steps/sec',
+                     'p95 step ms', 'peak RSS MB'))
+    for config, result in sorted(results.items()):
+        if 'error' in result:
+            print('{:<20}{}'.format(config, result['error']))
+            continue
+        print(row.format(config,
+                         '{:.2f}'.format(result['startup_seconds']),
+                         result['steps'],
+                         '{:.1f}'.format(result['steps_per_sec']),
+                         '{:.2f}'.format(1000 * result['step_p95']),
+                         '{:.1f}'.format(result['peak_rss_kb'] / 1024)))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+            description='Benchmarks the example learning loops.')
+    parser.add_argument('--configs', nargs='+', choices=CONFIGS,
+                        default=CONFIGS)
+    parser.add_argument('--steps', type=int, default=1000,
+                        help='timesteps to run each configuration for')
+    parser.add_argument('--stream', choices=['synthetic', 'recorded'],
+                        default='synthetic')
+    parser.add_argument('--recording',
+                        help='path prefix of the recording to replay')
+    parser.add_argument('--allocation-steps', type=int, default=100,
+                        help='timesteps to trace allocations for; 0 skips')
+    parser.add_argument('--output', help='file to write the results to')
+    parser.add_argument('--baseline', help='results to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.1,
+                        help='fraction a metric may get worse by')
+    parser.add_argument('--save-baseline',
+                        help='file to write the results to as a baseline')
+    args = parser.parse_args(argv)
+
+    if args.stream == 'recorded' and not args.recording:
+        parser.error('--stream recorded needs --recording')
+    recording = args.recording and os.path.abspath(args.recording)
+
+    results = {}
+    for config in args.configs:
+        results[config] = run_config(config,
+                                     args.steps,
+                                     args.stream,
+                                     recording,
+                                     args.allocation_steps)
+    print_results(results)
+
+    for path in [args.output, args.save_baseline]:
+        if path:
+            with open(path, 'w') as f:
+                json.dump(results, f, indent=2, sort_keys=True)
+
+    status = 0
+    slow = slow_startups(results)
+    for startup in slow:
+        print('SLOW STARTUP ' + startup)
+    if slow:
+        status = 1
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = find_regressions(results, baseline, args.tolerance)
+        for regression in regressions:
+            print('REGRESSION ' + regression)
+        if regressions:
+            status = 1
+    return status
+
+
+if __name__ == '__main__':
+    sys.exit(main())
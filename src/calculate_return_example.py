@@ -3,7 +3,6 @@ from __future__ import division
 import multiprocessing as mp
 
 import numpy as np
-import rospy
 from geometry_msgs.msg import Twist, Vector3
 
 from action_manager import start_action_manager
@@ -11,6 +10,7 @@ from gvf import GVF
 from policy import Policy
 from return_calculator import start_return_calculator
 from state_representation import StateConstants
+from transport import ROSInterruptException, loginfo
 
 
 # go forward with probability 0.9 and left with probability 0.1
@@ -151,7 +151,7 @@ if __name__ == "__main__":
                                num_features=num_features,
                                learner=None,
                                name='DistanceToBump',
-                               logger=rospy.loginfo,
+                               logger=loginfo,
                                feature_indices=feature_indices,
                                **parameters)
 
@@ -189,8 +189,8 @@ if __name__ == "__main__":
 
 
 
-    except rospy.ROSInterruptException as detail:
-        rospy.loginfo("Handling: {}".format(detail))
+    except ROSInterruptException as detail:
+        loginfo("Handling: {}".format(detail))
     finally:
         try:
             return_calculator_process.join()
@@ -5,6 +5,8 @@ Authors:
 """
 import numpy as np
 
+from return_samples import load_return_samples
+
 
 class Evaluator:
     """Collects measurements of an agent's performance
@@ -27,10 +29,8 @@ class Evaluator:
 
         # load the state representation and actual return for sample states
         if use_MSRE:
-            data = np.load("actual_return_" + gvf_name + ".npz")
-            self.samples_phi = data["samples"]
-            self.samples_G = data["_return"]
-            self.sample_size = data["sample_size"]
+            self.samples = load_return_samples(gvf_name)
+            self.sample_size = len(self.samples)
 
         # # initialize the preformance measures
         self.MSRE = 0.0
@@ -58,12 +58,8 @@ class Evaluator:
         self.compute_IS_ess(*args, **kwargs)
 
     def compute_MSRE(self, theta, time_step, *args, **kwargs):
-        return_error = 0.0
-        for i, phi in enumerate(self.samples_phi):
-            estimated_value = np.dot(theta, phi)
-            return_error = return_error + (estimated_value - self.samples_G[
-                i]) * (estimated_value - self.samples_G[i])
-        MSRE = np.sqrt(return_error / self.sample_size)
+        errors = self.samples.predict(theta) - self.samples.returns
+        MSRE = np.sqrt(np.dot(errors, errors) / self.sample_size)
         self.MSRE = MSRE
         self.MSRE_over_time[time_step] = MSRE
         if time_step % 10 == 0.0:
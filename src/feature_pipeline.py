@@ -0,0 +1,182 @@
+"""Builds the image feature groups of phi in separate processes.
+
+Tile coding the chosen pixels and pixel pairs is CPU-bound and would
+otherwise run on the same core as learning. A :py:class:`FeaturePipeline`
+starts one :py:class:`FeatureProducer` process per image feature group.
+Each step the foreground writes the chosen pixels into shared memory, and
+every producer writes the active indices of its group into its own
+:py:class:`SharedIndices`.
+
+The foreground waits for the producers before it builds phi, since the
+learners need phi of the current step. Tile coding therefore only
+overlaps with learning when learning runs on a worker thread
+(``pipeline=True`` in :py:class:`~learning_foreground.LearningForeground`):
+the producers code step t while the worker learns from step t - 1.
+Without it, the producers only take the tile coding off the foreground's
+core and split the groups between two processes.
+"""
+from __future__ import division
+
+import multiprocessing as mp
+
+import numpy as np
+
+from state_representation import StateConstants
+
+
+class SharedIndices:
+    """Active indices of one feature group in shared memory.
+
+    Args:
+        max_active (int): Maximum number of active indices.
+    """
+
+    def __init__(self, max_active):
+        self.max_active = max_active
+
+        self._indices = mp.RawArray('i', max_active)
+        self._count = mp.RawValue('i', 0)
+        self._step = mp.RawValue('l', -1)
+
+    def write(self, step, indices):
+        """Stores the active indices computed for ``step``."""
+        count = len(indices)
+        assert count <= self.max_active
+
+        np.frombuffer(self._indices, dtype=np.int32)[:count] = indices
+        self._count.value = count
+        self._step.value = step
+
+    def read(self, step):
+        """Gets a copy of the active indices computed for ``step``.
+
+        Returns:
+            numpy array of int, or ``None`` if the indices stored are
+                not those of ``step``.
+        """
+        if self._step.value != step:
+            return None
+
+        view = np.frombuffer(self._indices, dtype=np.int32)
+        return view[:self._count.value].copy()
+
+
+class FeatureProducer(mp.Process):
+    """Process that tile codes one feature group on request.
+
+    The process is forked from the foreground, so it inherits the
+    ``state_manager`` with its pixel mask and collision tables. From then
+    on its copy of the group's collision tables is the only one in use.
+
+    Args:
+        group (str): Feature group to compute, ``'image'`` or
+            ``'pixel_pairs'``.
+        state_manager (StateManager): State manager of the foreground.
+        pixels (multiprocessing RawArray): Shared chosen pixels.
+        step (multiprocessing RawValue): Shared step of ``pixels``.
+    """
+
+    def __init__(self, group, state_manager, pixels, step):
+        mp.Process.__init__(self, name='{}_features'.format(group))
+        self.daemon = True
+
+        self.group = group
+        self.state_manager = state_manager
+        self.pixels = pixels
+        self.step = step
+
+        self.indices = SharedIndices(
+                StateConstants.num_active_features[group])
+        self.requested = mp.Event()
+        self.done = mp.Event()
+
+    def run(self):
+        if self.group == 'pixel_pairs':
+            compute = self.state_manager.pixel_pair_indices
+        else:
+            compute = self.state_manager.image_indices
+
+        pixels = np.frombuffer(self.pixels).reshape(
+                -1, StateConstants.CHANNELS)
+        while True:
+            self.requested.wait()
+            self.requested.clear()
+            self.indices.write(self.step.value, compute(pixels.copy()))
+            self.done.set()
+
+
+class FeaturePipeline:
+    """Computes the image feature groups of phi in producer processes.
+
+    Args:
+        state_manager (StateManager): State manager whose image groups
+            should be moved to producer processes.
+        timeout (float): Seconds to wait for a producer before checking
+            that it is still alive.
+
+    Attributes:
+        producers (list of FeatureProducer): One producer per image
+            feature group in use.
+        step (int): Number of steps computed so far.
+    """
+
+    def __init__(self, state_manager, timeout=1.0):
+        self.state_manager = state_manager
+        self.timeout = timeout
+
+        num_values = StateConstants.NUM_RANDOM_POINTS * StateConstants.CHANNELS
+        self.pixels = mp.RawArray('d', num_values)
+        self.shared_step = mp.RawValue('l', -1)
+        self.step = 0
+
+        features = state_manager.features_to_use
+        groups = []
+        if features & {'image', 'cimage'}:
+            groups.append('image')
+        if 'pixel_pairs' in features:
+            groups.append('pixel_pairs')
+
+        self.producers = [FeatureProducer(group,
+                                          state_manager,
+                                          self.pixels,
+                                          self.shared_step)
+                          for group in groups]
+        for producer in self.producers:
+            producer.start()
+
+    def compute(self, image):
+        """Computes the active indices of each image feature group.
+
+        Args:
+            image (numpy array): Newest image, or ``None``.
+
+        Returns:
+            dict: Maps each feature group to its active indices, in the
+                form expected by the ``active`` argument of
+                :py:meth:`~state_representation.StateManager.get_phi`.
+        """
+        if not self.producers:
+            return {}
+
+        pixels = self.state_manager.masked_pixels(image)
+        np.frombuffer(self.pixels)[:] = pixels.ravel()
+        self.shared_step.value = self.step
+
+        for producer in self.producers:
+            producer.requested.set()
+
+        active = {}
+        for producer in self.producers:
+            while not producer.done.wait(self.timeout):
+                if not producer.is_alive():
+                    raise RuntimeError(
+                            "Feature producer {} died.".format(producer.name))
+            producer.done.clear()
+            active[producer.group] = producer.indices.read(self.step)
+
+        self.step += 1
+        return active
+
+    def close(self):
+        for producer in self.producers:
+            producer.terminate()
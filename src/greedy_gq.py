@@ -13,9 +13,9 @@ import pickle
 import random
 
 import numpy as np
-import rospy
 
 import tools
+from transport import loginfo, logwarn
 
 
 class GreedyGQ:
@@ -58,6 +58,7 @@ class GreedyGQ:
         self.beta = tools.decay(beta) if decay else tools.constant(beta)
         self.num_features = num_features
         self.action_space = action_space
+        self.action_ids = range(len(action_space))
         self.finished_episode = finished_episode
 
         # learning 
@@ -89,20 +90,45 @@ class GreedyGQ:
 
         Args:
             phi (numpy array of bool): Boolean feature vector.
-            action (action): Action that was taken.
+            action (action or int): Action that was taken, or its index
+                in ``action_space``.
         """
         if action is not None:
             q = np.dot(self.get_state_action(phi, action), self.theta)
         else:
             # get average value of actions
-            def get_a_phi(actn):
-                return self.get_state_action(phi, actn)
-
-            dot_fun = np.vectorize(lambda a: np.dot(get_a_phi(a), self.theta))
-            q = np.mean(dot_fun(self.action_space))
+            q = np.mean(self.q_all(phi))
 
         return q
 
+    def q_all(self, phi):
+        """Computes the value of every action in a single product.
+
+        The state-action representation places ``phi`` in the block of
+        the chosen action, so each action value is the dot product of
+        ``phi`` with that action's block of ``theta``.
+
+        Args:
+            phi (numpy array of bool): Boolean feature vector.
+
+        Returns:
+            numpy array of float: Value of each action in
+                ``action_space``.
+        """
+        return np.dot(self.theta.reshape(len(self.action_ids), -1), phi)
+
+    def greedy_action(self, phi):
+        """Finds the greedy action, breaking ties towards later actions.
+
+        Args:
+            phi (numpy array of bool): Boolean feature vector.
+
+        Returns:
+            int: Index in ``action_space`` of the greedy action.
+        """
+        q = self.q_all(phi)
+        return int(q.size - 1 - np.argmax(q[::-1]))
+
     def update(self,
                phi,
                last_action,
@@ -119,7 +145,8 @@ class GreedyGQ:
 
         Parameters:
             phi (numpy array of bool): State at time t.
-            last_action (action): Action at time t.
+            last_action (int): Index in ``action_space`` of the action
+                at time t.
             phi_prime (numpy array of bool): State at time t+1.
             cumulant (float): Cumulant at time t.
             gamma (float): Discounting factor at time t+1.
@@ -154,48 +181,29 @@ class GreedyGQ:
 
         self.action_phi = self.get_state_action(phi, last_action)
 
-        action_phi_primes = {
-            temp_action: self.get_state_action(phi_prime, temp_action) for
-            temp_action in self.action_space}
-
-        action_phis = {
-            temp_action: self.get_state_action(phi, temp_action) for
-            temp_action in self.action_space}
-
         # A_{t+1} update
-        next_greedy_action = last_action
-        for temp_action in self.action_space:
-            if np.dot(self.theta,
-                      action_phi_primes[temp_action]) >= np.dot(
-                    self.theta, action_phi_primes[next_greedy_action]):
-                next_greedy_action = temp_action
+        next_greedy_action = self.greedy_action(phi_prime)
 
         # action_phi_bar update
-        action_phi_bar = action_phi_primes[next_greedy_action]
+        action_phi_bar = self.get_state_action(phi_prime, next_greedy_action)
 
         # delta_t update
         self.delta = cumulant + gamma * np.dot(self.theta,
                                                action_phi_bar) - np.dot(
                 self.theta, self.action_phi)
 
-        previous_greedy_action = last_action
-        for temp_action in self.action_space:
-            if np.dot(self.theta, action_phis[temp_action]) >= np.dot(
-                    self.theta, action_phis[previous_greedy_action]):
-                previous_greedy_action = temp_action
-
         if np.count_nonzero(self.theta) == 0:
-            rospy.logwarn('self.theta in greedy_gq is zero')
+            logwarn('self.theta in greedy_gq is zero')
 
         if np.count_nonzero(self.action_phi) == 0:
-            rospy.logwarn('self.action_phi in greedy_gq is zero')
+            logwarn('self.action_phi in greedy_gq is zero')
 
         # e_t update
         self.e *= self.last_gamma * self.lmbda * rho
         self.e += self.action_phi  # (phi_t)
 
         if np.count_nonzero(self.e) == 0:
-            rospy.logwarn('self.e in greedy_gq is zero')
+            logwarn('self.e in greedy_gq is zero')
 
         # theta_t update
         self.theta += self.alpha.next() * (self.delta * self.e - self.last_gamma *
@@ -234,7 +242,7 @@ class GreedyGQ:
                     pickle.dump(self.average_td_errors, f)
 
             if self.finished_episode(cumulant):
-                rospy.loginfo('Episode finished')
+                loginfo('Episode finished')
                 self.episode_finished_last_step = True
                 self.num_episodes += 1
                 self.e = np.zeros(self.num_features)
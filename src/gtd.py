@@ -62,3 +62,88 @@ class GTD:
 
     def predict(self, phi):
         return np.dot(phi, self.theta)
+
+
+class GTDBatch:
+    """GTD(lambda) for many independent agents at once.
+
+    Each row of the weight and trace arrays belongs to one agent, and
+    updating the batch is the same as updating one :py:class:`GTD` per
+    agent with that agent's row of every argument.
+
+    Args:
+        num_agents (int): Number of agents.
+        num_features (int): Length of each agent's weight vectors.
+        alpha (float): Primary learning rate.
+        beta (float): Secondary learning rate.
+        lmbda (float): Trace decay rate.
+        decay (bool, optional): Whether to decay alpha and beta.
+
+    Attributes:
+        theta: Primary weights, one row per agent.
+        w: Secondary weights, one row per agent.
+        e: Eligibility traces, one row per agent.
+        old_gamma: Discount of each agent from the previous timestep.
+        delta: TD-error of each agent from the previous timestep.
+        tderr_elig: delta * e of each agent.
+    """
+
+    def __init__(self,
+                 num_agents,
+                 num_features,
+                 alpha,
+                 beta,
+                 lmbda,
+                 decay=False,
+                 **kwargs):
+        self.theta = np.zeros((num_agents, num_features))
+        self.w = np.zeros((num_agents, num_features))
+        self.e = np.zeros((num_agents, num_features))
+
+        self.alpha = tools.decay(alpha) if decay else tools.constant(alpha)
+        self.beta = tools.decay(beta) if decay else tools.constant(beta)
+        self.lmbda = lmbda
+        self.old_gamma = np.zeros(num_agents)
+        self.delta = np.zeros(num_agents)
+        self.tderr_elig = np.zeros((num_agents, num_features))
+
+    def update(self, phi, phi_prime, cumulant, gamma, rho, **kwargs):
+        """Updates every agent with its row of each argument.
+
+        Args:
+            phi (numpy array): Feature vectors, one row per agent.
+            phi_prime (numpy array): Next feature vectors.
+            cumulant (numpy array of float): Cumulant of each agent.
+            gamma (numpy array of float): Discount of each agent.
+            rho (numpy array of float): Importance sampling ratio of each
+                agent.
+        """
+        phi = np.asarray(phi, dtype=float)
+        phi_prime = np.asarray(phi_prime, dtype=float)
+        gamma = np.asarray(gamma, dtype=float)
+
+        self.delta = (cumulant + gamma * rowdot(phi_prime, self.theta) -
+                      rowdot(phi, self.theta))
+
+        self.e *= (self.lmbda * self.old_gamma)[:, np.newaxis]
+        self.e += phi
+        self.e *= np.asarray(rho, dtype=float)[:, np.newaxis]
+        np.multiply(self.delta[:, np.newaxis], self.e, out=self.tderr_elig)
+
+        correction = gamma * (1 - self.lmbda) * rowdot(self.e, self.w)
+        self.theta += self.alpha.next() * (
+                self.tderr_elig - correction[:, np.newaxis] * phi_prime)
+        self.w += self.beta.next() * (
+                self.tderr_elig - rowdot(phi, self.w)[:, np.newaxis] * phi)
+
+        self.old_gamma = gamma
+
+        return phi
+
+    def predict(self, phi):
+        return rowdot(np.asarray(phi, dtype=float), self.theta)
+
+
+def rowdot(a, b):
+    """Dot product of each row of ``a`` with the same row of ``b``."""
+    return np.einsum('ij,ij->i', a, b)
@@ -7,6 +7,7 @@ from __future__ import division
 import numpy as np
 
 from evaluator import Evaluator
+from profiler import profiler
 
 
 class GVF:
@@ -31,7 +32,19 @@ class GVF:
             example, GTD.
         feature_indices (numpy array of bool): Indices of the features to use.
         use_MSRE (bool): Whether or not to calculate MSRE.
+        priority (float): Importance of the GVF's updates relative to
+            other GVFs when a timestep runs short of time (see
+            :doc:`gvf_scheduler`). Higher is more important.
+        update_period (int): Number of timesteps between updates when
+            scheduled by a :py:class:`~gvf_scheduler.GVFScheduler`.
+
+    Attributes:
+        TRACES (list of str): Eligibility trace attributes a learner may
+            have, cleared by :py:meth:`reset_trace`.
     """
+
+    TRACES = ['e', 'e_grad', 'e_w']
+
     def __init__(self,
                  cumulant,
                  gamma,
@@ -43,6 +56,8 @@ class GVF:
                  learner,
                  feature_indices,
                  use_MSRE=False,
+                 priority=0,
+                 update_period=1,
                  **kwargs):
 
         self.cumulant = cumulant
@@ -58,6 +73,8 @@ class GVF:
         self.learner = learner
         self.uses_action_state = feature_indices.size < num_features
         self.use_MSRE = use_MSRE
+        self.priority = priority
+        self.update_period = update_period
 
         self.time_step = 0
 
@@ -76,6 +93,18 @@ class GVF:
         else:
             return self.learner.predict(phi[self.feature_indices])
 
+    def reset_trace(self):
+        """Clears the learner's eligibility traces.
+
+        The next update then credits only its own features, as at the
+        start of an episode. Call this when the next transition does not
+        follow the last one learned from.
+        """
+        for name in self.TRACES:
+            trace = getattr(self.learner, name, None)
+            if trace is not None:
+                setattr(self.learner, name, np.zeros_like(trace))
+
     def update(self,
                last_observation,
                phi,
@@ -83,13 +112,27 @@ class GVF:
                observation,
                phi_prime,
                mu,
-               action):
+               action,
+               rho=None,
+               evaluate=True):
+        """Updates the learner and evaluator with the last transition.
+
+        Actions are passed as their index in the action space.
+
+        Args:
+            rho (float, optional): Importance sampling ratio for
+                ``last_action``. If ``None``, the target policy is
+                updated and queried here; pass it in when the target
+                policy has already been evaluated for this timestep.
+            evaluate (bool): Whether to update the evaluator as well.
+        """
 
         self.last_prediction = self.predict(phi_prime, action)
 
-        # update action probabilities and get probability of last action
-        self.target_policy.update(phi, last_observation)
-        pi = self.target_policy.get_probability(last_action)
+        if rho is None:
+            # update action probabilities and get probability of last action
+            self.target_policy.update(phi, last_observation)
+            rho = self.target_policy.get_probability(last_action) / mu
 
         cumulant = self.cumulant(observation)
 
@@ -97,7 +140,7 @@ class GVF:
         phi = phi[self.feature_indices]
         phi_prime = phi_prime[self.feature_indices]
 
-        self.rho = pi / mu
+        self.rho = rho
         kwargs = {"phi": phi,
                   "last_action": last_action,
                   "phi_prime": phi_prime,
@@ -108,12 +151,14 @@ class GVF:
 
         phi = self.learner.update(**kwargs)
 
-        self.evaluator.update(theta=self.learner.theta,
-                              time_step=self.time_step,
-                              tderr_elig=self.learner.tderr_elig,
-                              delta=self.learner.delta,
-                              phi=phi,
-                              rho=self.rho)
+        if evaluate:
+            with profiler.stage('evaluator/' + self.name):
+                self.evaluator.update(theta=self.learner.theta,
+                                      time_step=self.time_step,
+                                      tderr_elig=self.learner.tderr_elig,
+                                      delta=self.learner.delta,
+                                      phi=phi,
+                                      rho=self.rho)
 
         self.phi = phi_prime
         self.last_cumulant = cumulant
@@ -0,0 +1,148 @@
+"""Fits GVF updates into the time left in each timestep.
+
+Without a scheduler every GVF learns from every transition, however long
+that takes. A :py:class:`GVFScheduler` instead updates each GVF only
+every ``update_period`` timesteps, in order of ``priority``, and only
+while its measured cost fits in the remaining budget. When a GVF does
+not fit, its evaluator is skipped first; if even the learner update does
+not fit, the transition goes to that GVF's backlog, which is worked off
+in later timesteps that have slack. Mandatory GVFs, such as the control
+GVF, are always updated, whatever their ``update_period``.
+
+A GVF that learns from every ``update_period``-th transition, or whose
+backlog overflowed, would otherwise carry its eligibility trace across
+the missing transitions as if they were adjacent, which biases the
+learner when lambda is above zero. Its trace is reset (see
+:py:meth:`~gvf.GVF.reset_trace`) before it learns from a transition
+that does not follow the last one it learned from, so subsampled GVFs
+effectively learn with lambda of zero.
+"""
+from __future__ import division
+
+import time
+from collections import deque
+
+from profiler import profiler
+
+
+class GVFScheduler:
+    """Decides which GVFs learn from a transition within a deadline.
+
+    Args:
+        gvfs (list of GVF): GVFs to schedule. Each GVF's ``priority`` and
+            ``update_period`` attributes are used.
+        mandatory (list of GVF): GVFs that are updated on every timestep
+            regardless of the budget.
+        backlog_size (int): Number of deferred transitions kept per GVF.
+            When a backlog is full its oldest transition is dropped.
+        smoothing (float): Weight of the newest measurement in the moving
+            average of each GVF's update cost.
+
+    Attributes:
+        backlogs (dict): Maps each GVF to a deque of deferred transitions.
+        deferred (int): Number of transitions put in a backlog.
+        dropped (int): Number of deferred transitions that were dropped.
+        skipped_evaluations (int): Number of updates done without
+            updating the GVF's evaluator.
+        gaps (set): GVFs whose next transition does not follow the last
+            one they learned from, so their trace is reset first.
+    """
+
+    def __init__(self, gvfs, mandatory=(), backlog_size=10, smoothing=0.1):
+        self.mandatory = set(mandatory)
+        self.smoothing = smoothing
+        self.step = 0
+
+        # mandatory GVFs first, then by decreasing priority
+        self.gvfs = sorted(gvfs, key=lambda g: (g not in self.mandatory,
+                                                -g.priority))
+        self.backlogs = {gvf: deque(maxlen=backlog_size) for gvf in gvfs}
+
+        # estimated seconds per update, with and without the evaluator;
+        # GVFs are optimistically assumed to be free until measured
+        self.cost = {gvf: 0.0 for gvf in gvfs}
+        self.learn_cost = {gvf: 0.0 for gvf in gvfs}
+        self.measured = set()
+
+        self.deferred = 0
+        self.dropped = 0
+        self.skipped_evaluations = 0
+        self.gaps = set()
+
+    def update(self, transition, rhos, deadline):
+        """Updates the GVFs that are due and fit before ``deadline``.
+
+        Args:
+            transition (tuple): Arguments of
+                :py:meth:`~gvf.GVF.update` except ``rho``.
+            rhos (dict): Maps each GVF to its importance sampling ratio
+                for the transition.
+            deadline (float): Time, as given by ``time.time``, by which
+                the updates should be done.
+        """
+        for gvf in self.gvfs:
+            item = transition + (rhos[gvf],)
+            if gvf in self.mandatory:
+                self.run(gvf, item, evaluate=True)
+                continue
+
+            if self.step % gvf.update_period:
+                continue
+
+            remaining = deadline - time.time()
+            if self.backlogs[gvf]:
+                # keep the transitions of a GVF in order
+                self.defer(gvf, item)
+            elif self.cost[gvf] <= remaining:
+                self.run(gvf, item, evaluate=True)
+            elif self.learn_cost[gvf] <= remaining:
+                self.skipped_evaluations += 1
+                self.run(gvf, item, evaluate=False)
+            else:
+                self.defer(gvf, item)
+
+        self.work_off_backlog(deadline)
+        self.step += 1
+
+    def defer(self, gvf, item):
+        backlog = self.backlogs[gvf]
+        if len(backlog) == backlog.maxlen:
+            # the oldest transition is lost, so the next one learned from
+            # does not follow the last
+            self.dropped += 1
+            self.gaps.add(gvf)
+        backlog.append(item)
+        self.deferred += 1
+
+    def work_off_backlog(self, deadline):
+        """Replays deferred transitions, highest priority first, until
+        the next one would not fit before ``deadline``.
+        """
+        for gvf in self.gvfs:
+            backlog = self.backlogs[gvf]
+            while backlog:
+                if self.learn_cost[gvf] > deadline - time.time():
+                    return
+                self.skipped_evaluations += 1
+                self.run(gvf, backlog.popleft(), evaluate=False)
+
+    def run(self, gvf, item, evaluate):
+        subsampled = gvf not in self.mandatory and gvf.update_period > 1
+        if subsampled or gvf in self.gaps:
+            gvf.reset_trace()
+            self.gaps.discard(gvf)
+
+        start_time = time.time()
+        with profiler.stage('gvf/' + gvf.name):
+            gvf.update(*item[:-1], rho=item[-1], evaluate=evaluate)
+        elapsed = time.time() - start_time
+
+        costs = self.cost if evaluate else self.learn_cost
+        if (gvf, evaluate) in self.measured:
+            costs[gvf] += self.smoothing * (elapsed - costs[gvf])
+        else:
+            costs[gvf] = elapsed
+            self.measured.add((gvf, evaluate))
+        if not evaluate:
+            # an update with the evaluator costs at least as much
+            self.cost[gvf] = max(self.cost[gvf], self.learn_cost[gvf])
@@ -0,0 +1,447 @@
+"""Microbenchmarks of the learners over feature sizes and sparsity.
+
+Times ``update`` and ``predict`` of :py:class:`~gtd.GTD`,
+:py:class:`~to_gtd.TOGTD`, :py:class:`~wis_gtd.WISGTD`,
+:py:class:`~wis_to_gtd.WISTOGTD` and :py:class:`~greedy_gq.GreedyGQ` on
+every combination of number of features, number of active features,
+lambda and input kind, and reports updates per second alongside the
+memory each update allocates. The allocations are traced with
+``tracemalloc`` where it is available (Python 3). Elsewhere, including
+the Python 2 the learners run on, they are estimated from the growth of
+the resident set size and of the number of objects the garbage
+collector tracks; each result names the method used.
+
+``sparse`` input is a boolean feature vector with a fixed number of
+active features, as :py:class:`~state_representation.StateManager`
+produces; ``dense`` input is a float vector with every feature nonzero,
+scaled to unit expected squared norm. The feature vectors are drawn
+from a small pool, so large feature sizes do not need a large trace.
+
+A golden trace guards optimizations of the learners: save the weights
+each learner ends up with on a fixed seeded trace before changing it,
+then check that the changed learner ends up with the same weights.
+
+Example::
+
+    python learner_benchmark.py --save-golden golden.npz
+    # ... optimize a learner ...
+    python learner_benchmark.py --check-golden golden.npz \\
+        --num-features 1000 100000 --output results.json
+"""
+from __future__ import division, print_function
+
+import argparse
+import gc
+import json
+import os
+import shutil
+import sys
+import tempfile
+import timeit
+
+import numpy as np
+
+from benchmark import rss_kb
+from greedy_gq import GreedyGQ
+from gtd import GTD
+from to_gtd import TOGTD
+from wis_gtd import WISGTD
+from wis_to_gtd import WISTOGTD
+
+LEARNERS = ['GTD', 'TOGTD', 'WISGTD', 'WISTOGTD', 'GreedyGQ']
+
+""" feature vectors and transitions are drawn from a pool this large
+"""
+POOL_SIZE = 16
+
+""" the fixed trace the golden weights are computed on
+"""
+GOLDEN_TRACE = {'num_features': 1000,
+                'num_active': 50,
+                'lmbda': 0.9,
+                'num_steps': 300,
+                'seed': 0,
+                }
+
+
+def make_learner(name, num_features, num_active, lmbda, dense):
+    """Builds a learner with step sizes suited to its input.
+
+    Args:
+        name (str): One of :py:data:`LEARNERS`.
+        num_features (int): Length of the feature vectors.
+        num_active (int): Number of active features of sparse input.
+        lmbda (float): Trace decay rate.
+        dense (bool): Whether the input is dense.
+    """
+    alpha = 0.1 if dense else 0.1 / num_active
+    if name == 'GTD':
+        return GTD(num_features, alpha, alpha / 100, lmbda)
+    if name == 'TOGTD':
+        return TOGTD(num_features, alpha, alpha / 100, lmbda)
+    if name == 'WISGTD':
+        return WISGTD(num_features, u=1, eta=alpha, beta=alpha / 100,
+                      lmbda=lmbda)
+    if name == 'WISTOGTD':
+        return WISTOGTD(num_features, u=1, eta=alpha, beta=alpha / 100,
+                        lmbda=lmbda)
+    if name == 'GreedyGQ':
+        from geometry_msgs.msg import Twist, Vector3
+
+        # turning either way, as in align_ir_example
+        action_space = np.array([Twist(Vector3(0, 0, 0), Vector3(0, 0, 0.3)),
+                                 Twist(Vector3(0, 0, 0),
+                                       Vector3(0, 0, -0.3))])
+        return GreedyGQ(action_space=action_space,
+                        finished_episode=lambda cumulant: False,
+                        num_features=2 * num_features,
+                        alpha=alpha,
+                        beta=alpha / 100,
+                        lmbda=lmbda)
+    raise ValueError('Unknown learner: {}'.format(name))
+
+
+class Trace:
+    """Seeded pool of feature vectors and transitions to learn from.
+
+    Args:
+        num_features (int): Length of the feature vectors.
+        num_active (int): Number of active features of sparse input.
+        dense (bool): Whether the feature vectors are dense.
+        seed (int): Seed of the random number generator.
+        pool_size (int): Number of distinct feature vectors.
+    """
+
+    def __init__(self, num_features, num_active, dense, seed=0,
+                 pool_size=POOL_SIZE):
+        random = np.random.RandomState(seed)
+
+        if dense:
+            # uniform features have mean square 1/3
+            self.phis = (random.rand(pool_size, num_features) *
+                         np.sqrt(3 / num_features))
+        else:
+            self.phis = np.zeros((pool_size, num_features), dtype=bool)
+            for phi in self.phis:
+                phi[random.choice(num_features, num_active,
+                                  replace=False)] = True
+
+        self.cumulants = random.rand(pool_size)
+        self.gammas = np.where(random.rand(pool_size) < 0.05, 0, 0.9)
+        self.rhos = random.choice([0, 1, 2], pool_size, p=[0.25, 0.5, 0.25])
+        self.actions = random.randint(2, size=pool_size)
+
+    def transition(self, t):
+        """Arguments of ``update`` for the ``t`` th step."""
+        i = t % len(self.phis)
+        j = (t + 1) % len(self.phis)
+        return {'phi': self.phis[i],
+                'phi_prime': self.phis[j],
+                'last_action': self.actions[i],
+                'cumulant': self.cumulants[i],
+                'gamma': self.gammas[j],
+                'rho': self.rhos[i]}
+
+
+def predict(learner, phi):
+    if isinstance(learner, GreedyGQ):
+        return learner.predict(phi, 0)
+    return learner.predict(phi)
+
+
+def time_updates(learner, trace, num_updates, start=0):
+    """Seconds taken by ``num_updates`` updates."""
+    transitions = [trace.transition(t)
+                   for t in range(start, start + num_updates)]
+    start_time = timeit.default_timer()
+    for transition in transitions:
+        learner.update(**transition)
+    return timeit.default_timer() - start_time
+
+
+def time_predictions(learner, trace, num_predictions):
+    """Seconds taken by ``num_predictions`` predictions."""
+    phis = [trace.phis[t % len(trace.phis)]
+            for t in range(num_predictions)]
+    start_time = timeit.default_timer()
+    for phi in phis:
+        predict(learner, phi)
+    return timeit.default_timer() - start_time
+
+
+def count_allocations(learner, trace, num_updates, start=0):
+    """Estimates the memory updates allocate without ``tracemalloc``.
+
+    Temporary arrays that are freed again are not seen; only memory the
+    updates keep is.
+
+    Returns:
+        dict: Bytes of resident set size gained per update, or
+            ``None`` where ``/proc`` is not available, and objects
+            tracked by the garbage collector gained per update.
+    """
+    transitions = [trace.transition(t)
+                   for t in range(start, start + num_updates)]
+    gc.collect()
+    objects_before = len(gc.get_objects())
+    rss_before = rss_kb()
+    for transition in transitions:
+        learner.update(**transition)
+    gc.collect()
+    objects_after = len(gc.get_objects())
+    rss_after = rss_kb()
+
+    allocated = None
+    if rss_before is not None:
+        allocated = 1024 * (rss_after - rss_before) / num_updates
+    return {'method': 'gc',
+            'bytes_per_update': allocated,
+            'objects_per_update': (objects_after - objects_before) /
+                                  num_updates}
+
+
+def allocated_per_update(learner, trace, num_updates, start=0):
+    """Mean peak of the memory allocated while updating.
+
+    Returns:
+        dict: With ``tracemalloc``, the bytes by which each update
+            raises the traced memory at its peak, i.e. the size of its
+            temporary arrays. Without it, the estimates of
+            :py:func:`count_allocations`.
+    """
+    try:
+        import tracemalloc
+    except ImportError:
+        return count_allocations(learner, trace, num_updates, start)
+
+    total = 0
+    for t in range(start, start + num_updates):
+        transition = trace.transition(t)
+        tracemalloc.start()
+        before = tracemalloc.get_traced_memory()[0]
+        learner.update(**transition)
+        total += tracemalloc.get_traced_memory()[1] - before
+        tracemalloc.stop()
+    return {'method': 'tracemalloc',
+            'bytes_per_update': total / num_updates,
+            'objects_per_update': None}
+
+
+def benchmark(name, num_features, num_active, lmbda, dense, num_updates,
+              allocation_updates=0):
+    """Times one learner on one kind of input.
+
+    Returns:
+        dict: The configuration, updates and predictions per second,
+            microseconds per update and prediction, and bytes allocated
+            per update with the method used to measure them.
+    """
+    learner = make_learner(name, num_features, num_active, lmbda, dense)
+    trace = Trace(num_features, num_active, dense)
+
+    # warm up, and move the weights away from zero
+    warmup = min(10, num_updates)
+    time_updates(learner, trace, warmup)
+
+    update_seconds = time_updates(learner, trace, num_updates, warmup)
+    predict_seconds = time_predictions(learner, trace, num_updates)
+
+    allocated = {'method': None,
+                 'bytes_per_update': None,
+                 'objects_per_update': None}
+    if allocation_updates:
+        allocated = allocated_per_update(learner, trace, allocation_updates,
+                                         warmup + num_updates)
+
+    def rate(seconds):
+        return num_updates / seconds if seconds else float('inf')
+
+    return {'learner': name,
+            'num_features': num_features,
+            'num_active': num_features if dense else num_active,
+            'lmbda': lmbda,
+            'input': 'dense' if dense else 'sparse',
+            'updates_per_sec': rate(update_seconds),
+            'update_us': 1e6 * update_seconds / num_updates,
+            'predictions_per_sec': rate(predict_seconds),
+            'predict_us': 1e6 * predict_seconds / num_updates,
+            'bytes_allocated_per_update': allocated['bytes_per_update'],
+            'objects_allocated_per_update':
+                allocated['objects_per_update'],
+            'allocation_method': allocated['method']}
+
+
+def matrix(learners, sizes, actives, lmbdas, inputs):
+    """Every configuration to benchmark, as keyword arguments.
+
+    Dense input has every feature active, so it is only run once per
+    size rather than once per active count, and sparse input only for
+    active counts below the size.
+    """
+    for name in learners:
+        for num_features in sizes:
+            for lmbda in lmbdas:
+                if 'sparse' in inputs:
+                    for num_active in actives:
+                        if num_active < num_features:
+                            yield {'name': name,
+                                   'num_features': num_features,
+                                   'num_active': num_active,
+                                   'lmbda': lmbda,
+                                   'dense': False}
+                if 'dense' in inputs:
+                    yield {'name': name,
+                           'num_features': num_features,
+                           'num_active': num_features,
+                           'lmbda': lmbda,
+                           'dense': True}
+
+
+def golden_weights(learners):
+    """Weights each learner ends up with on the golden trace.
+
+    Returns:
+        dict: Maps ``'<learner>/<input>'`` to the final weights.
+    """
+    weights = {}
+    for name in learners:
+        for dense in [False, True]:
+            learner = make_learner(name,
+                                   GOLDEN_TRACE['num_features'],
+                                   GOLDEN_TRACE['num_active'],
+                                   GOLDEN_TRACE['lmbda'],
+                                   dense)
+            trace = Trace(GOLDEN_TRACE['num_features'],
+                          GOLDEN_TRACE['num_active'],
+                          dense,
+                          seed=GOLDEN_TRACE['seed'])
+            for t in range(GOLDEN_TRACE['num_steps']):
+                learner.update(**trace.transition(t))
+            key = '{}/{}'.format(name, 'dense' if dense else 'sparse')
+            weights[key] = np.array(learner.theta)
+    return weights
+
+
+def check_golden(weights, golden, rtol=1e-9, atol=1e-12):
+    """Compares weights with golden weights.
+
+    Returns:
+        tuple: The list of mismatches, describing each key whose weights
+            differ or that has no golden weights, and the list of golden
+            keys that were not checked, e.g. those of learners left out
+            of the run.
+    """
+    mismatches = []
+    for key in sorted(weights):
+        if key not in golden:
+            mismatches.append('{}: no golden weights'.format(key))
+        elif np.shape(weights[key]) != np.shape(golden[key]):
+            mismatches.append('{}: shape {} instead of {}'.format(
+                    key, np.shape(weights[key]), np.shape(golden[key])))
+        elif not np.allclose(weights[key], golden[key],
+                             rtol=rtol, atol=atol):
+            mismatches.append('{}: max difference {:.3g}'.format(
+                    key, np.max(np.abs(weights[key] - golden[key]))))
+    unchecked = sorted(set(golden) - set(weights))
+    return mismatches, unchecked
+
+
+ROW = '{:<10}{:>9}{:>8}{:>6}{:>8}{:>13}{:>12}{:>12}{:>14}{:>13}'
+
+
+def print_header():
+    print(ROW.format('learner', 'features', 'active', 'lmbda', 'input',
+                     'updates/sec', 'update us', 'predict us',
+                     'bytes/update', 'measured by'))
+
+
+def print_result(result):
+    allocated = result['bytes_allocated_per_update']
+    print(ROW.format(result['learner'],
+                     result['num_features'],
+                     result['num_active'],
+                     result['lmbda'],
+                     result['input'],
+                     '{:.0f}'.format(result['updates_per_sec']),
+                     '{:.1f}'.format(result['update_us']),
+                     '{:.1f}'.format(result['predict_us']),
+                     '-' if allocated is None
+                     else '{:.0f}'.format(allocated),
+                     result['allocation_method'] or '-'))
+    sys.stdout.flush()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+            description='Benchmarks the learners.')
+    parser.add_argument('--learners', nargs='+', choices=LEARNERS,
+                        default=LEARNERS)
+    parser.add_argument('--num-features', nargs='+', type=int,
+                        default=[100, 1000, 10000, 100000, 200000])
+    parser.add_argument('--active', nargs='+', type=int,
+                        default=[10, 100, 1000],
+                        help='active features of sparse input')
+    parser.add_argument('--lambdas', nargs='+', type=float,
+                        default=[0.0, 0.9])
+    parser.add_argument('--inputs', nargs='+', choices=['sparse', 'dense'],
+                        default=['sparse', 'dense'])
+    parser.add_argument('--updates', type=int, default=200,
+                        help='updates to time per configuration')
+    parser.add_argument('--allocation-updates', type=int, default=5,
+                        help='updates to trace allocations for; 0 skips')
+    parser.add_argument('--output', help='file to write the results to')
+    parser.add_argument('--save-golden',
+                        help='file to write the golden weights to, '
+                             'instead of benchmarking')
+    parser.add_argument('--check-golden',
+                        help='golden weights to check the learners against '
+                             'before benchmarking')
+    args = parser.parse_args(argv)
+
+    # GreedyGQ saves its TD errors to the working directory
+    cwd = os.getcwd()
+    paths = [os.path.abspath(path) if path else None
+             for path in [args.output, args.save_golden, args.check_golden]]
+    output, save_golden, check = paths
+    directory = tempfile.mkdtemp(prefix='learner_benchmark_')
+    os.chdir(directory)
+    try:
+        if save_golden or check:
+            weights = golden_weights(args.learners)
+            if save_golden:
+                np.savez(save_golden, **weights)
+            if check:
+                mismatches, unchecked = check_golden(weights,
+                                                     np.load(check))
+                for mismatch in mismatches:
+                    print('GOLDEN MISMATCH ' + mismatch)
+                for key in unchecked:
+                    print('GOLDEN UNCHECKED ' + key)
+                if mismatches:
+                    return 1
+                print('Golden weights match for {} of {} keys.'.format(
+                        len(weights), len(weights) + len(unchecked)))
+            if save_golden:
+                return 0
+
+        results = []
+        print_header()
+        for config in matrix(args.learners, args.num_features, args.active,
+                             args.lambdas, args.inputs):
+            result = benchmark(num_updates=args.updates,
+                               allocation_updates=args.allocation_updates,
+                               **config)
+            print_result(result)
+            results.append(result)
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(directory, ignore_errors=True)
+
+    if output:
+        with open(output, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -8,20 +8,25 @@ Authors:
 from __future__ import division
 
 import time
-from Queue import Queue
 from multiprocessing import Value
+from multiprocessing.pool import ThreadPool
 
-import cv2
 import geometry_msgs.msg as geom_msg
 import numpy as np
-import rosbag
-import rospy
 import std_msgs.msg as std_msg
 
+from action_manager import ActionChannel, start_action_thread
+from feature_pipeline import FeaturePipeline
+from gvf_scheduler import GVFScheduler
+from profiler import profiler
+from recorder import SensorRecorder
+from stats_publisher import StatsPublisher
 from state_representation import StateManager
 import tools
 from tools import timing
-from visualize_pixels import Visualize
+from topic_buffer import make_buffers
+from transport import (ROSInterruptException, RosTransport, logdebug, logerr,
+                       loginfo)
 
 
 class LearningForeground:
@@ -41,15 +46,56 @@ class LearningForeground:
             Evaluator.
         reset_episode (fun): Whether the episode should be reset.
         custom_stats (dictionary[string:lambda]): The custom topics defined by the user.
+        stats_period (int): Number of timesteps between publications of
+            ``stats``.
+        batch_stats (bool): Whether to publish all ``stats`` as one
+            array message (see :doc:`stats_publisher`).
+        profile (bool): Whether to record per-stage latency histograms
+            and report them to the ``profile`` topic and a file (see
+            :doc:`profiler`).
+        pipeline (bool): Whether to learn on a worker thread while the
+            next timestep's action is being chosen and published.
+        feature_processes (bool): Whether to tile code the image feature
+            groups in separate processes (see :doc:`feature_pipeline`).
+            Tile coding only overlaps with learning if ``pipeline`` is
+            also set.
+        schedule_updates (bool): Whether to fit the GVF updates into the
+            time left in each timestep by priority, deferring those that
+            do not fit (see :doc:`gvf_scheduler`). The control GVF is
+            always updated.
+        action_channel (ActionChannel, optional): Shared-memory channel
+            to send actions through instead of the ``action_cmd`` topic,
+            e.g. to an action manager process started with the same
+            channel.
+        action_thread (bool): Whether to run the action manager on a
+            thread of this process, fed through an action channel. Not
+            supported on a :py:class:`~transport.LocalTransport`.
+        transport (optional): Topics and clock to run on (see
+            :doc:`transport`). Defaults to a ROS node.
 
     Attributes:
-        COLLECT_DATA_FLAG (bool): Whether or not to save data in bags.
-        vis (bool): Whether or not to use the visualizer.
+        COLLECT_DATA_FLAG (bool): Whether or not to record sensor data and
+            actions (see :doc:`recorder`).
+        vis (bool): Whether or not to use the visualizer, which runs in
+            its own process (see :doc:`visualize_pixels`).
         to_replay_experience (bool): Whether or not to use experience replay.
-        recent (dict of queue): Dictionary mapping topic names to the queue
-            of recent values from their respective topics.
+        learning_worker (ThreadPool): Single worker thread that runs
+            :py:meth:`learn` in pipelined mode.
+        learning_overruns (int): Number of timesteps that had to wait
+            for the previous timestep's learning to finish.
+        recent (dict of topic buffers): Dictionary mapping topic names to
+            the bounded buffer of recent values from their respective
+            topics (see :doc:`topic_buffer`).
         publishers (dict of ROS publishers): Publishers for each of the
             data we want to publish.
+        stats_publisher (StatsPublisher): Publishes the statistics of
+            each GVF.
+        target_policies (list of Policy): Distinct target policies of
+            ``gvfs``.
+        gvf_policy_index (numpy array of int): Index into
+            ``target_policies`` of each GVF's target policy.
+        scheduler (GVFScheduler): Schedules the GVF updates if
+            ``schedule_updates`` is set, otherwise ``None``.
     """
     def __init__(self,
                  time_scale,
@@ -60,13 +106,25 @@ class LearningForeground:
                  control_gvf=None,
                  cumulant_counter=None,
                  reset_episode=None,
-                 custom_stats=None):
+                 custom_stats=None,
+                 pipeline=False,
+                 feature_processes=False,
+                 profile=False,
+                 stats_period=1,
+                 batch_stats=False,
+                 schedule_updates=False,
+                 action_channel=None,
+                 action_thread=False,
+                 transport=None):
+
+        init_start_time = time.time()
 
         # function that generates a list of actions to perform to reset episode
         self.reset_episode = reset_episode 
 
-        # set up ros
-        rospy.init_node('agent', anonymous=True)
+        # set up ros, or whatever stands in for it
+        self.transport = transport or RosTransport()
+        self.transport.init_node('agent')
 
         self.COLLECT_DATA_FLAG = False
 
@@ -78,8 +136,8 @@ class LearningForeground:
 
         # capture this session's data and actions
         if self.COLLECT_DATA_FLAG:
-            self.history = rosbag.Bag('results.bag', 'w')
-            self.current_time = rospy.Time().now()
+            self.recorder = SensorRecorder('results')
+            self.current_time = self.transport.now()
 
         self.vis = False
         # self.vis = True
@@ -87,23 +145,21 @@ class LearningForeground:
         extras = {'core', 'ir', 'odom'}
         self.features_to_use = set(features_to_use).union(extras)
 
-        topics = filter(lambda x: x,
-                        [tools.features[f] for f in self.features_to_use])
-
         # set up dictionary to receive sensor info
-        self.recent = {topic: Queue(0) for topic in topics}
+        self.recent = make_buffers(self.features_to_use,
+                                   threaded=self.transport.asynchronous)
 
         # setup sensor parsers
-        for topic in topics:
-            rospy.Subscriber(topic,
-                             tools.topic_format[topic],
-                             self.recent[topic].put)
+        for topic in self.recent:
+            self.transport.subscribe(topic,
+                                     tools.topic_format[topic],
+                                     self.recent[topic].put)
 
-        rospy.loginfo("Started sensor threads.")
+        loginfo("Started sensor threads.")
 
         # smooth out the actions
         self.time_scale = time_scale
-        self.r = rospy.Rate(int(1.0 / self.time_scale))
+        self.r = self.transport.rate(self.time_scale, name='learning')
 
         # agent info
         self.gvfs = gvfs
@@ -111,17 +167,42 @@ class LearningForeground:
         self.behavior_policy = behavior_policy
         self.avg_td_err = None
 
+        # evaluate each distinct target policy once per timestep
+        self.target_policies = []
+        policy_index = {}
+        for gvf in self.gvfs:
+            key = id(gvf.target_policy)
+            if key not in policy_index:
+                policy_index[key] = len(self.target_policies)
+                self.target_policies.append(gvf.target_policy)
+        self.gvf_policy_index = np.array(
+                [policy_index[id(gvf.target_policy)] for gvf in self.gvfs],
+                dtype=int)
+
+        self.scheduler = None
+        if schedule_updates:
+            mandatory = [control_gvf] if control_gvf is not None else []
+            self.scheduler = GVFScheduler(self.gvfs, mandatory=mandatory)
+
         self.state_manager = StateManager(features_to_use)
+        self.feature_pipeline = None
+        if feature_processes:
+            self.feature_pipeline = FeaturePipeline(self.state_manager)
 
         if self.vis:
-            rospy.loginfo("Creating visualization.")
-            self.visualization = Visualize(self.state_manager.pixel_mask,
-                                           imsizex=640,
-                                           imsizey=480)
-            rospy.loginfo("Done creatiing visualization.")
+            # matplotlib is slow to import, so only import it when needed
+            from visualize_pixels import VisualizeProcess
+
+            loginfo("Creating visualization.")
+            self.visualization = VisualizeProcess(
+                    self.state_manager.pixel_mask,
+                    imsizex=640,
+                    imsizey=480)
+            loginfo("Done creatiing visualization.")
 
         # previous timestep information
         self.last_action = None
+        self.last_action_id = None
         self.last_phi = None
         self.last_observation = None
         self.last_mu = 1
@@ -129,21 +210,42 @@ class LearningForeground:
         # experience replay
         self.to_replay_experience = False
 
-        action_publisher = rospy.Publisher('action_cmd',
-                                           geom_msg.Twist,
-                                           queue_size=1)
-        pause_publisher = rospy.Publisher('pause',
-                                          std_msg.Bool,
-                                          queue_size=1)
-        termination_publisher = rospy.Publisher('termination',
-                                                std_msg.Bool,
-                                                queue_size=1)
+        # act/learn pipelining
+        self.pipeline = pipeline
+        self.learning_worker = ThreadPool(1) if pipeline else None
+        self.pending_learning = None
+        self.learning_overruns = 0
+
+        action_publisher = self.transport.publisher('action_cmd',
+                                                    geom_msg.Twist,
+                                                    queue_size=1)
+        pause_publisher = self.transport.publisher('pause',
+                                                   std_msg.Bool,
+                                                   queue_size=1)
+        termination_publisher = self.transport.publisher('termination',
+                                                         std_msg.Bool,
+                                                         queue_size=1)
+
+        # send actions through shared memory rather than a topic
+        if action_thread and action_channel is None:
+            action_channel = ActionChannel()
+        self.action_channel = action_channel
+        if action_thread:
+            start_action_thread(self.action_channel, self.transport)
 
         self.publishers = {'action': action_publisher,
                            'pause': pause_publisher,
                            'termination': termination_publisher
                            }
 
+        if profile:
+            profile_publisher = self.transport.publisher('profile',
+                                                         std_msg.String,
+                                                         queue_size=1)
+            self.publishers['profile'] = profile_publisher
+            profiler.enable(deadline=self.time_scale,
+                            publish=profile_publisher.publish)
+
         valid_stats = ['prediction', 'td_error', 'avg_td_error', 'rupee',
                        'MSRE', 'cumulant', 'phi', 'e', 'rho', 'ESS']
 
@@ -153,7 +255,7 @@ class LearningForeground:
                           'avg_td_error': lambda g: g.evaluator.avg_td_error,
                           'rupee': lambda g: g.evaluator.rupee,
                           'MSRE': lambda g: g.evaluator.MSRE,
-                          'phi': lambda g: g.phi.sum(),
+                          'phi': lambda g: np.count_nonzero(g.phi),
                           'e': lambda g: g.learner.e.sum(),
                           'rho': lambda g: g.rho,
                           'ESS': lambda g: g.evaluator.ESS}
@@ -163,22 +265,19 @@ class LearningForeground:
             self.stat_data.update(custom_stats)
             self.stats += custom_stats.keys()
 
-        def publisher_name(gvf, label):
-            return '{}/{}'.format(gvf, label) if gvf else label
-
-        def make_publisher(gvf, label):
-            return rospy.Publisher(publisher_name(gvf, label),
-                                   std_msg.Float64,
-                                   queue_size=10)
-        stat_publishers = {gvf: {stat: make_publisher(gvf.name, stat)
-                                 for stat in self.stats}
-                           for gvf in self.gvfs}
-        self.publishers.update(stat_publishers)
+        self.stats_publisher = StatsPublisher(self.gvfs,
+                                              self.stats,
+                                              self.stat_data,
+                                              period=stats_period,
+                                              batch=batch_stats,
+                                              transport=self.transport)
 
-        rospy.loginfo("Done LearningForeground init.")
+        loginfo("Done LearningForeground init in {:.2f} sec.".format(
+                time.time() - init_start_time))
 
     @timing
-    def update_gvfs(self, phi_prime, observation, action):
+    def update_gvfs(self, phi_prime, observation, action, deadline=None,
+                    target_pis=None):
         """
         Calls the GVF update function for each GVF and publishes their updated
         statistics.
@@ -186,36 +285,73 @@ class LearningForeground:
         Args:
             phi_prime (numpy array): Feature vector for timestep t+1.
             observation (dict): Ancillary state information.
-            action (action): Action taken at time t+1.
+            action (int): Id of the action taken at time t+1.
+            deadline (float, optional): Time, as given by ``time.time``,
+                by which the updates should be done. Only used by
+                :py:attr:`scheduler`.
+            target_pis (numpy array, optional): Output of
+                :py:meth:`target_probabilities`, if it was already
+                computed.
         """
-        for gvf in self.gvfs:
-            gvf.update(self.last_observation,
-                       self.last_phi,
-                       self.last_action,
-                       observation,
-                       phi_prime,
-                       self.last_mu,
-                       action)
+        if target_pis is None:
+            with profiler.stage('target_policies'):
+                target_pis = self.target_probabilities()
+        rhos = target_pis[self.gvf_policy_index] / self.last_mu
+
+        if self.scheduler is not None:
+            transition = (self.last_observation,
+                          self.last_phi,
+                          self.last_action_id,
+                          observation,
+                          phi_prime,
+                          self.last_mu,
+                          action)
+            self.scheduler.update(transition,
+                                  dict(zip(self.gvfs, rhos)),
+                                  deadline if deadline else float('inf'))
+        else:
+            for gvf, rho in zip(self.gvfs, rhos):
+                with profiler.stage('gvf/' + gvf.name):
+                    gvf.update(self.last_observation,
+                               self.last_phi,
+                               self.last_action_id,
+                               observation,
+                               phi_prime,
+                               self.last_mu,
+                               action,
+                               rho=rho)
 
         # publishing
-        for gvf in self.gvfs:
-            for stat in self.stats:
-                self.publishers[gvf][stat].publish(self.stat_data[stat](gvf))
+        with profiler.stage('publish_stats'):
+            self.stats_publisher.step()
+
+    def target_probabilities(self):
+        """Evaluates each distinct target policy once for the last step.
+
+        GVFs that share a target policy object share its evaluation, so
+        the cost scales with the number of distinct policies rather than
+        with the number of GVFs.
+
+        Returns:
+            numpy array of float: Probability of :py:attr:`last_action_id`
+                under each policy in :py:attr:`target_policies`.
+        """
+        pis = np.zeros(len(self.target_policies))
+        for i, policy in enumerate(self.target_policies):
+            policy.update(self.last_phi, self.last_observation)
+            pis[i] = policy.get_probability(self.last_action_id)
+        return pis
 
     def read_source(self, source, history=False):
         """Reads from the topics and returns the most recent value.
+
+        If ``history`` is true, returns a list of the values buffered
+        since the last read instead.
         """
-        temp = [] if history else None
-        try:
-            stream = tools.features[source]
-            while True:
-                if history:
-                    temp.append(self.recent[stream].get_nowait())
-                else:
-                    temp = self.recent[stream].get_nowait()
-        except:
-            pass
-        return temp
+        buff = self.recent.get(tools.features.get(source))
+        if buff is None:
+            return [] if history else None
+        return buff.take_all() if history else buff.take_latest()
 
     @timing
     def create_state(self):
@@ -239,13 +375,19 @@ class LearningForeground:
         sensors = self.features_to_use.union(additional_features)
 
         # read data (used to make phi)
-        data = {sensor: None for sensor in sensors}
-        for source in sensors - {'ir', 'core'}:
-            data[source] = self.read_source(source)
+        with profiler.stage('sensor_read'):
+            data = {sensor: None for sensor in sensors}
+            read = {}
+            for source in sensors - {'ir', 'core'}:
+                # features that share a topic share its value
+                stream = tools.features.get(source)
+                if stream not in read:
+                    read[stream] = self.read_source(source)
+                data[source] = read[stream]
 
-        data['ir'] = self.read_source('ir', history=True)[-10:]
+            data['ir'] = self.read_source('ir', history=True)
 
-        data['core'] = self.read_source('core', history=True)
+            data['core'] = self.read_source('core', history=True)
 
         # process data
         if data['core']:
@@ -255,19 +397,6 @@ class LearningForeground:
                     axis=0, dtype=bool).tolist()
             data['charging'] = bool(data['core'][-1].charger & 2)
 
-            # enter the data into rosbag
-            if self.COLLECT_DATA_FLAG:
-                for bindex in range(len(data['bump'])):
-                    bump_bool = std_msg.Bool()
-                    bump_bool.data = data['bump'][bindex] if data['bump'][
-                        bindex] else False
-                    self.history.write('bump' + str(bindex), bump_bool,
-                                       t=self.current_time)
-                charge_bool = std_msg.Bool()
-                charge_bool.data = data['charging']
-                self.history.write('charging', charge_bool,
-                                   t=self.current_time)
-
         if data['ir']:
             ir = [[0] * 6] * 3
             # bitwise 'or' of all the ir data in last time_step
@@ -279,30 +408,14 @@ class LearningForeground:
             data['ir'] = [int(''.join([str(i) for i in ir_temp]), 2) for
                           ir_temp in ir]
 
-
-            # enter the data into rosbag
-            if self.COLLECT_DATA_FLAG:
-                ir_array = std_msg.Int32MultiArray()
-                ir_array.data = data['ir']
-                self.history.write('ir', ir_array, t=self.current_time)
-
+        # images arrive already decoded by their topic buffer
         if data['image'] is not None:
-            # enter the data into rosbag
-            # image_array = std_msg.Int32MultiArray()
-            # image_array.data = data['image']
-            if self.COLLECT_DATA_FLAG:
-                self.history.write('image', data['image'], t=self.current_time)
-
-            # uncompressed image
-            data['image'] = np.fromstring(data['image'].data,
-                                          np.uint8).reshape(480, 640, 3)
-
-            # compressing image
+            data['image_stamp'] = data['image'].stamp
+            data['image'] = data['image'].pixels
 
         if data['cimage'] is not None:
-            data['image'] = cv2.imdecode(np.fromstring(data['cimage'].data,
-                                                       np.uint8),
-                                         1)
+            data['image_stamp'] = data['cimage'].stamp
+            data['image'] = data['cimage'].pixels
 
         if data['odom'] is not None:
             pos = data['odom'].pose.pose.position
@@ -310,29 +423,18 @@ class LearningForeground:
             ang_vel = data['odom'].twist.twist.angular.z
             data['odom'] = np.array([pos.x, pos.y, lin_vel, ang_vel])
 
-            # enter the data into rosbag
-            if self.COLLECT_DATA_FLAG:
-                odom_x = std_msg.Float64()
-                odom_x.data = pos.x
-                odom_y = std_msg.Float64()
-                odom_y.data = pos.y
-                odom_lin = std_msg.Float64()
-                odom_lin.data = lin_vel
-                odom_ang = std_msg.Float64()
-                odom_ang.data = ang_vel
-
-                self.history.write('odom_x', odom_x, t=self.current_time)
-                self.history.write('odom_y', odom_y, t=self.current_time)
-                self.history.write('odom_lin', odom_lin, t=self.current_time)
-                self.history.write('odom_ang', odom_ang, t=self.current_time)
-
         if data['imu'] is not None:
             data['imu'] = data['imu'].orientation.z
-            # TODO: enter the  data into rosbag
+
+        # record the sensor data of this timestep
+        if self.COLLECT_DATA_FLAG:
+            self.record_sensors(data)
 
         if 'bias' in self.features_to_use:
             data['bias'] = True
         data['weights'] = self.gvfs[0].learner.theta if self.gvfs else None
+        if self.feature_pipeline is not None:
+            data['active'] = self.feature_pipeline.compute(data['image'])
         phi = self.state_manager.get_phi(**data)
 
         if 'last_action' in self.features_to_use:
@@ -353,8 +455,107 @@ class LearningForeground:
 
         return phi, observation
 
+    def record_sensors(self, data):
+        """Records the processed sensor data of the current timestep.
+
+        Args:
+            data (dict): Sensor data as built by :py:meth:`create_state`.
+        """
+        pixels = None
+        if data['image'] is not None:
+            pixels = data['image'][self.state_manager.pixel_mask]
+
+        stamp = data.get('image_stamp')
+        self.recorder.record(time=self.current_time.to_sec(),
+                             bump=data['bump'],
+                             charging=data['charging'],
+                             ir=data['ir'] or None,
+                             odom=data['odom'],
+                             imu=data['imu'],
+                             image_stamp=(stamp.to_sec() if stamp is not None
+                                          else None),
+                             pixels=pixels)
+
     def take_action(self, action):
-        self.publishers['action'].publish(action)
+        if self.action_channel is not None:
+            self.action_channel.write(action)
+        else:
+            self.publishers['action'].publish(action)
+
+    def learn(self, phi_prime, observation, action_id, mu, deadline=None,
+              target_pis=None):
+        """Learns from the transition into the current timestep.
+
+        Updates the GVFs, replays experience if enabled, and then saves
+        the current timestep as the previous one. In pipelined mode this
+        runs on :py:attr:`learning_worker`, so nothing else may touch
+        :py:attr:`last_phi`, :py:attr:`last_observation`,
+        :py:attr:`last_action_id` or :py:attr:`last_mu` until it
+        finishes.
+
+        Args:
+            phi_prime (numpy array): Feature vector for timestep t+1.
+            observation (dict): Ancillary state information.
+            action_id (int): Id of the action taken at time t+1.
+            mu (float): Probability of that action under the behavior
+                policy.
+            deadline (float, optional): Time by which learning should be
+                done (see :py:meth:`update_gvfs`).
+            target_pis (numpy array, optional): Target policy
+                probabilities of the last action (see
+                :py:meth:`update_gvfs`).
+        """
+        if self.last_observation is not None:
+            self.update_gvfs(phi_prime, observation, action_id, deadline,
+                             target_pis)
+
+        # not to replay when the episode resets at it will also
+        # include the experience at the start of new episode
+        if self.control_gvf is not None and self.to_replay_experience:
+            if not self.control_gvf.learner.episode_finished_last_step:
+                self.control_gvf.learner.uniform_experience_replay()
+
+        # save values
+        self.last_phi = phi_prime if len(phi_prime) else None
+        self.last_action_id = action_id
+        self.last_mu = mu
+        self.last_observation = observation
+
+    def wait_for_learning(self):
+        """Blocks until the learning submitted last timestep is done.
+
+        Counts an overrun in :py:attr:`learning_overruns` if the worker
+        was still busy.
+
+        Returns:
+            float: Seconds spent waiting.
+        """
+        if self.pending_learning is None:
+            return 0.0
+
+        start_time = time.time()
+        if not self.pending_learning.ready():
+            self.learning_overruns += 1
+        self.pending_learning.get()
+        self.pending_learning = None
+        return time.time() - start_time
+
+    def reset_if_finished(self):
+        """Takes the reset actions if the control GVF finished an episode.
+        """
+        if self.control_gvf is None:
+            return
+
+        # check if episode is over and reset accordingly [episodic]
+        if self.control_gvf.learner.episode_finished_last_step:
+            reset_actions = self.reset_episode()
+            for action in reset_actions:
+                self.take_action(action)
+                msg = 'taking random action number: {}'.format(action)
+                loginfo(msg)
+                if self.to_replay_experience:
+                    self.control_gvf.learner.uniform_experience_replay()
+                self.r.sleep()
 
     def run(self):
         """Main learning loop.
@@ -363,73 +564,99 @@ class LearningForeground:
             1. Get new state.
             2. Take an action.
             3. Learn.
+
+        In pipelined mode, step 3 is handed to :py:attr:`learning_worker`
+        and overlaps with the next timestep. The next timestep waits for
+        it only after its action is published, so the value functions
+        used by the behavior policy are at most one step stale. The
+        target policies are evaluated here before the hand-off, because
+        a target policy may be the behavior policy itself.
         """
 
         avg_time = 0
         time_step = 0
         max_time = 0
 
-        while not rospy.is_shutdown():
+        while not self.transport.is_shutdown():
             start_time = time.time()
-            self.current_time = rospy.Time().now()
+            self.current_time = self.transport.now()
 
             # get new state
             phi_prime, observation = self.create_state()
 
             # select and take an action
-            self.behavior_policy.update(phi_prime, observation)
-            action = self.behavior_policy.choose_action()
-            mu = self.behavior_policy.get_probability(action)
-            self.take_action(action)
+            with profiler.stage('policy'):
+                self.behavior_policy.update(phi_prime, observation)
+                action_id = self.behavior_policy.choose_action_id()
+                action = self.behavior_policy.action_space[action_id]
+                mu = self.behavior_policy.get_probability(action_id)
+            with profiler.stage('publish_action'):
+                self.take_action(action)
 
             if self.COLLECT_DATA_FLAG:
-                self.history.write('action', action, t=self.current_time)
+                self.recorder.record(action_id=action_id, mu=mu)
 
             # learn
-            if self.last_observation is not None:
-                self.update_gvfs(phi_prime, observation, action)
-
-            # check if episode is over and reset accordingly [episodic]
-            if self.control_gvf is not None:
-                if self.control_gvf.learner.episode_finished_last_step:
-                    reset_actions = self.reset_episode()
-                    for action in reset_actions:
-                        self.take_action(action)
-                        msg = 'taking random action number: {}'.format(action)
-                        rospy.loginfo(msg)
-                        if self.to_replay_experience:
-                            self.control_gvf.learner.uniform_experience_replay()
-                        self.r.sleep()
-                elif self.to_replay_experience:
-                    # not to replay when the episode resets at it will also
-                    # include the experience at the start of new episode
-                    self.control_gvf.learner.uniform_experience_replay()
+            if self.pipeline:
+                wait_time = self.wait_for_learning()
+                if wait_time:
+                    logdebug("Waited {:.4f} sec for learning. "
+                             "Overruns: {}".format(wait_time,
+                                                   self.learning_overruns))
+                self.reset_if_finished()
+                # policies are only updated on this thread, so the worker
+                # cannot change a policy's pi while it is being sampled
+                target_pis = None
+                if self.last_observation is not None:
+                    with profiler.stage('target_policies'):
+                        target_pis = self.target_probabilities()
+                # learning has to finish by the time the next timestep
+                # has chosen its action, which takes about as long as
+                # this one's did
+                act_time = time.time() - start_time
+                deadline = start_time + 2 * self.time_scale - act_time
+                self.pending_learning = self.learning_worker.apply_async(
+                        self.learn,
+                        (phi_prime, observation, action_id, mu, deadline,
+                         target_pis))
+            else:
+                self.learn(phi_prime, observation, action_id, mu,
+                           start_time + self.time_scale)
+                self.reset_if_finished()
 
-            # save values
-            self.last_phi = phi_prime if len(phi_prime) else None
             self.last_action = action
-            self.last_mu = mu
-            self.last_observation = observation
 
             # timestep logging
             total_time = time.time() - start_time
             max_time = max(max_time, total_time)
             time_step += 1
             avg_time += (total_time - avg_time) / time_step
-            time_msg = "Current timestep took {:.4f} sec.".format(total_time)
-            rospy.loginfo(time_msg)
+            profiler.end_step(total_time)
+
+            if self.COLLECT_DATA_FLAG:
+                self.recorder.record(step_time=total_time)
+                self.recorder.end_step()
 
             if total_time > self.time_scale:
                 if self.control_gvf is not None:
                     if not self.control_gvf.learner.episode_finished_last_step:
-                        rospy.logerr("Timestep took too long!")
+                        logerr("Timestep took too long!")
                 else:
-                    rospy.logerr("Timestep took too long!")
+                    logerr("Timestep took too long!")
 
             # sleep until next time step
             self.r.sleep()
+
+        if self.pipeline:
+            self.wait_for_learning()
+            self.learning_worker.close()
+        if self.feature_pipeline is not None:
+            self.feature_pipeline.close()
+        if self.vis:
+            self.visualization.close()
         if self.COLLECT_DATA_FLAG:
-            self.history.close()
+            self.recorder.close()
+        loginfo("Learning rate: {}".format(self.r.summary()))
 
 
 def start_learning_foreground(time_scale,
@@ -440,7 +667,16 @@ def start_learning_foreground(time_scale,
                               control_gvf=None,
                               cumulant_counter=None,
                               reset_episode=None,
-                              custom_stats=None):
+                              custom_stats=None,
+                              pipeline=False,
+                              feature_processes=False,
+                              profile=False,
+                              stats_period=1,
+                              batch_stats=False,
+                              schedule_updates=False,
+                              action_channel=None,
+                              action_thread=False,
+                              transport=None):
     """Function to call with multiprocessing or multithreading.
     """
     try:
@@ -451,8 +687,18 @@ def start_learning_foreground(time_scale,
                                         stats,
                                         control_gvf,
                                         cumulant_counter,
-                                        reset_episode)
+                                        reset_episode,
+                                        custom_stats,
+                                        pipeline,
+                                        feature_processes,
+                                        profile,
+                                        stats_period,
+                                        batch_stats,
+                                        schedule_updates,
+                                        action_channel,
+                                        action_thread,
+                                        transport)
 
         foreground.run()
-    except rospy.ROSInterruptException as detail:
-        rospy.loginfo("Handling: {}".format(detail))
+    except ROSInterruptException as detail:
+        loginfo("Handling: {}".format(detail))
@@ -28,6 +28,14 @@ class Policy:
         feature_indices (numpy array of bool, optional): Indices of the
             feature vector corresponding to indices used by the
             :py:obj:`value_function`.
+        q_function (fun, optional): A function of ``phi`` returning the
+            value of every action in ``action_space`` at once. Defaults
+            to the ``q_all`` method of the learner that owns
+            ``value_function``, if it has one.
+        action_key (fun, optional): Function mapping an action to a
+            hashable key, used to look up action ids in constant time.
+            If ``None``, actions are found by scanning ``action_space``
+            with ``action_equality``.
 
     Attributes:
         action_space (numpy array of action): Numpy array containing
@@ -47,6 +55,11 @@ class Policy:
             ``action_space``.
         last_index (int): The index of the last action chosen by the
             policy.
+        q_function (fun): A function of ``phi`` returning the value of
+            every action, or ``None`` if only ``value_function`` is
+            available.
+        action_index (dict): Maps the key of each action to its index in
+            ``action_space``. ``None`` if no ``action_key`` was given.
     """
 
     def __init__(self,
@@ -54,6 +67,8 @@ class Policy:
                  feature_indices=None,
                  value_function=None,
                  action_equality=tools.equal_twists,
+                 action_key=tools.twist_key,
+                 q_function=None,
                  *args,
                  **kwargs):
 
@@ -64,6 +79,17 @@ class Policy:
         self.feature_indices = feature_indices
         self.last_index = 0
 
+        if q_function is None:
+            learner = getattr(value_function, '__self__', None)
+            q_function = getattr(learner, 'q_all', None)
+        self.q_function = q_function
+
+        self.action_key = action_key
+        self.action_index = None
+        if action_key is not None:
+            self.action_index = tools.action_index(self.action_space,
+                                                   action_key)
+
     def update(self, phi, observation, *args, **kwargs):
         """Updates the probilities of taking each action
 
@@ -80,22 +106,67 @@ class Policy:
             **kwargs: Ignored. 
         """
         if self.value_function is not None:
-            phi = phi[self.feature_indices]
+            q_values = self.action_values(phi[self.feature_indices])
+
+            self.pi = q_values / q_values.sum()
+
+    def action_values(self, phi):
+        """Gets the value of each action in ``action_space``.
+
+        Uses ``q_function`` to evaluate all actions in one call when it
+        is available, and otherwise calls ``value_function`` once per
+        action.
+
+        Args:
+            phi (numpy array of bool): Feature vector already indexed
+                by ``feature_indices``.
+
+        Returns:
+            numpy array of float: Value of each action.
+        """
+        if self.q_function is not None:
+            return np.asarray(self.q_function(phi), dtype=float)
 
-            q_fun = np.vectorize(lambda a: self.value_function(phi, a))
-            q_values = q_fun(self.action_space)
+        q_fun = np.vectorize(lambda a: self.value_function(phi, a))
+        return np.asarray(q_fun(self.action_space), dtype=float)
 
-            self.pi = np.array(q_values) / q_values.sum()
+    def get_action_id(self, action):
+        """Get the index of the provided action in ``action_space``.
+
+        Throws an error if the provided action is not equal to an action
+        in ``action_space``.
+
+        Args:
+            action (action or int): Action to look up. Integers are
+                assumed to already be action ids and are returned as is.
+
+        Returns:
+            Index of ``action`` in ``action_space``.
+        """
+        if tools.is_action_id(action):
+            return action
+
+        if self.action_index is not None:
+            return self.action_index[self.action_key(action)]
+
+        equal_action = lambda i: self.action_equality(action,
+                                                      self.action_space[i])
+        indices = list(filter(equal_action, range(self.action_space.size)))
+        assert len(indices) > 0
+
+        return indices[0]
 
     def get_probability(self, action, choice=True, *args, **kwargs):
         """Get the probability of taking the provided action.
 
         This function can usually be used without being overwritten.
         Throws an error if the provided action is not equal to an action
-        in ``action_space`` according to ``action_equality``.
+        in ``action_space``.
 
         Args:
-            action (action): Find the probability of this action.
+            action (action or int): Find the probability of this action,
+                given either as an action or as its index in
+                ``action_space``.
             choice (bool): If set to true, updates ``last_index``.
             *args: Ignored.
             **kwargs: Ignored. 
@@ -103,18 +174,33 @@ class Policy:
         Returns:
             Float from ``pi`` corresponding to ``action``. 
         """
-        equal_action = lambda i: self.action_equality(action,
-                                                      self.action_space[i])
-        indices = list(filter(equal_action, range(self.action_space.size)))
-        assert len(indices) > 0
-
-        index = indices[0]
+        index = self.get_action_id(action)
 
         if choice:
             self.last_index = index
 
         return self.pi[index]
 
+    def choose_action_id(self, *args, **kwargs):
+        """Updates ``last_index`` by sampling an action id from ``pi``.
+
+        Samples by inverting the cumulative distribution of ``pi``,
+        which avoids the validation ``np.random.choice`` does on every
+        call.
+
+        Args:
+            *args: Ignored.
+            **kwargs: Ignored.
+
+        Returns:
+            Sampled index of ``action_space``.
+        """
+        cdf = np.cumsum(self.pi)
+        index = int(np.searchsorted(cdf, np.random.random() * cdf[-1],
+                                    side='right'))
+        self.last_index = min(index, self.action_space.size - 1)
+        return self.last_index
+
     def choose_action(self, *args, **kwargs):
         """Updates ``last_index`` and chooses an action according to ``pi``.
 
@@ -125,5 +211,108 @@ class Policy:
         Returns:
             Action at the sampled index.
         """
-        self.last_index = np.random.choice(self.action_space.size, p=self.pi)
-        return self.action_space[self.last_index]
+        return self.action_space[self.choose_action_id(*args, **kwargs)]
+
+
+class BatchPolicy:
+    """Parent class for policies of many independent agents at once.
+
+    Keeps one row of action probabilities per agent, and samples the
+    actions of all agents together. Inherit this class and override
+    :py:meth:`update` to make a batched policy; as is, every action is
+    equally likely.
+
+    Args:
+        action_space (numpy array of action): Actions available to every
+            agent.
+        num_agents (int): Number of agents.
+        feature_indices (numpy array of bool, optional): Indices of the
+            feature vectors used by the policy.
+        random (numpy RandomState, optional): Source of the sampled
+            actions.
+
+    Attributes:
+        pi (numpy array of float): Action probabilities, one row per
+            agent.
+        last_index (numpy array of int): Last action id chosen for each
+            agent.
+    """
+
+    def __init__(self,
+                 action_space,
+                 num_agents,
+                 feature_indices=None,
+                 random=None):
+        self.action_space = np.asarray(action_space)
+        self.num_agents = num_agents
+        self.feature_indices = feature_indices
+        self.random = random or np.random
+        self.pi = np.ones((num_agents, self.action_space.size))
+        self.pi /= self.action_space.size
+        self.last_index = np.zeros(num_agents, dtype=int)
+        self.agents = np.arange(num_agents)
+
+    def update(self, phi, observations):
+        """Updates :py:attr:`pi` for a batch of states.
+
+        Args:
+            phi (numpy array): Feature vectors, one row per agent.
+            observations (dict): Maps each observation name to an array
+                with one entry per agent.
+        """
+        pass
+
+    def choose_action_ids(self):
+        """Samples an action id for every agent from its row of ``pi``.
+
+        Returns:
+            numpy array of int: Sampled index of ``action_space`` for each
+                agent.
+        """
+        cdf = np.cumsum(self.pi, axis=1)
+        draws = self.random.random_sample(self.num_agents) * cdf[:, -1]
+        indices = (cdf <= draws[:, np.newaxis]).sum(axis=1)
+        self.last_index = np.minimum(indices, self.action_space.size - 1)
+        return self.last_index
+
+    def get_probabilities(self, action_ids):
+        """Gets each agent's probability of taking its action.
+
+        Args:
+            action_ids (numpy array of int): Action id of each agent.
+
+        Returns:
+            numpy array of float: Probability of each action.
+        """
+        return self.pi[self.agents, action_ids]
+
+
+class PolicyList(BatchPolicy):
+    """Runs one ordinary :py:class:`Policy` per agent as a batch.
+
+    Any policy can be batched this way, at the cost of a Python call per
+    agent on each update.
+
+    Args:
+        policies (list of Policy): Policy of each agent.
+    """
+
+    def __init__(self, policies, random=None):
+        BatchPolicy.__init__(self,
+                             policies[0].action_space,
+                             len(policies),
+                             random=random)
+        self.policies = policies
+
+    def update(self, phi, observations):
+        for i, policy in enumerate(self.policies):
+            policy.update(phi[i],
+                          {key: value[i]
+                           for key, value in observations.items()})
+            self.pi[i] = policy.pi
+
+    def choose_action_ids(self):
+        action_ids = BatchPolicy.choose_action_ids(self)
+        for policy, action_id in zip(self.policies, action_ids):
+            policy.last_index = action_id
+        return action_ids
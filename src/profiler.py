@@ -0,0 +1,212 @@
+"""Low-overhead latency profiling of the learning loop.
+
+Stages of the loop are timed into fixed-bucket histograms, from which
+:py:class:`Profiler` periodically reports percentiles, maxima and overrun
+counts to a file and, optionally, a topic. Profiling is off by default;
+while it is off, :py:meth:`Profiler.stage` returns a shared do-nothing
+context manager and :py:func:`tools.timing` calls the function directly.
+
+Example::
+
+    from profiler import profiler
+
+    profiler.enable(deadline=0.06)
+    with profiler.stage('policy'):
+        policy.update(phi, observation)
+"""
+from __future__ import division
+
+import json
+import math
+import time
+from threading import Lock
+
+import numpy as np
+
+
+class LatencyHistogram:
+    """Histogram of latencies with logarithmically spaced buckets.
+
+    Buckets are 20 per decade from 1 microsecond to 100 seconds, so
+    percentiles are accurate to about 12%.
+
+    Args:
+        deadline (float, optional): Latencies above this many seconds
+            are counted as overruns.
+    """
+
+    MIN_LATENCY = 1e-6
+    BUCKETS_PER_DECADE = 20
+    NUM_BUCKETS = 8 * BUCKETS_PER_DECADE + 1
+    LOG_RATIO = math.log(10) / BUCKETS_PER_DECADE
+
+    # upper edge of each bucket
+    EDGES = MIN_LATENCY * np.exp(LOG_RATIO * np.arange(NUM_BUCKETS))
+
+    def __init__(self, deadline=None):
+        self.deadline = deadline
+        self.counts = np.zeros(self.NUM_BUCKETS, dtype=int)
+        self.count = 0
+        self.max = 0.0
+        self.overruns = 0
+
+    def add(self, seconds):
+        if seconds <= self.MIN_LATENCY:
+            bucket = 0
+        else:
+            bucket = int(math.ceil(math.log(seconds / self.MIN_LATENCY) /
+                                   self.LOG_RATIO))
+            bucket = min(bucket, self.NUM_BUCKETS - 1)
+
+        self.counts[bucket] += 1
+        self.count += 1
+        self.max = max(self.max, seconds)
+        if self.deadline is not None and seconds > self.deadline:
+            self.overruns += 1
+
+    def percentile(self, q):
+        """Upper bound of the ``q`` th percentile latency in seconds."""
+        if not self.count:
+            return 0.0
+        cumulative = np.cumsum(self.counts)
+        bucket = np.searchsorted(cumulative, q / 100 * self.count)
+        return float(min(self.EDGES[bucket], self.max))
+
+    def summary(self):
+        return {'count': self.count,
+                'p50': self.percentile(50),
+                'p95': self.percentile(95),
+                'p99': self.percentile(99),
+                'max': self.max,
+                'overruns': self.overruns}
+
+
+class NullStage:
+    """Context manager that does nothing, used while profiling is off."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+
+NULL_STAGE = NullStage()
+
+
+class Stage:
+    """Context manager that times its body into a histogram."""
+
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+        self.start = 0.0
+
+    def __enter__(self):
+        self.start = time.time()
+        return self
+
+    def __exit__(self, *args):
+        self.profiler.record(self.name, time.time() - self.start)
+        return False
+
+
+class Profiler:
+    """Collects per-stage latency histograms and reports them.
+
+    Attributes:
+        enabled (bool): Whether stages are being timed.
+        histograms (dict): Maps stage names to their
+            :py:class:`LatencyHistogram`.
+        steps (int): Number of timesteps ended since the last report.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.histograms = {}
+        self.lock = Lock()
+        self.steps = 0
+
+        self.deadline = None
+        self.report_every = None
+        self.path = None
+        self.publish = None
+
+    def enable(self, deadline=None, report_every=500,
+               path='profile.jsonl', publish=None):
+        """Starts timing stages.
+
+        Args:
+            deadline (float, optional): Length of a timestep in seconds.
+                Timesteps that take longer are counted as overruns.
+            report_every (int): Number of timesteps between reports.
+            path (str, optional): File to append a JSON line to for each
+                report.
+            publish (fun, optional): Function called with the JSON
+                string of each report, e.g. a ROS publisher's
+                ``publish``.
+        """
+        self.deadline = deadline
+        self.report_every = report_every
+        self.path = path
+        self.publish = publish
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+
+    def stage(self, name):
+        """Context manager that times its body as stage ``name``."""
+        if not self.enabled:
+            return NULL_STAGE
+        return Stage(self, name)
+
+    def record(self, name, seconds):
+        """Adds a latency measurement to the histogram of ``name``."""
+        with self.lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = LatencyHistogram()
+                self.histograms[name] = histogram
+            histogram.add(seconds)
+
+    def end_step(self, seconds):
+        """Records the length of a timestep and reports if it is time to.
+        """
+        if not self.enabled:
+            return
+
+        with self.lock:
+            if 'step' not in self.histograms:
+                self.histograms['step'] = LatencyHistogram(self.deadline)
+        self.record('step', seconds)
+
+        self.steps += 1
+        if self.steps >= self.report_every:
+            self.report()
+
+    def summary(self):
+        with self.lock:
+            return {name: histogram.summary()
+                    for name, histogram in self.histograms.items()}
+
+    def report(self):
+        """Writes and publishes a summary of every stage, then resets.
+        """
+        message = json.dumps({'time': time.time(),
+                              'stages': self.summary()},
+                             sort_keys=True)
+        if self.path is not None:
+            with open(self.path, 'a') as f:
+                f.write(message + '\n')
+        if self.publish is not None:
+            self.publish(message)
+
+        with self.lock:
+            self.histograms = {}
+        self.steps = 0
+
+
+""" profiler shared by every module of the process
+"""
+profiler = Profiler()
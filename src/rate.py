@@ -0,0 +1,163 @@
+"""Keeps a loop running at a fixed period on the monotonic clock.
+
+``rospy.Rate`` takes a whole number of hertz, so a 0.06 second timestep
+became ``rospy.Rate(16)``, i.e. 0.0625 seconds, and it reports nothing
+about how late each wake-up was. :py:class:`PreciseRate` schedules
+ticks at exact multiples of a fractional period, so small delays do not
+accumulate into drift. It counts overruns and records how late each
+wake-up was.
+
+Example::
+
+    rate = PreciseRate(0.06, name='learning')
+    while not rospy.is_shutdown():
+        step()
+        rate.sleep()
+"""
+from __future__ import division
+
+import math
+import time
+
+from profiler import LatencyHistogram, profiler
+
+try:
+    from time import monotonic
+except ImportError:
+    # python 2 has no monotonic clock in the standard library
+    import ctypes
+    import os
+
+    class _Timespec(ctypes.Structure):
+        _fields_ = [('tv_sec', ctypes.c_long), ('tv_nsec', ctypes.c_long)]
+
+    _CLOCK_MONOTONIC = 1
+    _librt = ctypes.CDLL('librt.so.1', use_errno=True)
+    _clock_gettime = _librt.clock_gettime
+    _clock_gettime.argtypes = [ctypes.c_int, ctypes.POINTER(_Timespec)]
+
+    def monotonic():
+        """Seconds on the monotonic clock, from an arbitrary start."""
+        t = _Timespec()
+        if _clock_gettime(_CLOCK_MONOTONIC, ctypes.pointer(t)) != 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno))
+        return t.tv_sec + t.tv_nsec * 1e-9
+
+
+class WallClock:
+    """Real time, read from the monotonic clock."""
+
+    def time(self):
+        return monotonic()
+
+    def sleep(self, seconds):
+        time.sleep(seconds)
+
+    def wait(self, event, seconds):
+        """Waits up to ``seconds`` for ``event``; returns whether it was
+        set.
+        """
+        return event.wait(seconds)
+
+
+class PreciseRate:
+    """Sleeps until the next tick of a fixed-period schedule.
+
+    Ticks are at ``start + k * period``. A call to :py:meth:`sleep` that
+    comes after its tick is due returns immediately. If the loop fell
+    behind by whole periods, the rate either catches up, returning
+    immediately until the schedule is met again, or skips the ticks it
+    missed entirely.
+
+    Args:
+        period (float): Seconds between ticks.
+        catch_up (bool): Whether to run missed ticks back to back after
+            an overrun instead of skipping them.
+        name (str, optional): Name under which wake-up lateness is also
+            recorded into the :doc:`profiler` while it is enabled.
+        clock (optional): Clock to read and sleep on, with the methods of
+            :py:class:`WallClock`, which is the default. A simulated clock
+            such as :py:class:`~transport.VirtualClock` makes the rate run
+            as fast as the loop allows.
+
+    Attributes:
+        ticks (int): Number of ticks so far.
+        overruns (int): Number of calls to :py:meth:`sleep` made after
+            their tick was already due.
+        skipped (int): Number of ticks skipped after overruns.
+        jitter (LatencyHistogram): Seconds between each tick and the
+            wake-up for it.
+    """
+
+    def __init__(self, period, catch_up=False, name=None, clock=None):
+        self.period = period
+        self.catch_up = catch_up
+        self.name = name
+        self.clock = clock or WallClock()
+
+        self.ticks = 0
+        self.overruns = 0
+        self.skipped = 0
+        self.jitter = LatencyHistogram()
+
+        self.start = self.clock.time()
+        self.last_tick = self.start
+
+    def remaining(self):
+        """Seconds until the next tick; negative if it is overdue."""
+        return self.last_tick + self.period - self.clock.time()
+
+    def sleep(self, event=None):
+        """Sleeps until the next tick.
+
+        If the tick is already due, returns immediately.
+
+        Args:
+            event (Event, optional): Event that ends the sleep early when
+                set. The tick is then still pending.
+
+        Returns:
+            bool: Whether ``event`` ended the sleep.
+        """
+        tick = self.last_tick + self.period
+        now = self.clock.time()
+
+        if now > tick:
+            self.overruns += 1
+            if not self.catch_up:
+                missed = int(math.floor((now - tick) / self.period))
+                self.skipped += missed
+                tick += missed * self.period
+        elif event is not None:
+            if self.clock.wait(event, tick - now):
+                return True
+            now = self.clock.time()
+        else:
+            self.clock.sleep(tick - now)
+            now = self.clock.time()
+
+        lateness = max(now - tick, 0.0)
+        self.jitter.add(lateness)
+        if self.name is not None and profiler.enabled:
+            profiler.record('rate/' + self.name, lateness)
+
+        self.last_tick = tick
+        self.ticks += 1
+        return False
+
+    def summary(self):
+        """Tick counts, overruns and wake-up lateness percentiles.
+
+        Returns:
+            dict: Summary of the rate, suitable for logging.
+        """
+        elapsed = self.last_tick - self.start
+        summary = self.jitter.summary()
+        summary.update({'period': self.period,
+                        'ticks': self.ticks,
+                        'overruns': self.overruns,
+                        'skipped': self.skipped,
+                        'mean_period': (elapsed / self.ticks if self.ticks
+                                        else self.period)})
+        return summary
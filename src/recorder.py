@@ -0,0 +1,126 @@
+"""Records sensor data and actions into chunked numpy files.
+
+Each timestep fills one row of a fixed set of columns held in memory.
+Full chunks are handed to a background thread that writes them with
+``np.savez``, so recording costs the learning loop little more than a few
+array assignments. :py:func:`load_recording` concatenates the chunks back
+into one array per column.
+"""
+from __future__ import division
+
+import glob
+from Queue import Queue
+from threading import Thread
+
+import numpy as np
+
+from state_representation import StateConstants
+
+""" columns mapped to their per-row shape, dtype and value when missing
+"""
+COLUMNS = {
+    'time': ((), float, np.nan),
+    'step_time': ((), float, np.nan),
+    'bump': ((3,), bool, False),
+    'charging': ((), bool, False),
+    'ir': ((3,), np.int32, -1),
+    'odom': ((4,), float, np.nan),
+    'imu': ((), float, np.nan),
+    'action_id': ((), np.int32, -1),
+    'mu': ((), float, np.nan),
+    'image_stamp': ((), float, np.nan),
+    'pixels': ((StateConstants.NUM_RANDOM_POINTS, StateConstants.CHANNELS),
+               np.uint8, 0),
+}
+
+
+def chunk_path(prefix, index):
+    return '{}_{:05d}.npz'.format(prefix, index)
+
+
+class SensorRecorder:
+    """Appends one row per timestep to chunked column files.
+
+    Args:
+        prefix (str): Path prefix of the chunk files.
+        chunk_size (int): Number of rows per chunk file.
+
+    Attributes:
+        rows (int): Number of rows recorded so far.
+    """
+
+    def __init__(self, prefix, chunk_size=1000):
+        self.prefix = prefix
+        self.chunk_size = chunk_size
+        self.rows = 0
+
+        self.num_chunks = 0
+        self.chunk = None
+        self.row = 0
+        self.new_chunk()
+
+        self.to_write = Queue()
+        self.writer = Thread(target=self.write_loop, name='recorder')
+        self.writer.daemon = True
+        self.writer.start()
+
+    def new_chunk(self):
+        self.chunk = {name: np.full((self.chunk_size,) + shape, missing,
+                                    dtype=dtype)
+                      for name, (shape, dtype, missing) in COLUMNS.items()}
+        self.row = 0
+
+    def record(self, **values):
+        """Sets columns of the current row. ``None`` values are skipped.
+        """
+        for name, value in values.items():
+            if value is not None:
+                self.chunk[name][self.row] = value
+
+    def end_step(self):
+        """Moves on to the next row, handing off the chunk if it is full.
+        """
+        self.row += 1
+        self.rows += 1
+        if self.row == self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        """Hands the current rows to the writer thread."""
+        if self.row == 0:
+            return
+        chunk = {name: column[:self.row]
+                 for name, column in self.chunk.items()}
+        self.to_write.put((chunk_path(self.prefix, self.num_chunks), chunk))
+        self.num_chunks += 1
+        self.new_chunk()
+
+    def write_loop(self):
+        while True:
+            item = self.to_write.get()
+            if item is None:
+                break
+            path, chunk = item
+            np.savez(path, **chunk)
+
+    def close(self):
+        """Writes the remaining rows and waits for the writer to finish.
+        """
+        self.flush()
+        self.to_write.put(None)
+        self.writer.join()
+
+
+def load_recording(prefix):
+    """Loads every chunk written with ``prefix``.
+
+    Returns:
+        dict: Maps each column name to an array with one row per
+            recorded timestep.
+    """
+    paths = sorted(glob.glob('{}_[0-9]*.npz'.format(prefix)))
+    chunks = [np.load(path) for path in paths]
+    if not chunks:
+        return {}
+    return {name: np.concatenate([chunk[name] for chunk in chunks])
+            for name in chunks[0].files}
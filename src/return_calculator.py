@@ -12,59 +12,132 @@ the behavior policy to the target policy.
 
 from __future__ import division
 
-from Queue import Queue
-
 import geometry_msgs.msg as geom_msg
 import numpy as np
-import rospy
-from cv_bridge.core import CvBridge
 from std_msgs.msg import Bool
 
+from return_samples import ReturnSampleWriter
 import tools
+from topic_buffer import make_buffers
 from state_representation import StateConstants, StateManager
+from transport import (ROSInterruptException, RosTransport, logdebug,
+                       loginfo)
+
+
+def discounted_returns(cumulants, gammas):
+    """Computes the return from every step of a rollout.
+
+    Uses the backward recursion ``G[i] = c[i] + gamma[i] * G[i + 1]``, so
+    the cost is linear in the length of the rollout. Steps are along the
+    last axis, so the returns of several GVFs can be computed at once.
+
+    Args:
+        cumulants (numpy array): Cumulant observed at each step.
+        gammas (numpy array): Discount observed at each step.
+
+    Returns:
+        numpy array: ``G`` with one more step than ``cumulants``, where
+            ``G[..., i]`` is the return truncated at the end of the
+            rollout, ``sum_k c[k] * prod(gammas[i:k])`` for ``k >= i``,
+            and the last step is 0.
+    """
+    cumulants = np.asarray(cumulants, dtype=float)
+    gammas = np.asarray(gammas, dtype=float)
+    num_steps = cumulants.shape[-1]
+
+    returns = np.zeros(cumulants.shape[:-1] + (num_steps + 1,))
+    for i in range(num_steps - 1, -1, -1):
+        returns[..., i] = (cumulants[..., i] +
+                           gammas[..., i] * returns[..., i + 1])
+    return returns
 
 
 class ReturnCalculator:
+    """Collects samples of states and their actual return under the
+    target policy, for measuring MSRE.
+
+    GVFs that share a target policy share its rollouts: the observations
+    of a rollout are recorded once, and every GVF's cumulant and gamma
+    are evaluated on them afterwards. Groups with different target
+    policies take turns rolling out. Each GVF's samples are written to
+    their own files.
+
+    Args:
+        gvfs (GVF or list of GVF): GVFs to collect returns for.
+        target_policy (Policy, optional): Target policy of all ``gvfs``.
+            If ``None``, each GVF's own ``target_policy`` is used.
+        label_all_states (bool): Whether to also label each state visited
+            while following the target policy with its return truncated
+            at the end of the rollout, rather than only the state the
+            rollout started from.
+        min_label_horizon (int): Minimum number of rollout steps that
+            must follow a visited state for it to be labelled, unless its
+            return is already complete to within ``discount_tolerance``.
+        discount_tolerance (float): A rollout ends early, and the
+            behavior policy takes over again, once the product of the
+            discounts seen during it is at most this for every GVF being
+            rolled out. The default of 0 only ends rollouts at a
+            terminal gamma of 0, which leaves the returns unchanged.
+        transport (optional): Topics and clock to run on (see
+            :doc:`transport`). Defaults to a ROS node.
+    """
     def __init__(self,
                  time_scale,
-                 gvf,
+                 gvfs,
                  num_features,
                  features_to_use,
                  behavior_policy,
-                 target_policy):
+                 target_policy=None,
+                 label_all_states=False,
+                 min_label_horizon=50,
+                 discount_tolerance=0.0,
+                 transport=None):
 
-        self.features_to_use = set(features_to_use + ['core', 'ir'])
-        topics = filter(lambda x: x,
-                        [tools.features[f] for f in self.features_to_use])
+        # set up ros, or whatever stands in for it
+        self.transport = transport or RosTransport()
+        self.transport.init_node('agent')
 
+        self.features_to_use = set(features_to_use + ['core', 'ir'])
         # set up dictionary to receive sensor info
-        self.recent = {topic: Queue(0) for topic in topics}
-
-        # set up ros
-        rospy.init_node('agent', anonymous=True)
+        self.recent = make_buffers(self.features_to_use,
+                                   threaded=self.transport.asynchronous)
+        topics = self.recent.keys()
 
         # setup sensor parsers
         for topic in topics:
-            rospy.Subscriber(topic,
-                             tools.topic_format[topic],
-                             self.recent[topic].put)
+            self.transport.subscribe(topic,
+                                     tools.topic_format[topic],
+                                     self.recent[topic].put)
         self.topics = topics
 
-        rospy.loginfo("Started sensor threads.")
+        loginfo("Started sensor threads.")
 
         # smooth out the actions
         self.time_scale = time_scale
-        self.r = rospy.Rate(int(1.0 / self.time_scale))
+        self.r = self.transport.rate(self.time_scale,
+                                     name='return_calculator')
 
         # agent info
-        self.gvf = gvf
-        self.target_policy = target_policy
+        if not isinstance(gvfs, (list, tuple)):
+            gvfs = [gvfs]
+        self.gvfs = gvfs
         self.behavior_policy = behavior_policy
 
+        # GVFs grouped by target policy, as (policy, list of GVF) pairs
+        self.groups = []
+        group_index = {}
+        for gvf in gvfs:
+            policy = target_policy or gvf.target_policy
+            if id(policy) not in group_index:
+                group_index[id(policy)] = len(self.groups)
+                self.groups.append((policy, []))
+            self.groups[group_index[id(policy)]][1].append(gvf)
+        self.group = 0
+        self.target_policy = self.groups[0][0]
+
         self.state_manager = StateManager(features_to_use)
         self.feature_indices = np.concatenate(
                 [StateConstants.indices_in_phi[f] for f in features_to_use])
-        self.img_to_cv2 = CvBridge().compressed_imgmsg_to_cv2
 
         # information for managing the shift between the target and behavior
         #  policies
@@ -79,25 +152,37 @@ class ReturnCalculator:
         self.steps_under_mu = self.fixed_step_under_mu + np.random.randint(
             self.mu_max_horizon)
 
-        # MSRE information
+        # MSRE information, stored sparsely (see :doc:`return_samples`)
         self.sample_size = 1000
-        self.samples_phi = np.zeros((self.sample_size, num_features))
-        self.samples_G = np.zeros(self.sample_size)
+        self.samples = {gvf: ReturnSampleWriter(gvf.name, num_features)
+                        for gvf in gvfs}
+        self.start_active = None
+
+        self.observation_buffer = [None] * self.fixed_steps_under_pi
 
-        self.cumulant_buffer = np.zeros(self.fixed_steps_under_pi)
-        self.gamma_buffer = np.zeros(self.fixed_steps_under_pi)
+        # discounts of each GVF in the rolled out group, seen online to
+        # end rollouts whose remaining discount mass is negligible
+        self.discount_tolerance = discount_tolerance
+        self.gamma_buffer = np.zeros((max(len(g) for _, g in self.groups),
+                                      self.fixed_steps_under_pi))
+        self.horizons = []
+
+        # states visited under the target policy, to label them as well
+        self.label_all_states = label_all_states
+        self.min_label_horizon = min_label_horizon
+        self.active_buffer = [None] * self.fixed_steps_under_pi
 
         # Set up publishers
-        action_publisher = rospy.Publisher('action_cmd',
-                                           geom_msg.Twist,
-                                           queue_size=1)
-        termination_publisher = rospy.Publisher('termination',
-                                                Bool,
-                                                queue_size=1)
+        action_publisher = self.transport.publisher('action_cmd',
+                                                    geom_msg.Twist,
+                                                    queue_size=1)
+        termination_publisher = self.transport.publisher('termination',
+                                                         Bool,
+                                                         queue_size=1)
         self.publishers = {'action': action_publisher,
                            'termination': termination_publisher
                            }
-        rospy.loginfo("Done LearningForeground init.")
+        loginfo("Done LearningForeground init.")
 
     def create_state(self):
         # bumper constants from
@@ -110,25 +195,19 @@ class ReturnCalculator:
 
         # build data (used to make phi)
         data = {sensor: None for sensor in sensors}
+        read = {}
         for source in sensors - {'ir'}:
-            temp = None
-            try:
-                while True:
-                    temp = self.recent[tools.features[source]].get_nowait()
-            except:
-                pass
-            data[source] = temp
-
-        temp = []
-        try:
-            while True:
-                temp.append(self.recent[tools.features['ir']].get_nowait())
-        except:
-            pass
-
-        # use only the last 10 values, helpful at the end of episode when we
-        #  have accumulated at lot or IR data
-        data['ir'] = temp[-10:] if temp else None
+            # features that share a topic share its value
+            stream = tools.features.get(source)
+            if stream not in read:
+                buff = self.recent.get(stream)
+                read[stream] = buff.take_latest() if buff is not None else None
+            data[source] = read[stream]
+
+        # the ir buffer keeps only the last few values, helpful at the end
+        # of episode when we have accumulated at lot or IR data
+        temp = self.recent[tools.features['ir']].take_all()
+        data['ir'] = temp if temp else None
 
         if data['core'] is not None:
             bump = data['core'].bumper
@@ -144,7 +223,7 @@ class ReturnCalculator:
             data['ir'] = [int(''.join([str(i) for i in ir_temp]), 2) for
                           ir_temp in ir]
         if data['image'] is not None:
-            data['image'] = np.asarray(self.img_to_cv2(data['image']))
+            data['image'] = data['image'].pixels
         if data['odom'] is not None:
             pos = data['odom'].pose.pose.position
             data['odom'] = np.array([pos.x, pos.y])
@@ -168,22 +247,92 @@ class ReturnCalculator:
     def take_action(self, action):
         self.publishers['action'].publish(action)
 
-    def update_return_buffers(self, index, observations):
-        self.cumulant_buffer[index] = self.gvf.cumulant(observations)
-        self.gamma_buffer[index] = self.gvf.gamma(observations)
-
-    def compute_return(self, sample_number):
-        G = 0.0
-        for i in range(self.fixed_steps_under_pi):
-            gamma = 1
-            for j in range(i):
-                gamma = gamma * self.gamma_buffer[j]
-            G = G + gamma * self.cumulant_buffer[i]
-        print("----------------------------------")
-        print("computed return: ", G)
-        print("----------------------------------")
-
-        self.samples_G[sample_number] = G
+    def update_return_buffers(self, index, observations, phi):
+        self.observation_buffer[index] = observations
+        gvfs = self.groups[self.group][1]
+        self.gamma_buffer[:len(gvfs), index] = [gvf.gamma(observations)
+                                                for gvf in gvfs]
+        if self.label_all_states:
+            self.active_buffer[index] = np.flatnonzero(
+                    phi[self.feature_indices])
+
+    def rollout_finished(self, num_steps):
+        """Whether the rollout should end after ``num_steps`` steps.
+
+        Rollouts end after :py:attr:`fixed_steps_under_pi` steps, or as
+        soon as the discount product, which weighs every later cumulant,
+        is at most :py:attr:`discount_tolerance` for each GVF.
+        """
+        if num_steps == self.fixed_steps_under_pi:
+            return True
+        gvfs = self.groups[self.group][1]
+        gammas = self.gamma_buffer[:len(gvfs), :num_steps]
+        return np.all(np.prod(gammas, axis=1) <= self.discount_tolerance)
+
+    def compute_return(self, horizon):
+        """Stores the returns of the finished rollout for each GVF of
+        the rolled out group.
+
+        The state the rollout started from, :py:attr:`start_active`, gets
+        the full return. If :py:attr:`label_all_states` is set, states
+        visited during the rollout are appended after it with their
+        truncated returns. Each sample records the number of rollout
+        steps its return covers.
+
+        Args:
+            horizon (int): Number of steps the rollout lasted.
+
+        Returns:
+            int: Number of samples stored so far for the group.
+        """
+        gvfs = self.groups[self.group][1]
+        observations = self.observation_buffer[:horizon]
+        cumulants = [[gvf.cumulant(obs) for obs in observations]
+                     for gvf in gvfs]
+        gammas = self.gamma_buffer[:len(gvfs), :horizon]
+        returns = discounted_returns(cumulants, gammas)
+        logdebug("Rollout of {} steps, returns of the first state: "
+                 "{}".format(horizon, returns[:, 0]))
+        self.horizons.append(horizon)
+
+        # the return of the state seen at step k starts at step k + 1
+        labelled = []
+        if self.label_all_states:
+            # discount left at the end of the rollout for each state
+            tails = np.ones((len(gvfs), horizon))
+            tails[:, :-1] = np.cumprod(gammas[:, :0:-1], axis=1)[:, ::-1]
+            complete = np.all(tails <= self.discount_tolerance, axis=0)
+            steps_after = horizon - 1 - np.arange(horizon)
+            labelled = np.flatnonzero(complete |
+                                      (steps_after >= self.min_label_horizon))
+
+            num_samples = self.samples[gvfs[0]].size
+            labelled = labelled[:max(self.sample_size - num_samples - 1, 0)]
+
+        for gvf, gvf_returns in zip(gvfs, returns):
+            samples = self.samples[gvf]
+            samples.append(self.start_active, gvf_returns[0], horizon)
+            for k in labelled:
+                samples.append(self.active_buffer[k],
+                               gvf_returns[k + 1],
+                               horizon - 1 - k)
+
+        return self.samples[gvfs[0]].size
+
+    def next_group(self):
+        """Picks the group of GVFs to roll out next, in turns among the
+        groups that still need samples.
+
+        Returns:
+            int: Index into :py:attr:`groups`, or ``None`` if every group
+                has :py:attr:`sample_size` samples.
+        """
+        for offset in range(1, len(self.groups) + 1):
+            group = (self.group + offset) % len(self.groups)
+            gvfs = self.groups[group][1]
+            if self.samples[gvfs[0]].size < self.sample_size:
+                return group
+        return None
 
     def run(self):
 
@@ -191,20 +340,19 @@ class ReturnCalculator:
         num_steps_followed_mu = 0
         num_steps_followed_pi = 0
 
-        while not rospy.is_shutdown():
+        while not self.transport.is_shutdown():
 
             # start_time = time.time()
             # get new state
             phi, observations = self.create_state()
 
-            print("-------------------------------------")
-            print("num_steps_followed_mu:", num_steps_followed_mu)
-            print("num_steps_followed_pi:", num_steps_followed_pi)
-            print("current_condition:", self.current_condition)
-            print("fixed_steps_under_pi:", self.fixed_steps_under_pi)
-            print("steps_under_mu:", self.steps_under_mu)
-            print("sample_number:", sample_number)
-            print("-------------------------------------")
+            logdebug("Steps under mu: {}/{}, under pi: {}/{}, condition: "
+                     "{}, samples: {}".format(num_steps_followed_mu,
+                                              self.steps_under_mu,
+                                              num_steps_followed_pi,
+                                              self.fixed_steps_under_pi,
+                                              self.current_condition,
+                                              sample_number))
 
             # take action
             self.current_policy.update(phi, observations)
@@ -214,24 +362,36 @@ class ReturnCalculator:
             # update cumulant and gamma buffers if following the target policy
             if self.current_condition == self.following_pi:
                 self.update_return_buffers(index=num_steps_followed_pi,
-                                           observations=observations)
+                                           observations=observations,
+                                           phi=phi)
                 num_steps_followed_pi += 1
             elif self.current_condition == self.following_mu:
                 num_steps_followed_mu += 1
 
             # figure out which policy should be followed
-            if num_steps_followed_pi == self.fixed_steps_under_pi:
+            if (self.current_condition == self.following_pi and
+                    self.rollout_finished(num_steps_followed_pi)):
                 self.current_condition = self.following_mu
                 self.current_policy = self.behavior_policy
                 self.steps_under_mu = self.fixed_step_under_mu + \
                                       np.random.randint(
                     self.mu_max_horizon)
+                horizon = num_steps_followed_pi
                 num_steps_followed_pi = 0
 
-                # compute and store return
-                self.compute_return(sample_number)
-                sample_number = sample_number + 1
-                print("sample_number:", sample_number)
+                # compute and store return; every 10 samples are saved
+                sample_number = self.compute_return(horizon)
+                logdebug("Sample number: {}".format(sample_number))
+
+                # terminate once every group has sample_size samples
+                group = self.next_group()
+                if group is None:
+                    for samples in self.samples.values():
+                        samples.flush()
+                    self.publishers["termination"].publish(True)
+                    break
+                self.group = group
+                self.target_policy = self.groups[group][0]
 
             elif num_steps_followed_mu == self.steps_under_mu:
                 self.current_condition = self.following_pi
@@ -239,46 +399,35 @@ class ReturnCalculator:
                 num_steps_followed_mu = 0
 
                 # store phi
-                print("----------------------------------")
-                print("")
-                print("")
-                print("")
-                print("sample phi: ", np.sum(phi[self.feature_indices]))
-                print("----------------------------------")
-                self.samples_phi[sample_number, :] = phi[self.feature_indices]
-
-            # terminate if collected information for sample size
-            if sample_number % 10 == 0 and num_steps_followed_pi == (
-                self.fixed_steps_under_pi - 1):
-                np.savez("actual_return_{}.npz".format(self.gvf.name),
-                         _return=self.samples_G[:sample_number],
-                         samples=self.samples_phi[:sample_number, :],
-                         sample_size=sample_number)
-            if sample_number == self.sample_size:
-                np.savez("actual_return_{}.npz".format(self.gvf.name),
-                         _return=self.samples_G[:sample_number],
-                         samples=self.samples_phi[:sample_number, :],
-                         sample_size=sample_number)
-                self.publishers["termination"].publish(True)
-                break
+                logdebug("Active features of the sampled state: {}".format(
+                        np.sum(phi[self.feature_indices])))
+                self.start_active = np.flatnonzero(phi[self.feature_indices])
 
             # sleep until next time step
             self.r.sleep()
 
 
 def start_return_calculator(time_scale,
-                            GVF,
+                            GVFs,
                             num_features,
                             features_to_use,
                             behavior_policy,
-                            target_policy):
+                            target_policy=None,
+                            label_all_states=False,
+                            min_label_horizon=50,
+                            discount_tolerance=0.0,
+                            transport=None):
     try:
         return_calculator = ReturnCalculator(time_scale,
-                                             GVF,
+                                             GVFs,
                                              num_features,
                                              features_to_use,
                                              behavior_policy,
-                                             target_policy)
+                                             target_policy,
+                                             label_all_states,
+                                             min_label_horizon,
+                                             discount_tolerance,
+                                             transport)
         return_calculator.run()
-    except rospy.ROSInterruptException as detail:
-        rospy.loginfo("Handling: {}".format(detail))
+    except ROSInterruptException as detail:
+        loginfo("Handling: {}".format(detail))
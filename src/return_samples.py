@@ -0,0 +1,163 @@
+"""Stores sample states and their actual returns for measuring MSRE.
+
+Feature vectors are binary, so each sample state is kept as the indices
+of its active features. Samples are stored in compressed sparse row
+form: the active indices of all samples concatenated, plus the offset
+where each sample's indices start. The :py:class:`ReturnSampleWriter`
+appends samples in small chunk files instead of rewriting everything it
+has collected, and :py:func:`load_return_samples` joins the chunks back
+together.
+"""
+from __future__ import division
+
+import glob
+import os
+
+import numpy as np
+
+
+def sample_path(name):
+    return 'actual_return_{}.npz'.format(name)
+
+
+def sample_chunk_path(name, index):
+    return 'actual_return_{}_{:05d}.npz'.format(name, index)
+
+
+def sample_chunk_pattern(name):
+    return 'actual_return_{}_{}.npz'.format(name, '[0-9]' * 5)
+
+
+class ReturnSampleWriter:
+    """Appends sample states and returns to chunk files.
+
+    Args:
+        name (str): Name of the GVF the returns belong to.
+        num_features (int): Number of features of the GVF.
+        chunk_size (int): Number of samples per chunk file.
+
+    Attributes:
+        size (int): Number of samples appended so far.
+    """
+
+    def __init__(self, name, num_features, chunk_size=10):
+        self.name = name
+        self.num_features = num_features
+        self.chunk_size = chunk_size
+        self.size = 0
+
+        # start a new collection rather than appending to an old one
+        for path in glob.glob(sample_chunk_pattern(name)):
+            os.remove(path)
+        self.num_chunks = 0
+
+        self.active = []
+        self.returns = []
+        self.horizons = []
+
+    def append(self, active, G, horizon=-1):
+        """Adds a sample.
+
+        Args:
+            active (numpy array of int): Indices of the sample state's
+                active features.
+            G (float): Actual return from the sample state.
+            horizon (int): Number of steps the return covers, or -1 if
+                unknown.
+        """
+        self.active.append(np.asarray(active, dtype=np.int32))
+        self.returns.append(G)
+        self.horizons.append(horizon)
+        self.size += 1
+        if len(self.returns) == self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        """Writes the samples appended since the last flush."""
+        if not self.returns:
+            return
+
+        lengths = [len(active) for active in self.active]
+        np.savez(sample_chunk_path(self.name, self.num_chunks),
+                 indices=np.concatenate(self.active),
+                 indptr=np.concatenate([[0], np.cumsum(lengths)]),
+                 _return=np.array(self.returns),
+                 horizon=np.array(self.horizons, dtype=np.int32),
+                 num_features=self.num_features)
+        self.num_chunks += 1
+
+        self.active = []
+        self.returns = []
+        self.horizons = []
+
+
+class ReturnSamples:
+    """Sample states in sparse form, with their actual returns.
+
+    Args:
+        indices (numpy array of int): Active feature indices of every
+            sample, concatenated.
+        indptr (numpy array of int): Offset into ``indices`` where each
+            sample starts, followed by the length of ``indices``.
+        returns (numpy array of float): Actual return of each sample.
+        num_features (int): Number of features of the GVF.
+    """
+
+    def __init__(self, indices, indptr, returns, num_features):
+        self.indices = indices
+        self.indptr = indptr
+        self.returns = returns
+        self.num_features = num_features
+
+        # sample of each active index, for summing them per sample
+        self.rows = np.repeat(np.arange(len(returns)), np.diff(indptr))
+
+    def __len__(self):
+        return len(self.returns)
+
+    def predict(self, theta):
+        """Linear prediction of each sample state.
+
+        Args:
+            theta (numpy array): Weights of the GVF.
+
+        Returns:
+            numpy array of float: ``theta`` dotted with each sample.
+        """
+        return np.bincount(self.rows,
+                           weights=theta[self.indices],
+                           minlength=len(self))
+
+
+def load_return_samples(name):
+    """Loads every sample collected for the GVF ``name``.
+
+    Falls back to a single file of dense samples as written by older
+    versions of :doc:`return_calculator`.
+
+    Returns:
+        ReturnSamples: The samples.
+    """
+    paths = sorted(glob.glob(sample_chunk_pattern(name)))
+    chunks = [np.load(path) for path in paths]
+
+    if not chunks:
+        data = np.load(sample_path(name))
+        samples = data['samples'][:int(data['sample_size'])]
+        rows, indices = np.nonzero(samples)
+        indptr = np.searchsorted(rows, np.arange(len(samples) + 1))
+        return ReturnSamples(indices,
+                             indptr,
+                             data['_return'][:len(samples)],
+                             samples.shape[1])
+
+    offsets = np.cumsum([0] + [len(chunk['indices']) for chunk in chunks])
+    indptr = np.concatenate(
+            [[0]] + [chunk['indptr'][1:] + offset
+                     for chunk, offset in zip(chunks, offsets)])
+    indices = np.concatenate([chunk['indices'] for chunk in chunks])
+    returns = np.concatenate([chunk['_return'] for chunk in chunks])
+    return ReturnSamples(indices,
+                         indptr,
+                         returns,
+                         int(chunks[0]['num_features']))
@@ -0,0 +1,599 @@
+"""Headless kinematic simulation of a Turtlebot in a room with a dock.
+
+The simulator stands in for the robot's ROS topics. It moves a unicycle
+model around a rectangular room according to the ``Twist`` actions it is
+given, and produces messages shaped like the ones
+:py:meth:`~learning_foreground.LearningForeground.create_state` reads:
+kobuki core bumper and charger bits, dock IR bytes, IMU orientation,
+odometry and a ray-cast 640x480 camera image. Everything is plain NumPy,
+so it runs without a robot or ROS, as fast as the CPU allows.
+
+Example::
+
+    simulator = TurtlebotSimulator(seed=0)
+    for step in range(1000):
+        simulator.step(policy.choose_action(), 0.06)
+        for topic, message in simulator.messages(topics).items():
+            recent[topic].put(message)
+"""
+from __future__ import division
+
+import math
+
+import numpy as np
+
+import tools
+
+
+class Message(object):
+    """Stand-in for a ROS message; keyword arguments become attributes.
+    """
+
+    def __init__(self, **fields):
+        self.__dict__.update(fields)
+
+
+class Stamp(object):
+    """Stand-in for a ROS time stamp."""
+
+    def __init__(self, secs):
+        self.secs = secs
+
+    def to_sec(self):
+        return self.secs
+
+
+def vector3(x=0.0, y=0.0, z=0.0):
+    return Message(x=x, y=y, z=z)
+
+
+def wrap_angle(angle):
+    """Wraps an angle, or array of angles, into [-pi, pi)."""
+    return (angle + np.pi) % (2 * np.pi) - np.pi
+
+
+class Room:
+    """Rectangular room with a docking station against its bottom wall.
+
+    Args:
+        width (float): Size of the room along x, in metres.
+        height (float): Size of the room along y, in metres.
+        dock_x (float): Position of the dock along the bottom wall.
+
+    Attributes:
+        wall_colours (numpy array of uint8): RGB colour of the left,
+            right, bottom and top walls.
+    """
+
+    DOCK_WIDTH = 0.35
+
+    def __init__(self, width=3.0, height=3.0, dock_x=1.5):
+        self.width = width
+        self.height = height
+        self.dock = np.array([dock_x, 0.0])
+
+        self.wall_colours = np.array([[200, 60, 60],
+                                      [60, 200, 60],
+                                      [60, 60, 200],
+                                      [200, 200, 60]], dtype=np.uint8)
+        self.dock_colour = np.array([20, 20, 20], dtype=np.uint8)
+        self.floor_colour = np.array([120, 100, 80], dtype=np.uint8)
+        self.ceiling_colour = np.array([230, 230, 230], dtype=np.uint8)
+
+    def ray_cast(self, x, y, angles):
+        """Finds where rays from ``(x, y)`` hit the walls.
+
+        Args:
+            x (float or numpy array): Origin of the rays, broadcastable
+                against ``angles``.
+            y (float or numpy array): Origin of the rays.
+            angles (numpy array): Direction of each ray.
+
+        Returns:
+            (numpy array, numpy array): Distance to the hit and index of
+                the wall hit (left, right, bottom, top) for each ray.
+        """
+        cos, sin = np.cos(angles), np.sin(angles)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            distances = np.stack(np.broadcast_arrays(
+                    -x / cos,
+                    (self.width - x) / cos,
+                    -y / sin,
+                    (self.height - y) / sin))
+        distances[~(distances > 0)] = np.inf
+        return distances.min(axis=0), np.argmin(distances, axis=0)
+
+
+class TurtlebotBatch:
+    """Independent kinematic Turtlebots, each in its own copy of a
+    :py:class:`Room`, simulated together as arrays.
+
+    Args:
+        num_robots (int): Number of robots.
+        room (Room, optional): Room every robot drives in.
+        poses (numpy array, optional): Initial ``(x, y, heading)`` of each
+            robot; random if not given.
+        seed (int, optional): Seed of the random initial poses.
+
+    Attributes:
+        x, y, heading (numpy array of float): Pose of each robot.
+        linear, angular (numpy array of float): Speed of each robot.
+        bumper (numpy array of int): Kobuki bumper bits: 1 right,
+            2 centre, 4 left.
+        charger (numpy array of int): Kobuki charger state; 6 while
+            docked.
+    """
+
+    RADIUS = 0.177
+
+    # kobuki dock IR bits
+    NEAR_LEFT, NEAR_CENTER, NEAR_RIGHT = 1, 2, 4
+    FAR_CENTER, FAR_LEFT, FAR_RIGHT = 8, 16, 32
+    NEAR_DISTANCE = 0.8
+    FAR_DISTANCE = 2.5
+    CENTER_REGION = 0.15
+    # bearing and half field of view of the right, centre and left IR
+    # receivers
+    IR_BEARINGS = np.radians([-60.0, 0.0, 60.0])
+    IR_FOV = np.radians(35.0)
+
+    # direction of the left, right, bottom and top walls
+    WALL_DIRECTIONS = np.array([np.pi, 0.0, -np.pi / 2, np.pi / 2])
+
+    # camera
+    IMAGE_LI = 480
+    IMAGE_CO = 640
+    CAMERA_FOV = np.radians(58.0)
+    CAMERA_HEIGHT = 0.4
+    WALL_HEIGHT = 1.0
+
+    def __init__(self, num_robots, room=None, poses=None, seed=None):
+        self.num_robots = num_robots
+        self.room = room or Room()
+        self.random = np.random.RandomState(seed)
+
+        if poses is None:
+            margin = 2 * self.RADIUS
+            poses = np.column_stack([
+                self.random.uniform(margin, self.room.width - margin,
+                                    num_robots),
+                self.random.uniform(margin, self.room.height - margin,
+                                    num_robots),
+                self.random.uniform(-np.pi, np.pi, num_robots)])
+        poses = np.array(poses, dtype=float).reshape(num_robots, 3)
+        self.x, self.y, self.heading = poses.T.copy()
+
+        self.linear = np.zeros(num_robots)
+        self.angular = np.zeros(num_robots)
+        self.bumper = np.zeros(num_robots, dtype=int)
+        self.charger = np.zeros(num_robots, dtype=int)
+
+        # camera ray directions relative to the heading, left to right
+        columns = (np.arange(self.IMAGE_CO) + 0.5) / self.IMAGE_CO
+        self.ray_offsets = (0.5 - columns) * self.CAMERA_FOV
+        self.focal_length = (self.IMAGE_CO / 2 /
+                             math.tan(self.CAMERA_FOV / 2))
+
+    def step(self, linear, angular, dt):
+        """Drives each robot at the given speeds for ``dt`` seconds.
+
+        Robots stop at walls, pressing the bumper on the side that hit
+        the wall.
+
+        Args:
+            linear (numpy array of float): Forward speed of each robot.
+            angular (numpy array of float): Turning speed of each robot.
+            dt (float): Length of the step in seconds.
+        """
+        linear = np.asarray(linear, dtype=float)
+        self.angular = np.asarray(angular, dtype=float)
+        self.heading = wrap_angle(self.heading + self.angular * dt)
+
+        x = self.x + linear * np.cos(self.heading) * dt
+        y = self.y + linear * np.sin(self.heading) * dt
+
+        # distance past each wall
+        overlaps = np.stack([self.RADIUS - x,
+                             x + self.RADIUS - self.room.width,
+                             self.RADIUS - y,
+                             y + self.RADIUS - self.room.height])
+        blocked = (overlaps > 0).any(axis=0)
+
+        # press the bumper facing the wall
+        bearing = wrap_angle(self.WALL_DIRECTIONS[np.argmax(overlaps, axis=0)]
+                             - self.heading)
+        side = np.where(bearing > 0, 4, 1)
+        bumper = np.where(np.abs(bearing) < np.pi / 6, 2, side)
+        self.bumper = np.where(blocked & (np.abs(bearing) < np.pi / 2),
+                               bumper, 0)
+
+        # stop against the wall
+        self.x = np.clip(x, self.RADIUS, self.room.width - self.RADIUS)
+        self.y = np.clip(y, self.RADIUS, self.room.height - self.RADIUS)
+        self.linear = np.where(blocked, 0.0, linear)
+
+        docked = ((np.abs(self.x - self.room.dock[0]) <
+                   self.room.DOCK_WIDTH / 2) &
+                  (self.y - self.RADIUS < 0.02))
+        self.charger = np.where(docked, 6, 0)
+
+    def dock_ir(self):
+        """Gets the dock IR bytes of each robot's right, centre and left
+        receivers.
+
+        Returns:
+            numpy array of int: Dock regions seen by each receiver, as
+                kobuki NEAR and FAR bits, one row per robot.
+        """
+        dx = self.room.dock[0] - self.x
+        dy = self.room.dock[1] - self.y
+        distance = np.hypot(dx, dy)
+
+        # region of the dock's beam each robot is in, as seen by the dock
+        beam_angle = np.arctan2(-dx, -dy)
+        center = np.abs(beam_angle) < self.CENTER_REGION
+        near = np.where(center, self.NEAR_CENTER,
+                        np.where(beam_angle < 0, self.NEAR_LEFT,
+                                 self.NEAR_RIGHT))
+        far = np.where(center, self.FAR_CENTER,
+                       np.where(beam_angle < 0, self.FAR_LEFT,
+                                self.FAR_RIGHT))
+        region = np.where(distance < self.NEAR_DISTANCE, near, far)
+        region[distance > self.FAR_DISTANCE] = 0
+
+        bearing = wrap_angle(np.arctan2(dy, dx) - self.heading)
+        seen = (np.abs(wrap_angle(bearing[:, np.newaxis] - self.IR_BEARINGS))
+                < self.IR_FOV)
+        return np.where(seen, region[:, np.newaxis], 0)
+
+    def camera_pixels(self, rows, columns):
+        """Ray casts chosen pixels of each robot's camera view.
+
+        Rays are only cast for the entries of ``columns``, so passing
+        the columns of a few chosen pixels is far cheaper than rendering
+        whole images.
+
+        Args:
+            rows (numpy array of int): Row of each pixel, broadcastable
+                against ``columns``.
+            columns (numpy array of int): Column of each pixel.
+
+        Returns:
+            numpy array of uint8: RGB value of each pixel, shaped
+                ``(num_robots,) + broadcast shape + (3,)``.
+        """
+        rows = np.asarray(rows)
+        columns = np.asarray(columns)
+        shape = (-1,) + (1,) * columns.ndim
+        offsets = self.ray_offsets[columns]
+        angles = self.heading.reshape(shape) + offsets
+        x = self.x.reshape(shape)
+        distances, walls = self.room.ray_cast(x, self.y.reshape(shape), angles)
+
+        colours = self.room.wall_colours[walls]
+        hits_x = x + distances * np.cos(angles)
+        on_dock = (walls == 2) & (np.abs(hits_x - self.room.dock[0]) <
+                                  self.room.DOCK_WIDTH / 2)
+        colours[on_dock] = self.room.dock_colour
+
+        # shade walls by distance
+        depth = distances * np.cos(offsets)
+        shade = 1 / (1 + 0.3 * depth)
+        colours = (colours * shade[..., np.newaxis]).astype(np.uint8)
+
+        horizon = self.IMAGE_LI / 2
+        top = horizon - self.focal_length * (
+                self.WALL_HEIGHT - self.CAMERA_HEIGHT) / depth
+        bottom = horizon + self.focal_length * self.CAMERA_HEIGHT / depth
+        wall = (rows >= top) & (rows < bottom)
+
+        background = np.where((rows < self.IMAGE_LI // 2)[..., np.newaxis],
+                              self.room.ceiling_colour,
+                              self.room.floor_colour)
+        return np.where(wall[..., np.newaxis], colours, background)
+
+    def render(self):
+        """Ray casts each robot's whole camera view.
+
+        Returns:
+            numpy array of uint8: One 480x640 RGB image per robot.
+        """
+        return self.camera_pixels(np.arange(self.IMAGE_LI)[:, np.newaxis],
+                                  np.arange(self.IMAGE_CO)[np.newaxis])
+
+
+class TurtlebotSimulator:
+    """Kinematic Turtlebot in a :py:class:`Room`.
+
+    A :py:class:`TurtlebotBatch` of one robot that reads and writes ROS
+    style messages.
+
+    Args:
+        room (Room, optional): Room to drive in.
+        pose (tuple, optional): Initial ``(x, y, heading)``; random if not
+            given.
+        seed (int, optional): Seed of the random initial pose.
+
+    Attributes:
+        time (float): Simulated seconds since the start.
+        robot (TurtlebotBatch): The simulated robot.
+    """
+
+    def __init__(self, room=None, pose=None, seed=None):
+        self.robot = TurtlebotBatch(1,
+                                    room,
+                                    poses=None if pose is None else [pose],
+                                    seed=seed)
+        self.time = 0.0
+
+    @property
+    def x(self):
+        return self.robot.x[0]
+
+    @property
+    def y(self):
+        return self.robot.y[0]
+
+    @property
+    def heading(self):
+        return self.robot.heading[0]
+
+    @property
+    def linear(self):
+        return self.robot.linear[0]
+
+    @property
+    def angular(self):
+        return self.robot.angular[0]
+
+    @property
+    def bumper(self):
+        """Kobuki bumper bits: 1 right, 2 centre, 4 left."""
+        return int(self.robot.bumper[0])
+
+    @property
+    def charger(self):
+        """Kobuki charger state; 6 while docked."""
+        return int(self.robot.charger[0])
+
+    def step(self, action, dt):
+        """Drives with ``action`` for ``dt`` seconds.
+
+        Args:
+            action (geometry_msgs Twist): Linear and angular speed, or
+                ``None`` to stand still.
+            dt (float): Length of the step in seconds.
+        """
+        self.time += dt
+        if action is None:
+            self.robot.step([0.0], [0.0], dt)
+        else:
+            self.robot.step([action.linear.x], [action.angular.z], dt)
+
+    def dock_ir(self):
+        """Gets the dock IR bytes of the right, centre and left receivers.
+
+        Returns:
+            list of int: Dock regions seen by each receiver, as kobuki
+                NEAR and FAR bits.
+        """
+        return self.robot.dock_ir()[0].tolist()
+
+    def render(self):
+        """Ray casts the robot's camera view.
+
+        Returns:
+            numpy array of uint8: 480x640 RGB image.
+        """
+        return self.robot.render()[0]
+
+    def messages(self, topics):
+        """Builds a message of the current state for each topic.
+
+        Args:
+            topics (iterable of str): ROS topic names, as in
+                ``tools.features``. Topics the simulator does not provide
+                are left out.
+
+        Returns:
+            dict: Maps topics to their message.
+        """
+        stamp = Stamp(self.time)
+        header = Message(stamp=stamp)
+        builders = {
+            tools.features['core']: self.core_message,
+            tools.features['ir']: self.ir_message,
+            tools.features['imu']: self.imu_message,
+            tools.features['odom']: self.odom_message,
+            tools.features['image']: self.image_message,
+            tools.features['cimage']: self.compressed_image_message,
+        }
+        return {topic: builders[topic](header)
+                for topic in topics if topic in builders}
+
+    def core_message(self, header):
+        return Message(header=header,
+                       bumper=self.bumper,
+                       charger=self.charger)
+
+    def ir_message(self, header):
+        return Message(header=header,
+                       data=''.join(chr(b) for b in self.dock_ir()))
+
+    def imu_message(self, header):
+        orientation = Message(x=0.0,
+                              y=0.0,
+                              z=math.sin(self.heading / 2),
+                              w=math.cos(self.heading / 2))
+        return Message(header=header, orientation=orientation)
+
+    def odom_message(self, header):
+        pose = Message(position=vector3(self.x, self.y),
+                       orientation=None)
+        twist = Message(linear=vector3(self.linear),
+                        angular=vector3(z=self.angular))
+        return Message(header=header,
+                       pose=Message(pose=pose),
+                       twist=Message(twist=twist))
+
+    def image_message(self, header):
+        return Message(header=header,
+                       height=TurtlebotBatch.IMAGE_LI,
+                       width=TurtlebotBatch.IMAGE_CO,
+                       encoding='rgb8',
+                       data=self.render().tostring())
+
+    def compressed_image_message(self, header):
+        import cv2
+
+        _, data = cv2.imencode('.jpg', self.render())
+        return Message(header=header, format='jpeg', data=data.tostring())
+
+
+class RecordedTurtlebot(TurtlebotSimulator):
+    """Replays a :doc:`recorder` recording as a simulated robot.
+
+    Each recorded timestep is held for ``period`` simulated seconds, and
+    the recording starts over when it runs out. Actions are ignored, so
+    the replay is the same whatever the learner does.
+
+    Only the chosen pixels of each image are recorded, so the replayed
+    image is blank except for them. Set :py:attr:`pixel_mask` to the
+    mask of the :py:class:`~state_representation.StateManager` that reads
+    the images, so its chosen pixels get the recorded values.
+
+    Args:
+        prefix (str): Path prefix the recording was written with.
+        period (float, optional): Simulated seconds per recorded
+            timestep; defaults to the median recorded timestep.
+
+    Attributes:
+        pixel_mask (numpy array of bool): Where the recorded pixels go
+            in the replayed image.
+    """
+
+    def __init__(self, prefix, period=None):
+        from recorder import load_recording
+
+        self.recording = load_recording(prefix)
+        self.num_rows = len(self.recording['time'])
+        if period is None:
+            period = np.nanmedian(np.diff(self.recording['time']))
+        self.period = period
+        self.pixel_mask = None
+        self.time = 0.0
+        self.row = 0
+
+    def column(self, name):
+        return self.recording[name][self.row]
+
+    @property
+    def x(self):
+        return self.column('odom')[0]
+
+    @property
+    def y(self):
+        return self.column('odom')[1]
+
+    @property
+    def heading(self):
+        return 2 * math.asin(self.column('imu'))
+
+    @property
+    def linear(self):
+        return self.column('odom')[2]
+
+    @property
+    def angular(self):
+        return self.column('odom')[3]
+
+    @property
+    def bumper(self):
+        right, left, center = self.column('bump')
+        return 1 * right | 4 * left | 2 * center
+
+    @property
+    def charger(self):
+        return 6 if self.column('charging') else 0
+
+    def step(self, action, dt):
+        self.time += dt
+        self.row = int(self.time / self.period) % self.num_rows
+
+    def dock_ir(self):
+        return np.maximum(self.column('ir'), 0).tolist()
+
+    def render(self):
+        image = np.zeros((TurtlebotBatch.IMAGE_LI,
+                          TurtlebotBatch.IMAGE_CO,
+                          3), dtype=np.uint8)
+        if self.pixel_mask is not None:
+            image[self.pixel_mask] = self.column('pixels')
+        return image
+
+
+class SimulatedRobot:
+    """Runs a :py:class:`TurtlebotSimulator` on a local transport.
+
+    Each time the transport's virtual clock advances, the robot drives
+    with the newest action for that long. The core and dock IR topics
+    are published every ``sensor_period`` seconds along the way, like
+    the kobuki's 50Hz sensor stream, and the other topics once at the
+    end.
+
+    Args:
+        transport (LocalTransport): Transport to publish on; its clock
+            drives the simulation.
+        topics (iterable of str): Topics to publish.
+        simulator (TurtlebotSimulator, optional): Simulated robot, or a
+            :py:class:`RecordedTurtlebot` to replay a recording.
+        action_topic (str): Topic to read actions from. ``action_cmd``
+            takes the learner's actions directly;
+            ``cmd_vel_mux/input/teleop`` takes them from an
+            :py:class:`~action_manager.ActionManager`.
+        sensor_period (float): Seconds between core and dock IR messages.
+    """
+
+    FAST_TOPICS = (tools.features['core'], tools.features['ir'])
+
+    def __init__(self,
+                 transport,
+                 topics,
+                 simulator=None,
+                 action_topic='action_cmd',
+                 sensor_period=0.02):
+        self.transport = transport
+        self.simulator = simulator or TurtlebotSimulator()
+        self.sensor_period = sensor_period
+        self.action = None
+
+        topics = set(topics)
+        self.fast_topics = [t for t in self.FAST_TOPICS if t in topics]
+        self.slow_topics = [t for t in topics if t not in self.FAST_TOPICS]
+        # latched, so loops that subscribe later still get the newest
+        # message
+        self.publishers = {topic: transport.publisher(topic,
+                                                      object,
+                                                      latch=True)
+                           for topic in topics}
+
+        transport.subscribe(action_topic, None, self.set_action)
+        transport.clock.on_advance(self.advance)
+
+        # publish the initial state so the first timestep has data
+        self.publish(self.simulator.messages(topics))
+
+    def set_action(self, action):
+        self.action = action
+
+    def publish(self, messages):
+        for topic, message in messages.items():
+            self.publishers[topic].publish(message)
+
+    def advance(self, dt):
+        """Drives for ``dt`` seconds and publishes the sensor data."""
+        steps = max(int(round(dt / self.sensor_period)), 1)
+        for _ in range(steps):
+            self.simulator.step(self.action, dt / steps)
+            self.publish(self.simulator.messages(self.fast_topics))
+        self.publish(self.simulator.messages(self.slow_topics))
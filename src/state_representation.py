@@ -6,11 +6,42 @@ Authors:
     Michele Albach, Shibhansh Dohare, David Quail, Parash Rahman, Niko Yasui.
 """
 import numpy as np
-import rospy
-from scipy.misc import comb
 
 from CTiles import tiles
+from profiler import profiler
 from tools import get_next_pow2, timing
+from transport import logwarn
+
+
+class FeatureRanges(object):
+    """Maps feature groups to their indices in phi.
+
+    The index arrays are only built the first time they are looked up, so
+    importing this module does not allocate arrays for every group.
+
+    Args:
+        ranges (dict): Maps each feature group to the ``(start, stop)``
+            of its indices in phi.
+    """
+
+    def __init__(self, ranges):
+        self.ranges = ranges
+        self.indices = {}
+
+    def __getitem__(self, group):
+        if group not in self.indices:
+            start, stop = self.ranges[group]
+            self.indices[group] = np.arange(start, stop)
+        return self.indices[group]
+
+    def __contains__(self, group):
+        return group in self.ranges
+
+    def __iter__(self):
+        return iter(self.ranges)
+
+    def keys(self):
+        return self.ranges.keys()
 
 
 class StateConstants:
@@ -60,7 +91,7 @@ class StateConstants:
     # IR_ITH_SIZE = 3
 
     # pixel pairs
-    NUM_PP = comb(NUM_RANDOM_POINTS, 2, exact=True)
+    NUM_PP = NUM_RANDOM_POINTS * (NUM_RANDOM_POINTS - 1) // 2
     NUM_PP_TILINGS = 4
     NUM_PP_TILES = 4
     SCALE_PP = NUM_PP_TILES / 2.  # [-1, 1]
@@ -73,21 +104,20 @@ class StateConstants:
                             ODOM_IHT_SIZE + IR_ITH_SIZE + 3 + 1 +
                             PP_FEATURE_LENGTH)
 
-    indices_in_phi = {
-        'image': np.arange(IMAGE_START_INDEX,
-                           IMAGE_START_INDEX + TOTAL_IMAGE_FEATURE_LENGTH),
-        'cimage': np.arange(IMAGE_START_INDEX,
-                            IMAGE_START_INDEX + TOTAL_IMAGE_FEATURE_LENGTH),
-        'imu': np.arange(IMU_START_INDEX, IMU_START_INDEX + IMU_IHT_SIZE),
-        'odom': np.arange(ODOM_START_INDEX, ODOM_START_INDEX + ODOM_IHT_SIZE),
-        'ir': np.arange(IR_START_INDEX, IR_START_INDEX + IR_ITH_SIZE),
-        'pixel_pairs': np.arange(PP_START_INDEX,
-                                 PP_START_INDEX + PP_FEATURE_LENGTH),
-        'bump': np.arange(PP_START_INDEX + PP_FEATURE_LENGTH,
-                          PP_START_INDEX + PP_FEATURE_LENGTH + 3),
-        'bias': np.array([TOTAL_FEATURE_LENGTH - 1]),
-        'last_action': np.array([], dtype=int),
-    }
+    indices_in_phi = FeatureRanges({
+        'image': (IMAGE_START_INDEX,
+                  IMAGE_START_INDEX + TOTAL_IMAGE_FEATURE_LENGTH),
+        'cimage': (IMAGE_START_INDEX,
+                   IMAGE_START_INDEX + TOTAL_IMAGE_FEATURE_LENGTH),
+        'imu': (IMU_START_INDEX, IMU_START_INDEX + IMU_IHT_SIZE),
+        'odom': (ODOM_START_INDEX, ODOM_START_INDEX + ODOM_IHT_SIZE),
+        'ir': (IR_START_INDEX, IR_START_INDEX + IR_ITH_SIZE),
+        'pixel_pairs': (PP_START_INDEX, PP_START_INDEX + PP_FEATURE_LENGTH),
+        'bump': (PP_START_INDEX + PP_FEATURE_LENGTH,
+                 PP_START_INDEX + PP_FEATURE_LENGTH + 3),
+        'bias': (TOTAL_FEATURE_LENGTH - 1, TOTAL_FEATURE_LENGTH),
+        'last_action': (0, 0),
+    })
 
     num_active_features = {
         "image": NUM_RANDOM_POINTS * CHANNELS * NUM_IMAGE_TILINGS,
@@ -106,26 +136,31 @@ class StateManager(object):
     def __init__(self, features_to_use):
         """Sets up the hash tables used for each feature encoding.
 
+        Only the tables of the groups in ``features_to_use`` are built
+        here; the others are built if they are ever used.
+
         Args:
             features_to_use: strings representing which sensorimotor
                 information should actually be incorporated into phi
                 (see :py:meth:`~state_representation.StateManager.get_phi`).
         """
-        num_img_ihts = StateConstants.NUM_RANDOM_POINTS * \
-                       StateConstants.CHANNELS
-        img_iht_size = StateConstants.IMAGE_IHT_SIZE
-        self.img_ihts = [tiles.CollisionTable(img_iht_size, "safe") for _ in
-                         range(num_img_ihts)]
-
-        self.pp_ihts = [
-            tiles.CollisionTable(StateConstants.PP_IHT_SIZE, "safe") for _ in
-            range(StateConstants.NUM_PP)
-        ]
-
-        self.imu_iht = tiles.CollisionTable(StateConstants.IMU_IHT_SIZE,
-                                            "safe")
-        self.odom_iht = tiles.CollisionTable(StateConstants.ODOM_IHT_SIZE,
-                                             "safe")
+        self.features_to_use = set(features_to_use)
+
+        self._img_ihts = None
+        self._pp_ihts = None
+        self._imu_iht = None
+        self._odom_iht = None
+        self._image_lookup = None
+
+        # build the tables in use now, so no timestep pays for them and
+        # forked feature producers inherit them
+        tables_in_use = {'img_ihts': {'image', 'cimage'},
+                         'pp_ihts': {'pixel_pairs'},
+                         'imu_iht': {'imu'},
+                         'odom_iht': {'odom'}}
+        for tables, groups in tables_in_use.items():
+            if self.features_to_use & groups:
+                getattr(self, tables)
 
         # set up mask to chose pixels
         num_pixels = StateConstants.IMAGE_LI * StateConstants.IMAGE_CO
@@ -148,139 +183,250 @@ class StateManager(object):
         self.last_charging_raw = False
         self.last_bump_raw = False
 
-        self.features_to_use = features_to_use
-
-    @timing
-    def get_phi(self, image, bump, ir, imu, odom, bias, weights=None, *args,
-                **kwargs):
-        """Gets the binary tile coding of all the pertinent fields.
+    @property
+    def img_ihts(self):
+        """Collision tables of the image features, one per channel of
+        each chosen pixel.
+        """
+        if self._img_ihts is None:
+            num_img_ihts = StateConstants.NUM_RANDOM_POINTS * \
+                           StateConstants.CHANNELS
+            img_iht_size = StateConstants.IMAGE_IHT_SIZE
+            self._img_ihts = [tiles.CollisionTable(img_iht_size, "safe")
+                              for _ in range(num_img_ihts)]
+        return self._img_ihts
+
+    @property
+    def pp_ihts(self):
+        """Collision tables of the pixel pair features, one per pair."""
+        if self._pp_ihts is None:
+            self._pp_ihts = [
+                tiles.CollisionTable(StateConstants.PP_IHT_SIZE, "safe")
+                for _ in range(StateConstants.NUM_PP)
+            ]
+        return self._pp_ihts
+
+    @property
+    def imu_iht(self):
+        if self._imu_iht is None:
+            self._imu_iht = tiles.CollisionTable(StateConstants.IMU_IHT_SIZE,
+                                                 "safe")
+        return self._imu_iht
+
+    @property
+    def odom_iht(self):
+        if self._odom_iht is None:
+            self._odom_iht = tiles.CollisionTable(
+                    StateConstants.ODOM_IHT_SIZE, "safe")
+        return self._odom_iht
+
+    @property
+    def image_lookup(self):
+        """Active image indices for every byte value of every chosen
+        pixel channel.
+
+        Each channel is tile coded on its own and takes one of only 256
+        values, so all its codings are computed once here and whole
+        batches of images are then coded by indexing. Filling the tables
+        in a fixed order does not change the coding of any value.
+
+        Returns:
+            numpy array of int: Indices shaped (channel, value, tiling).
+        """
+        if self._image_lookup is None:
+            values = np.arange(256) * StateConstants.SCALE_RGB
+            lookup = np.array([[tiles.tiles(StateConstants.NUM_IMAGE_TILINGS,
+                                            iht,
+                                            [value]) for value in values]
+                               for iht in self.img_ihts])
+            offsets = np.arange(len(lookup)) * StateConstants.IMAGE_IHT_SIZE
+            self._image_lookup = lookup + offsets[:, np.newaxis, np.newaxis]
+        return self._image_lookup
+
+    def masked_pixels(self, image):
+        """Gets the pixels chosen by ``pixel_mask`` from the image.
+
+        Falls back to the last valid image if ``image`` is empty.
+
+        Returns:
+            numpy array of float: One row of channel values per chosen
+                pixel.
         """
-
-        phi = np.zeros(StateConstants.TOTAL_FEATURE_LENGTH, dtype=bool)
-
-        # phi = np.zeros(2)
-        # self.features_to_use = set()
-        # phi[0] = imu if imu is not None else 0
-        # phi[1] = 1
-
         def valid_image(img):
             return img is not None and len(img) > 0 and len(img[0]) > 0
 
         if not valid_image(image):
             image = self.last_image_raw
             if 'image' in self.features_to_use:
-                rospy.logwarn("Image is empty.")
+                logwarn("Image is empty.")
 
         self.last_image_raw = image
 
-        if 'image' or 'cimage' in self.features_to_use:
-            rgb_points = image[self.pixel_mask].flatten().astype(float)
-            rgb_points *= StateConstants.SCALE_RGB
-            rgb_inds = np.arange(StateConstants.NUM_RANDOM_POINTS * 3)
+        return image[self.pixel_mask].reshape(
+                -1, StateConstants.CHANNELS).astype(float)
 
-            tile_inds = [tiles.tiles(StateConstants.NUM_IMAGE_TILINGS,
-                                     self.img_ihts[i],
-                                     [rgb_points[i]]) for i in rgb_inds]
+    def image_indices(self, pixels):
+        """Tile codes each channel of the chosen pixels.
 
-            # tile_inds = np.ones((900,4), dtype=int)
+        Args:
+            pixels (numpy array of float): Output of
+                :py:meth:`masked_pixels`.
 
-            rgb_inds *= StateConstants.IMAGE_IHT_SIZE
+        Returns:
+            numpy array of int: Active indices of the image features.
+        """
+        rgb_points = pixels.flatten() * StateConstants.SCALE_RGB
+        rgb_inds = np.arange(StateConstants.NUM_RANDOM_POINTS * 3)
 
-            indices = (tile_inds + rgb_inds[:, np.newaxis]).ravel()
-            assert np.min(indices) >= StateConstants.IMAGE_START_INDEX
-            assert np.max(indices) <= (
-                                    StateConstants.IMAGE_START_INDEX +
-                                    StateConstants.TOTAL_IMAGE_FEATURE_LENGTH
-                                    )
-            phi[indices] = 1
+        tile_inds = [tiles.tiles(StateConstants.NUM_IMAGE_TILINGS,
+                                 self.img_ihts[i],
+                                 [rgb_points[i]]) for i in rgb_inds]
 
-        if 'pixel_pairs' in self.features_to_use:
-            # get vector of pixels with each pixel=(Channel1,Channel2,...)
-            num_channels = StateConstants.CHANNELS
-            pixels = image[self.pixel_mask].reshape(-1,
-                                                    num_channels).astype(float)
-
-            # get vector of L2 norms of above pixels
-            norms = np.linalg.norm(pixels, axis=1)
-            assert norms.size == pixels.shape[0]
-
-            # find indices to multiply to get upper triangle
-            # of the outer product of the arrays
-            row, col = np.triu_indices(norms.size, 1)
-
-            # calculate upper triangle of inner product: pixels, pixels
-            dots = np.einsum('ij,ij->i', pixels[row], pixels[col])
-
-            # calculate upper triangle of inner product: norms, norms
-            norm_product = np.einsum('i,i->i', norms[row], norms[col])
-
-            # find cosine similarity and avoid making nans
-            div_by_zero = norm_product == 0
-            cos_sim = dots
-            cos_sim[div_by_zero] = 0
-            cos_sim[~div_by_zero] /= norm_product[~div_by_zero]
-            assert (np.abs(cos_sim) <= 1.1).all()
-
-            # fix rounding errors
-            cos_sim[cos_sim < -1] = -1
-            cos_sim[cos_sim > 1] = 1
-            assert cos_sim.size == StateConstants.NUM_PP
-
-            cos_sim *= StateConstants.SCALE_PP
-
-            # get indices form tile coding
-            pp_inds = np.arange(StateConstants.NUM_PP)
-            tile_inds = [tiles.tiles(StateConstants.NUM_PP_TILINGS,
-                                     self.pp_ihts[i],
-                                     [cos_sim[i]]) for i in pp_inds]
-
-            # offset tilecoding for each pixel by the IHT size to map
-            # each pixel to a different set of PP_IHT_SIZE indices
-            pp_inds *= StateConstants.PP_IHT_SIZE
-            indices = (tile_inds + pp_inds[:, np.newaxis]).ravel()
-
-            # offset all indices to correspond to the Pixel pairs
-            # section of the feature array
-            indices += StateConstants.PP_START_INDEX
-
-            assert np.min(indices) >= StateConstants.PP_START_INDEX
-            assert np.max(indices) <= (
-                                    StateConstants.PP_START_INDEX +
-                                    StateConstants.PP_FEATURE_LENGTH
-                                    )
+        rgb_inds *= StateConstants.IMAGE_IHT_SIZE
+
+        indices = (tile_inds + rgb_inds[:, np.newaxis]).ravel()
+        assert np.min(indices) >= StateConstants.IMAGE_START_INDEX
+        assert np.max(indices) <= (
+                                StateConstants.IMAGE_START_INDEX +
+                                StateConstants.TOTAL_IMAGE_FEATURE_LENGTH
+                                )
+        return indices
+
+    def pixel_pair_indices(self, pixels):
+        """Tile codes the cosine similarity of each pair of chosen pixels.
+
+        Args:
+            pixels (numpy array of float): Output of
+                :py:meth:`masked_pixels`.
+
+        Returns:
+            numpy array of int: Active indices of the pixel pair features.
+        """
+        # get vector of L2 norms of above pixels
+        norms = np.linalg.norm(pixels, axis=1)
+        assert norms.size == pixels.shape[0]
+
+        # find indices to multiply to get upper triangle
+        # of the outer product of the arrays
+        row, col = np.triu_indices(norms.size, 1)
+
+        # calculate upper triangle of inner product: pixels, pixels
+        dots = np.einsum('ij,ij->i', pixels[row], pixels[col])
+
+        # calculate upper triangle of inner product: norms, norms
+        norm_product = np.einsum('i,i->i', norms[row], norms[col])
+
+        # find cosine similarity and avoid making nans
+        div_by_zero = norm_product == 0
+        cos_sim = dots
+        cos_sim[div_by_zero] = 0
+        cos_sim[~div_by_zero] /= norm_product[~div_by_zero]
+        assert (np.abs(cos_sim) <= 1.1).all()
+
+        # fix rounding errors
+        cos_sim[cos_sim < -1] = -1
+        cos_sim[cos_sim > 1] = 1
+        assert cos_sim.size == StateConstants.NUM_PP
+
+        cos_sim *= StateConstants.SCALE_PP
+
+        # get indices form tile coding
+        pp_inds = np.arange(StateConstants.NUM_PP)
+        tile_inds = [tiles.tiles(StateConstants.NUM_PP_TILINGS,
+                                 self.pp_ihts[i],
+                                 [cos_sim[i]]) for i in pp_inds]
+
+        # offset tilecoding for each pixel by the IHT size to map
+        # each pixel to a different set of PP_IHT_SIZE indices
+        pp_inds *= StateConstants.PP_IHT_SIZE
+        indices = (tile_inds + pp_inds[:, np.newaxis]).ravel()
+
+        # offset all indices to correspond to the Pixel pairs
+        # section of the feature array
+        indices += StateConstants.PP_START_INDEX
+
+        assert np.min(indices) >= StateConstants.PP_START_INDEX
+        assert np.max(indices) <= (
+                                StateConstants.PP_START_INDEX +
+                                StateConstants.PP_FEATURE_LENGTH
+                                )
+        return indices
+
+    def imu_indices(self, imu):
+        """Tile codes the IMU orientation into indices of phi."""
+        indices = np.array(tiles.tiles(StateConstants.NUM_IMU_TILINGS,
+                                       self.imu_iht,
+                                       [imu * StateConstants.SCALE_IMU]))
+        return indices + StateConstants.IMU_START_INDEX
+
+    def odom_indices(self, odom):
+        """Tile codes the odometry into indices of phi."""
+        indices = np.array(tiles.tiles(
+                StateConstants.NUM_ODOM_TILINGS,
+                self.odom_iht,
+                (np.asarray(odom) * StateConstants.SCALE_ODOM).tolist(),
+                []))
+        return indices + StateConstants.ODOM_START_INDEX
+
+    @timing
+    def get_phi(self, image, bump, ir, imu, odom, bias, weights=None,
+                active=None, *args, **kwargs):
+        """Gets the binary tile coding of all the pertinent fields.
+
+        Args:
+            active (dict, optional): Maps feature groups, such as
+                ``'image'`` or ``'pixel_pairs'``, to active indices that
+                were already computed elsewhere (see
+                :doc:`feature_pipeline`). These groups are not tile coded
+                again here.
+        """
+        active = active or {}
+
+        phi = np.zeros(StateConstants.TOTAL_FEATURE_LENGTH, dtype=bool)
+
+        for indices in active.values():
             phi[indices] = 1
 
+        image_groups = {'image', 'cimage', 'pixel_pairs'}
+        local_groups = (self.features_to_use & image_groups) - set(active)
+        if 'cimage' in active:
+            local_groups.discard('image')
+        if 'image' in active:
+            local_groups.discard('cimage')
+
+        if local_groups:
+            pixels = self.masked_pixels(image)
+
+        if local_groups & {'image', 'cimage'}:
+            with profiler.stage('phi/image'):
+                phi[self.image_indices(pixels)] = 1
+
+        if 'pixel_pairs' in local_groups:
+            with profiler.stage('phi/pixel_pairs'):
+                phi[self.pixel_pair_indices(pixels)] = 1
+
         if imu is None:
             imu = self.last_imu_raw
             if 'imu' in self.features_to_use:
-                rospy.logwarn("No imu value.")
+                logwarn("No imu value.")
 
         if 'imu' in self.features_to_use:
-            indices = np.array(tiles.tiles(StateConstants.NUM_IMU_TILINGS,
-                                           self.imu_iht,
-                                           [imu * StateConstants.SCALE_IMU]))
-
-            phi[indices + StateConstants.IMU_START_INDEX] = 1
+            with profiler.stage('phi/imu'):
+                phi[self.imu_indices(imu)] = 1
 
         if odom is None:
             odom = self.last_odom_raw
             if 'odom' in self.features_to_use:
-                rospy.logwarn("No odom value.")
+                logwarn("No odom value.")
 
         if 'odom' in self.features_to_use:
-            indices = np.array(tiles.tiles(StateConstants.NUM_ODOM_TILINGS,
-                                           self.odom_iht,
-                                           (
-                                               odom *
-                                               StateConstants.SCALE_ODOM).tolist(),
-                                           []))
-
-            phi[indices + StateConstants.ODOM_START_INDEX] = 1
+            with profiler.stage('phi/odom'):
+                phi[self.odom_indices(odom)] = 1
 
         if ir is None:
             ir = self.last_ir_raw
             if 'ir' in self.features_to_use:
-                rospy.logwarn("No ir value.")
+                logwarn("No ir value.")
 
         if 'ir' in self.features_to_use and len(ir) >= 3:
             # indices = np.asarray(ir)
@@ -314,7 +460,7 @@ class StateManager(object):
         if bump is None:
             bump = self.last_bump_raw
             if 'bump' in self.features_to_use:
-                rospy.logwarn("No bump value")
+                logwarn("No bump value")
 
         if 'bump' in self.features_to_use:
             phi[StateConstants.indices_in_phi['bump']] = bump
@@ -325,6 +471,70 @@ class StateManager(object):
 
         return phi
 
+    def get_phi_batch(self, pixels, bump, ir, imu, odom):
+        """Gets the feature vectors of a batch of states at once.
+
+        The batched counterpart of :py:meth:`get_phi` for sensor data
+        that is already in arrays, such as a simulated
+        :py:class:`~simulator.TurtlebotBatch`'s. Image features are
+        looked up in :py:attr:`image_lookup` for the whole batch; the
+        other tile coded groups are still coded one state at a time.
+
+        Args:
+            pixels (numpy array of uint8): Chosen pixels of each state, in
+                the order of :py:meth:`masked_pixels`, shaped
+                (state, pixel, channel). Only needed for image features.
+            bump (numpy array of bool): Right, left and centre bumper of
+                each state.
+            ir (numpy array of int): Dock IR bytes of each state.
+            imu (numpy array of float): IMU orientation of each state.
+            odom (numpy array of float): Odometry of each state.
+
+        Returns:
+            numpy array of bool: One feature vector per row.
+        """
+        num_states = len(bump)
+        phi = np.zeros((num_states, StateConstants.TOTAL_FEATURE_LENGTH),
+                       dtype=bool)
+        states = np.arange(num_states)[:, np.newaxis]
+
+        if self.features_to_use & {'image', 'cimage'}:
+            with profiler.stage('phi/image'):
+                values = pixels.reshape(num_states, -1)
+                channels = np.arange(values.shape[1])
+                active = self.image_lookup[channels, values]
+                phi[states, active.reshape(num_states, -1)] = 1
+
+        if 'pixel_pairs' in self.features_to_use:
+            with profiler.stage('phi/pixel_pairs'):
+                for i in range(num_states):
+                    phi[i, self.pixel_pair_indices(
+                            pixels[i].astype(float))] = 1
+
+        if 'imu' in self.features_to_use:
+            with profiler.stage('phi/imu'):
+                for i in range(num_states):
+                    phi[i, self.imu_indices(imu[i])] = 1
+
+        if 'odom' in self.features_to_use:
+            with profiler.stage('phi/odom'):
+                for i in range(num_states):
+                    phi[i, self.odom_indices(odom[i])] = 1
+
+        if 'ir' in self.features_to_use:
+            # bits of the centre receiver, most significant first
+            shifts = np.arange(StateConstants.IR_ITH_SIZE)[::-1]
+            bits = (np.asarray(ir)[:, 1, np.newaxis] >> shifts) & 1
+            phi[:, StateConstants.indices_in_phi['ir']] = bits
+
+        if 'bump' in self.features_to_use:
+            phi[:, StateConstants.indices_in_phi['bump']] = bump
+
+        if 'bias' in self.features_to_use:
+            phi[:, StateConstants.indices_in_phi['bias']] = 1
+
+        return phi
+
     def get_observations(self, bump, ir, charging, odom, imu, **kwargs):
         """A way to access auxiliary state information.
         """
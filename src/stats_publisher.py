@@ -0,0 +1,100 @@
+"""Publishes GVF statistics in batches from a background thread.
+
+Publishing one ``Float64`` per GVF and statistic on every timestep costs a
+serialization and a send for each pair. :py:class:`StatsPublisher` only
+evaluates the statistics every ``period`` timesteps, and hands the values
+to a sender thread so the control thread never waits on ROS.
+"""
+from Queue import Queue, Full
+from threading import Thread
+
+import numpy as np
+import std_msgs.msg as std_msg
+
+from transport import RosTransport
+
+
+class StatsPublisher:
+    """Evaluates and publishes statistics of each GVF.
+
+    In batched mode all values go out as one ``Float64MultiArray`` on the
+    ``stats`` topic, and the ``gvf/stat`` label of each element is
+    published once, comma separated, on the latched ``stats/labels``
+    topic. Otherwise each value goes to its own ``gvf/stat`` topic as
+    before.
+
+    Args:
+        gvfs (list of GVF): GVFs whose statistics to publish.
+        stats (list of str): Names of the statistics to publish.
+        stat_data (dict): Maps statistic names to functions of a GVF
+            that compute them.
+        period (int): Number of timesteps between publications.
+        batch (bool): Whether to publish one array message.
+        max_pending (int): Number of publications that may wait for the
+            sender thread before new ones are dropped.
+        transport (optional): Transport to publish on (see
+            :doc:`transport`). Defaults to ROS.
+
+    Attributes:
+        labels (list of str): ``gvf/stat`` name of each value.
+        dropped (int): Number of publications dropped because the sender
+            thread fell behind.
+    """
+
+    def __init__(self, gvfs, stats, stat_data, period=1, batch=False,
+                 max_pending=10, transport=None):
+        self.period = period
+        self.batch = batch
+        self.steps = 0
+        self.dropped = 0
+
+        self.getters = [(gvf, stat_data[stat]) for gvf in gvfs
+                        for stat in stats]
+        self.labels = ['{}/{}'.format(gvf.name, stat) for gvf in gvfs
+                       for stat in stats]
+
+        transport = transport or RosTransport()
+        if batch:
+            self.array_publisher = transport.publisher(
+                    'stats',
+                    std_msg.Float64MultiArray,
+                    queue_size=1)
+            label_publisher = transport.publisher('stats/labels',
+                                                  std_msg.String,
+                                                  queue_size=1,
+                                                  latch=True)
+            label_publisher.publish(','.join(self.labels))
+        else:
+            self.publishers = [transport.publisher(label,
+                                                   std_msg.Float64,
+                                                   queue_size=10)
+                               for label in self.labels]
+
+        self.to_send = Queue(max_pending)
+        sender = Thread(target=self.send_loop, name='stats_publisher')
+        sender.daemon = True
+        sender.start()
+
+    def step(self):
+        """Evaluates the statistics if this timestep is due to publish.
+        """
+        self.steps += 1
+        if self.steps % self.period or not self.getters:
+            return
+
+        values = np.array([get(gvf) for gvf, get in self.getters],
+                          dtype=float)
+        try:
+            self.to_send.put_nowait(values)
+        except Full:
+            self.dropped += 1
+
+    def send_loop(self):
+        while True:
+            values = self.to_send.get()
+            if self.batch:
+                self.array_publisher.publish(
+                        std_msg.Float64MultiArray(data=values.tolist()))
+            else:
+                for publisher, value in zip(self.publishers, values):
+                    publisher.publish(value)
@@ -0,0 +1,333 @@
+"""Benchmarks of the tile coders that StateManager uses.
+
+:py:class:`~state_representation.StateManager` tile codes each channel
+of its chosen pixels (300 channels) and the cosine similarity of each
+pair of chosen pixels (4,950 pairs), each with a collision table of its
+own. This times both coders with safe collision tables, unsafe ones and
+no table at all (hashing straight into the table's memory size), and
+through two APIs:
+
+``per_call``
+    One call to ``tiles.tiles`` per table per frame, as
+    :py:meth:`~state_representation.StateManager.image_indices` and
+    :py:meth:`~state_representation.StateManager.pixel_pair_indices` do.
+``batched``
+    Every coder input is one-dimensional, and tiles only depend on its
+    value quantized to ``1 / num_tilings``, so the tiles of every
+    quantized value of every table are looked up once, as
+    :py:attr:`~state_representation.StateManager.image_lookup` does, and
+    all the frames are then coded by indexing. The lookup is timed
+    separately, as setup.
+
+Next to the timings it reports how full the tables are and the
+collision rate: the fraction of distinct tiles whose index is shared
+with another tile of the same table, which makes their features
+indistinguishable to the learners.
+
+The frames are random pixels, or the pixels of a :doc:`recorder`
+recording.
+
+Example::
+
+    python tile_benchmark.py --frames 50 --output tiles.json
+"""
+from __future__ import division, print_function
+
+import argparse
+import json
+import sys
+import timeit
+
+import numpy as np
+
+from CTiles import tiles
+from state_representation import StateConstants
+
+COLLISION_MODES = ['safe', 'unsafe', 'none']
+APIS = ['per_call', 'batched']
+
+
+class Coder:
+    """Shape of one of the tile coders of StateManager.
+
+    Args:
+        num_tables (int): Number of inputs, each coded with a table of
+            its own.
+        table_size (int): Size of each table.
+        num_tilings (int): Number of tilings.
+        low (float): Smallest scaled input.
+        high (float): Largest scaled input.
+    """
+
+    def __init__(self, num_tables, table_size, num_tilings, low, high):
+        self.num_tables = num_tables
+        self.table_size = table_size
+        self.num_tilings = num_tilings
+
+        # every quantized value an input can take
+        self.levels = np.arange(int(np.floor(low * num_tilings)),
+                                int(np.floor(high * num_tilings)) + 1)
+
+    def tables(self, mode):
+        """Fresh tables for a collision mode.
+
+        With no collision table, ``tiles.tiles`` takes the memory size
+        in place of the table.
+        """
+        if mode == 'none':
+            return [self.table_size] * self.num_tables
+        return [tiles.CollisionTable(self.table_size, mode)
+                for _ in range(self.num_tables)]
+
+    def quantize(self, inputs):
+        """Row into :py:meth:`lookup` of each input.
+
+        Inputs are quantized in single precision, as ``tiles.tiles``
+        does.
+        """
+        scaled = (np.asarray(inputs, dtype=np.float32) *
+                  np.float32(self.num_tilings))
+        return np.floor(scaled).astype(int) - self.levels[0]
+
+    def lookup(self, tables):
+        """Tiles of every quantized value of every table.
+
+        Returns:
+            numpy array of int: Tiles shaped (table, level, tiling).
+        """
+        # the middle of each quantization interval
+        values = ((self.levels + 0.5) / self.num_tilings).tolist()
+        return np.array([[tiles.tiles(self.num_tilings, table, [value])
+                          for value in values]
+                         for table in tables])
+
+    def tile_keys(self, inputs):
+        """Identifies the tile each input falls in, in each tiling.
+
+        Reproduces the grid of ``tiles.tiles`` for one variable: tiling
+        ``j`` is offset by ``j`` quantization steps, and its tiles are
+        ``num_tilings`` steps wide.
+
+        Returns:
+            numpy array of int: Position of each tile in its tiling,
+                shaped (frame, table, tiling).
+        """
+        levels = self.quantize(inputs) + self.levels[0]
+        tilings = np.arange(self.num_tilings)
+        offsets = levels[..., np.newaxis] - tilings
+        return tilings + self.num_tilings * (offsets // self.num_tilings)
+
+
+""" the tile coders of StateManager
+"""
+CODERS = {
+    'image': Coder(StateConstants.NUM_RANDOM_POINTS *
+                   StateConstants.CHANNELS,
+                   StateConstants.IMAGE_IHT_SIZE,
+                   StateConstants.NUM_IMAGE_TILINGS,
+                   0,
+                   255 * StateConstants.SCALE_RGB),
+    'pixel_pairs': Coder(StateConstants.NUM_PP,
+                         StateConstants.PP_IHT_SIZE,
+                         StateConstants.NUM_PP_TILINGS,
+                         -StateConstants.SCALE_PP,
+                         StateConstants.SCALE_PP),
+}
+
+
+def random_pixels(num_frames, seed=0):
+    """Random chosen pixels, shaped (frame, pixel, channel)."""
+    random = np.random.RandomState(seed)
+    return random.randint(256, size=(num_frames,
+                                     StateConstants.NUM_RANDOM_POINTS,
+                                     StateConstants.CHANNELS)).astype(float)
+
+
+def recorded_pixels(prefix, num_frames):
+    """Chosen pixels of the first frames of a recording that has them."""
+    from recorder import load_recording
+
+    pixels = load_recording(prefix)['pixels']
+    pixels = pixels[~np.isnan(pixels).any(axis=(1, 2))]
+    return pixels[:num_frames]
+
+
+def coder_inputs(pixels):
+    """Scaled inputs of each coder, computed as StateManager does.
+
+    Args:
+        pixels (numpy array of float): Chosen pixels, shaped (frame,
+            pixel, channel).
+
+    Returns:
+        dict: Maps each coder to its inputs, shaped (frame, table).
+    """
+    num_frames = len(pixels)
+    image = pixels.reshape(num_frames, -1) * StateConstants.SCALE_RGB
+
+    row, col = np.triu_indices(pixels.shape[1], 1)
+    dots = np.einsum('fij,fij->fi', pixels[:, row], pixels[:, col])
+    norms = np.linalg.norm(pixels, axis=2)
+    norm_product = norms[:, row] * norms[:, col]
+    cos_sim = np.zeros_like(dots)
+    nonzero = norm_product != 0
+    cos_sim[nonzero] = dots[nonzero] / norm_product[nonzero]
+    cos_sim = np.clip(cos_sim, -1, 1) * StateConstants.SCALE_PP
+
+    return {'image': image, 'pixel_pairs': cos_sim}
+
+
+def code_per_call(coder, tables, inputs):
+    """Codes every frame with one ``tiles.tiles`` call per table.
+
+    Returns:
+        numpy array of int: Tiles shaped (frame, table, tiling).
+    """
+    num_tilings = coder.num_tilings
+    return np.array([[tiles.tiles(num_tilings, table, [value])
+                      for table, value in zip(tables, frame)]
+                     for frame in inputs.tolist()])
+
+
+def code_batched(coder, lookup, inputs):
+    """Codes every frame by indexing a :py:meth:`Coder.lookup`."""
+    return lookup[np.arange(coder.num_tables), coder.quantize(inputs)]
+
+
+def table_stats(coder, tables, mode, indices, keys):
+    """Collision rate and usage of the tables after coding.
+
+    Args:
+        indices (numpy array of int): Tiles returned by the coder,
+            shaped (frame, table, tiling).
+        keys (numpy array of int): Tiles the inputs fall in, from
+            :py:meth:`Coder.tile_keys`.
+
+    Returns:
+        dict: Number of distinct tiles seen, the fraction of them whose
+            index is shared with another tile of their table, and the
+            mean and largest fraction of each table in use.
+    """
+    table_ids = np.broadcast_to(np.arange(coder.num_tables)[:, np.newaxis],
+                                indices.shape)
+    tilings = np.broadcast_to(np.arange(coder.num_tilings), indices.shape)
+
+    # each distinct tile, with the index it was given
+    assigned = np.unique(np.column_stack([table_ids.ravel(),
+                                          tilings.ravel(),
+                                          keys.ravel(),
+                                          indices.ravel()]), axis=0)
+    num_tiles = len(np.unique(assigned[:, :3], axis=0))
+    slots, tiles_per_slot = np.unique(assigned[:, [0, 3]], axis=0,
+                                      return_counts=True)
+    shared = tiles_per_slot[tiles_per_slot > 1].sum()
+
+    if mode == 'none':
+        usage = np.bincount(slots[:, 0], minlength=coder.num_tables)
+    else:
+        usage = np.array([table.usage() for table in tables])
+    usage = usage / coder.table_size
+
+    return {'distinct_tiles': num_tiles,
+            'collision_rate': shared / num_tiles if num_tiles else 0.0,
+            'mean_usage': float(usage.mean()),
+            'max_usage': float(usage.max())}
+
+
+def benchmark(name, mode, api, inputs):
+    """Times one coder with one collision mode and API.
+
+    Returns:
+        dict: The configuration, seconds spent setting up and coding,
+            frames per second, microseconds per table per frame and
+            the statistics of :py:func:`table_stats`.
+    """
+    coder = CODERS[name]
+    tables = coder.tables(mode)
+
+    setup_seconds = 0.0
+    start_time = timeit.default_timer()
+    if api == 'per_call':
+        indices = code_per_call(coder, tables, inputs)
+    else:
+        lookup = coder.lookup(tables)
+        setup_seconds = timeit.default_timer() - start_time
+        start_time = timeit.default_timer()
+        indices = code_batched(coder, lookup, inputs)
+    seconds = timeit.default_timer() - start_time
+
+    result = {'coder': name,
+              'collision_table': mode,
+              'api': api,
+              'frames': len(inputs),
+              'tables': coder.num_tables,
+              'setup_seconds': setup_seconds,
+              'seconds': seconds,
+              'frames_per_sec': len(inputs) / seconds if seconds
+                                else float('inf'),
+              'us_per_table': 1e6 * seconds / inputs.size}
+    result.update(table_stats(coder, tables, mode, indices,
+                              coder.tile_keys(inputs)))
+    return result
+
+
+ROW = '{:<12}{:>8}{:>10}{:>12}{:>12}{:>10}{:>11}{:>10}'
+
+
+def print_header():
+    print(ROW.format('coder', 'table', 'api', 'frames/sec', 'us/table',
+                     'setup s', 'collision', 'usage'))
+
+
+def print_result(result):
+    print(ROW.format(result['coder'],
+                     result['collision_table'],
+                     result['api'],
+                     '{:.1f}'.format(result['frames_per_sec']),
+                     '{:.3f}'.format(result['us_per_table']),
+                     '{:.3f}'.format(result['setup_seconds']),
+                     '{:.2%}'.format(result['collision_rate']),
+                     '{:.2%}'.format(result['mean_usage'])))
+    sys.stdout.flush()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+            description='Benchmarks the tile coders of StateManager.')
+    parser.add_argument('--coders', nargs='+', choices=sorted(CODERS),
+                        default=sorted(CODERS))
+    parser.add_argument('--collision-tables', nargs='+',
+                        choices=COLLISION_MODES, default=COLLISION_MODES)
+    parser.add_argument('--apis', nargs='+', choices=APIS, default=APIS)
+    parser.add_argument('--frames', type=int, default=20,
+                        help='frames to code')
+    parser.add_argument('--recording',
+                        help='path prefix of a recording to take the '
+                             'pixels from, instead of random ones')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='file to write the results to')
+    args = parser.parse_args(argv)
+
+    if args.recording:
+        pixels = recorded_pixels(args.recording, args.frames)
+    else:
+        pixels = random_pixels(args.frames, args.seed)
+    inputs = coder_inputs(pixels)
+
+    results = []
+    print_header()
+    for name in args.coders:
+        for mode in args.collision_tables:
+            for api in args.apis:
+                result = benchmark(name, mode, api, inputs[name])
+                print_result(result)
+                results.append(result)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
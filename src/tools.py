@@ -8,34 +8,65 @@ Authors:
 
 from __future__ import division
 from functools import wraps
+import importlib
 import math
+import numbers
 
-from cv_bridge.core import CvBridge
-import kobuki_msgs.msg as kob_msg
-import nav_msgs.msg as nav_msg
-import rospy
-import sensor_msgs.msg as sens_msg
-import sensor_msgs.point_cloud2 as pc2
-from turtlesim.msg import Pose
 import numpy as np
 
 from time import time
 
+from profiler import profiler
+
+
+class MessageTypes(object):
+    """Maps topics to their ROS message type, imported on first lookup.
+
+    Message packages such as ``kobuki_msgs`` or ``turtlesim`` take a while
+    to import, so only the ones for topics actually in use are imported.
+
+    Args:
+        names (dict): Maps each topic to the dotted name of its message
+            type, e.g. ``'sensor_msgs.msg.Image'``.
+    """
+
+    def __init__(self, names):
+        self.names = names
+        self.types = {}
+
+    def __getitem__(self, topic):
+        if topic not in self.types:
+            module, name = self.names[topic].rsplit('.', 1)
+            self.types[topic] = getattr(importlib.import_module(module),
+                                        name)
+        return self.types[topic]
+
+    def __contains__(self, topic):
+        return topic in self.names
+
+    def __iter__(self):
+        return iter(self.names)
+
+    def keys(self):
+        return self.names.keys()
+
+
 """ topics related to what ROS message type they return
 """
-topic_format = {
-    "/camera/depth/image": sens_msg.Image,
-    "/camera/depth/points": sens_msg.PointCloud2,
-    "/camera/ir/image": sens_msg.Image,
-    "/camera/rgb/image_raw": sens_msg.Image,
-    "/camera/rgb/image_rect_color": sens_msg.Image,
-    "/mobile_base/sensors/core": kob_msg.SensorState,
-    "/mobile_base/sensors/dock_ir": kob_msg.DockInfraRed,
-    "/mobile_base/sensors/imu_data": sens_msg.Imu,
-    "/turtle1/pose": Pose,
-    "/camera/rgb/image_rect_color/compressed": sens_msg.CompressedImage,
-    "/odom": nav_msg.Odometry,
-    }
+topic_format = MessageTypes({
+    "/camera/depth/image": 'sensor_msgs.msg.Image',
+    "/camera/depth/points": 'sensor_msgs.msg.PointCloud2',
+    "/camera/ir/image": 'sensor_msgs.msg.Image',
+    "/camera/rgb/image_raw": 'sensor_msgs.msg.Image',
+    "/camera/rgb/image_rect_color": 'sensor_msgs.msg.Image',
+    "/mobile_base/sensors/core": 'kobuki_msgs.msg.SensorState',
+    "/mobile_base/sensors/dock_ir": 'kobuki_msgs.msg.DockInfraRed',
+    "/mobile_base/sensors/imu_data": 'sensor_msgs.msg.Imu',
+    "/turtle1/pose": 'turtlesim.msg.Pose',
+    "/camera/rgb/image_rect_color/compressed":
+        'sensor_msgs.msg.CompressedImage',
+    "/odom": 'nav_msgs.msg.Odometry',
+    })
 
 """ features mapped to their corresponding ROS topic
 """
@@ -51,6 +82,21 @@ features = {'core': "/mobile_base/sensors/core",
             'pixel_pairs': "/camera/rgb/image_rect_color",
             }
 
+""" features whose messages are aggregated over a timestep, mapped to the
+number of recent messages to keep; other features keep only the newest
+"""
+feature_history = {'core': 32,
+                   'ir': 10,
+                   }
+
+""" image features mapped to the name of the parser that decodes their
+messages into pixel arrays
+"""
+image_decoders = {'image': 'raw_image_parse',
+                  'cimage': 'compressed_image_parse',
+                  'pixel_pairs': 'raw_image_parse',
+                  }
+
 def decay(base):
     """Yields the base value divided by t each timestep.
 
@@ -89,6 +135,41 @@ def equal_twists(t1, t2):
                 np.isclose(t1.angular.z, t2.angular.z)])
 
 
+def twist_key(twist, decimals=6):
+    """ Quantizes the fields of a Twist into a hashable key
+
+    Twists whose fields agree to ``decimals`` places get the same key,
+    which makes the key a constant-time stand-in for
+    :py:func:`equal_twists`.
+
+    Args:
+        twist: the Twist action to quantize
+        decimals: number of decimal places to keep
+    """
+    return (round(twist.linear.x, decimals) + 0.0,
+            round(twist.linear.y, decimals) + 0.0,
+            round(twist.linear.z, decimals) + 0.0,
+            round(twist.angular.x, decimals) + 0.0,
+            round(twist.angular.y, decimals) + 0.0,
+            round(twist.angular.z, decimals) + 0.0)
+
+
+def is_action_id(action):
+    """ Determines if action is an integer index into an action space
+    """
+    return isinstance(action, numbers.Integral)
+
+
+def action_index(action_space, key=twist_key):
+    """ Builds a dictionary mapping action keys to their action id
+
+    Args:
+        action_space: a list of all possible actions
+        key: function mapping an action to a hashable key
+    """
+    return {key(action): i for i, action in enumerate(action_space)}
+
+
 def action_state_rep(action_space):
     """ Creates a function that generates phi (feature rep of state)
     based on all other aspects of state (e.g. camera, ir, etc.) and 
@@ -97,12 +178,14 @@ def action_state_rep(action_space):
     Args: 
         action_space: a list of all possible actions
     """
+    index = action_index(action_space)
+
     def action_state_phi(state, action):
         phi = np.zeros(state.size * len(action_space))
 
-        for i, current_action in enumerate(action_space):
-            if equal_twists(action, current_action):
-                phi[np.arange(i * state.size, (i + 1) * state.size)] = state
+        i = action if is_action_id(action) else index.get(twist_key(action))
+        if i is not None:
+            phi[i * state.size:(i + 1) * state.size] = state
 
         return phi
 
@@ -110,16 +193,19 @@ def action_state_rep(action_space):
 
 
 def timing(f):
-    """Decorator that print how long a function takes to execute.
+    """Decorator that records how long a function takes to execute.
+
+    Times are recorded into the histogram named after the function in
+    :py:data:`profiler.profiler`. While profiling is disabled the function
+    is called directly.
     """
     @wraps(f)
     def wrap(*args, **kw):
+        if not profiler.enabled:
+            return f(*args, **kw)
         ts = time()
         result = f(*args, **kw)
-        te = time()
-        # print 'func:%r args:[%r, %r] took: %2.4f sec' % \
-        # (f.__name__, args, kw, te-ts)
-        rospy.logdebug('func:%r took: %2.4f sec' % (f.__name__, te-ts))
+        profiler.record(f.__name__, time() - ts)
         return result
     return wrap
 
@@ -150,15 +236,33 @@ Parsers for easy (but maybe heavy) state creation
 def image_parse(img, enc='passthrough'):
     """ Converts a ros image to a numpy array
     """
+    from cv_bridge.core import CvBridge
+
     br = CvBridge()
     image = np.asarray(br.imgmsg_to_cv2(img, desired_encoding=enc)) 
     return image
 
 
+def raw_image_parse(img):
+    """ Converts a raw 640x480 rgb ros image to a numpy array
+    """
+    return np.fromstring(img.data, np.uint8).reshape(480, 640, 3)
+
+
+def compressed_image_parse(img):
+    """ Decodes a compressed ros image to a numpy array
+    """
+    import cv2
+
+    return cv2.imdecode(np.fromstring(img.data, np.uint8), 1)
+
+
 def pc2_parse(data):
     """ PointCloud2 parser
     pc2.read_points returns a generator of (x,y,z) tuples
     """
+    import sensor_msgs.point_cloud2 as pc2
+
     gen = pc2.read_points(data, skip_nans=True, field_names=("x","y","z"))
     return list(gen)
 
@@ -0,0 +1,207 @@
+"""Bounded buffers that hold the recent messages of a ROS topic.
+
+Subscriber threads ``put`` messages as they arrive and the learning loop
+``take`` s them once per timestep. Every operation holds the buffer's lock
+once, and memory is bounded by the buffer's capacity no matter how long
+a timestep takes.
+"""
+
+from collections import deque, namedtuple
+from threading import Condition, Lock, Thread
+
+from profiler import profiler
+import tools
+from transport import logerr
+
+
+class LatestSlot:
+    """Keeps only the newest message of a topic.
+
+    Suited to topics like the IMU or odometry where older messages are
+    superseded by newer ones.
+    """
+
+    def __init__(self):
+        self.lock = Lock()
+        self.message = None
+
+    def put(self, message):
+        with self.lock:
+            self.message = message
+
+    def take_latest(self):
+        """Returns the newest message since the last take, or ``None``.
+        """
+        with self.lock:
+            message, self.message = self.message, None
+        return message
+
+    def take_all(self):
+        """Returns a list holding the newest message, if there is one.
+        """
+        message = self.take_latest()
+        return [] if message is None else [message]
+
+
+class RingBuffer:
+    """Keeps the ``capacity`` newest messages of a topic.
+
+    Suited to topics like the bumper whose messages are aggregated over
+    the timestep.
+
+    Args:
+        capacity (int): Maximum number of messages to keep.
+    """
+
+    def __init__(self, capacity):
+        self.lock = Lock()
+        self.messages = deque(maxlen=capacity)
+
+    def put(self, message):
+        with self.lock:
+            self.messages.append(message)
+
+    def take_latest(self):
+        """Returns the newest message since the last take, or ``None``.
+        """
+        with self.lock:
+            message = self.messages[-1] if self.messages else None
+            self.messages.clear()
+        return message
+
+    def take_all(self):
+        """Returns the messages since the last take, oldest first.
+        """
+        with self.lock:
+            messages = list(self.messages)
+            self.messages.clear()
+        return messages
+
+
+Frame = namedtuple('Frame', ['pixels', 'stamp', 'message'])
+""" A decoded image, its capture stamp and the message it came from
+"""
+
+
+class ImageSlot:
+    """Decodes the newest image of a topic on a background thread.
+
+    Messages are only stored when they arrive. A decoder thread picks up
+    the newest stored message, so frames superseded before it gets to
+    them are dropped without being decoded, and the learning loop gets
+    pixels that are ready to use.
+
+    Args:
+        decode (fun): Function that turns an image message into a numpy
+            array of pixels.
+        threaded (bool): Whether to decode on the background thread. If
+            not, each message is decoded as it is put, which keeps a
+            loop on a :doc:`transport` with a virtual clock
+            deterministic.
+
+    A message that fails to decode is logged and counted as dropped, so
+    one bad frame neither stops the decoder thread nor raises in the
+    subscriber that put it.
+
+    Attributes:
+        decoded (int): Number of frames decoded.
+        dropped (int): Number of frames dropped without being decoded,
+            including those that failed to decode.
+    """
+
+    def __init__(self, decode, threaded=True):
+        self.decode = decode
+        self.threaded = threaded
+        self.condition = Condition()
+        self.message = None
+        self.frame = None
+        self.decoded = 0
+        self.dropped = 0
+
+        if threaded:
+            decoder = Thread(target=self.decode_loop, name='image_decoder')
+            decoder.daemon = True
+            decoder.start()
+
+    def put(self, message):
+        if not self.threaded:
+            self.decode_message(message)
+            return
+
+        with self.condition:
+            if self.message is not None:
+                self.dropped += 1
+            self.message = message
+            self.condition.notify()
+
+    def decode_loop(self):
+        while True:
+            with self.condition:
+                while self.message is None:
+                    self.condition.wait()
+                message, self.message = self.message, None
+            self.decode_message(message)
+
+    def decode_message(self, message):
+        try:
+            with profiler.stage('decode'):
+                pixels = self.decode(message)
+        except Exception as error:
+            logerr("Dropping an image that failed to decode: {!r}".format(
+                    error))
+            with self.condition:
+                self.dropped += 1
+            return
+        frame = Frame(pixels, message.header.stamp, message)
+
+        with self.condition:
+            if self.frame is not None and not self.threaded:
+                self.dropped += 1
+            self.frame = frame
+            self.decoded += 1
+
+    def take_latest(self):
+        """Returns the newest decoded :py:class:`Frame` since the last
+        take, or ``None``.
+        """
+        with self.condition:
+            frame, self.frame = self.frame, None
+        return frame
+
+    def take_all(self):
+        """Returns a list holding the newest decoded frame, if there is
+        one.
+        """
+        frame = self.take_latest()
+        return [] if frame is None else [frame]
+
+
+def make_buffers(features_to_use, threaded=True):
+    """Creates a buffer for each topic used by the given features.
+
+    Topics of features in ``tools.feature_history`` get a
+    :py:class:`RingBuffer` of that length, topics of features in
+    ``tools.image_decoders`` get an :py:class:`ImageSlot`, and all others
+    get a :py:class:`LatestSlot`.
+
+    Args:
+        features_to_use (set of str): Features whose topics to buffer.
+        threaded (bool): Whether image slots decode on their own thread.
+
+    Returns:
+        dict: Maps topic names to their buffer.
+    """
+    buffers = {}
+    for feature in features_to_use:
+        topic = tools.features.get(feature)
+        if topic is None or topic in buffers:
+            continue
+        capacity = tools.feature_history.get(feature)
+        decoder = tools.image_decoders.get(feature)
+        if capacity is not None:
+            buffers[topic] = RingBuffer(capacity)
+        elif decoder is not None:
+            buffers[topic] = ImageSlot(getattr(tools, decoder), threaded)
+        else:
+            buffers[topic] = LatestSlot()
+    return buffers
@@ -0,0 +1,228 @@
+"""Connects the learning loops to their topics and clock.
+
+:py:class:`~learning_foreground.LearningForeground`,
+:py:class:`~return_calculator.ReturnCalculator` and
+:py:class:`~action_manager.ActionManager` subscribe, publish, read the
+time and pace their loops through a transport instead of calling rospy.
+:py:class:`RosTransport` does so through ROS, as before.
+:py:class:`LocalTransport` instead calls subscribers directly from
+``publish``, with no serialization or ROS master, and keeps a
+:py:class:`VirtualClock` that only moves when the loop sleeps. A loop on
+a local transport, fed by e.g. a :py:class:`~simulator.SimulatedRobot`,
+runs as fast as the CPU allows.
+
+Example::
+
+    transport = LocalTransport(max_time=600)
+    robot = SimulatedRobot(transport, topics)
+    foreground = LearningForeground(..., transport=transport)
+    foreground.run()
+
+The log functions are rospy's when it is installed, and the standard
+library's otherwise, so modules that only log need not import rospy.
+"""
+from __future__ import division
+
+from collections import defaultdict
+import threading
+
+from rate import PreciseRate
+
+try:
+    from rospy import ROSInterruptException, logdebug, logerr, loginfo, logwarn
+except ImportError:
+    import logging
+
+    class ROSInterruptException(Exception):
+        """Never raised without ROS; lets ``except`` clauses name it."""
+
+    # print INFO and above to stderr, as rospy does
+    _logger = logging.getLogger('horde')
+    if not _logger.handlers:
+        _handler = logging.StreamHandler()
+        _handler.setFormatter(logging.Formatter(
+                '[%(levelname)s] [%(created)f]: %(message)s'))
+        _logger.addHandler(_handler)
+        _logger.setLevel(logging.INFO)
+        _logger.propagate = False
+    logdebug = _logger.debug
+    loginfo = _logger.info
+    logwarn = _logger.warning
+    logerr = _logger.error
+
+
+class RosTransport:
+    """Topics, time and shutdown from ROS.
+
+    Attributes:
+        asynchronous (bool): Whether messages arrive on other threads
+            while a loop runs.
+    """
+
+    asynchronous = True
+
+    def __init__(self):
+        import rospy
+
+        self.rospy = rospy
+
+    def init_node(self, name):
+        self.rospy.init_node(name, anonymous=True)
+
+    def subscribe(self, topic, message_type, callback):
+        return self.rospy.Subscriber(topic, message_type, callback)
+
+    def publisher(self, topic, message_type, queue_size=1, latch=False):
+        return self.rospy.Publisher(topic,
+                                    message_type,
+                                    queue_size=queue_size,
+                                    latch=latch)
+
+    def now(self):
+        return self.rospy.Time.now()
+
+    def rate(self, period, catch_up=False, name=None):
+        return PreciseRate(period, catch_up=catch_up, name=name)
+
+    def is_shutdown(self):
+        return self.rospy.is_shutdown()
+
+
+class Time(object):
+    """Point on a :py:class:`VirtualClock`, like a ROS time stamp."""
+
+    def __init__(self, secs):
+        self.secs = secs
+
+    def to_sec(self):
+        return self.secs
+
+
+class VirtualClock:
+    """Simulated time that advances only when a loop sleeps on it.
+
+    Sleeping returns immediately, after moving the time forward and
+    calling every function added with :py:meth:`on_advance`. Only one
+    loop should sleep on a virtual clock; it drives the simulation.
+
+    Args:
+        start (float): Initial time in seconds.
+
+    Attributes:
+        seconds (float): Current time.
+    """
+
+    def __init__(self, start=0.0):
+        self.seconds = start
+        self.listeners = []
+
+    def on_advance(self, listener):
+        """Calls ``listener(dt)`` each time the clock moves ``dt``
+        seconds forward.
+        """
+        self.listeners.append(listener)
+
+    def time(self):
+        return self.seconds
+
+    def sleep(self, seconds):
+        if seconds <= 0:
+            return
+        self.seconds += seconds
+        for listener in self.listeners:
+            listener(seconds)
+
+    def wait(self, event, seconds):
+        """Returns at once if ``event`` is set; otherwise sleeps."""
+        if event.is_set():
+            return True
+        self.sleep(seconds)
+        return False
+
+
+class LocalPublisher:
+    """Publishes by calling the subscribers of a :py:class:`LocalTransport`.
+    """
+
+    def __init__(self, transport, topic, message_type, latch=False):
+        self.transport = transport
+        self.topic = topic
+        self.message_type = message_type
+        self.latch = latch
+
+    def publish(self, *args, **kwargs):
+        """Sends a message, or builds one from the arguments as rospy
+        does.
+        """
+        if (len(args) == 1 and not kwargs and
+                isinstance(args[0], self.message_type)):
+            message = args[0]
+        else:
+            message = self.message_type(*args, **kwargs)
+        self.transport.deliver(self.topic, message, self.latch)
+
+
+class LocalTransport:
+    """In-process topics on a virtual clock.
+
+    Messages are passed to subscribers as objects, on the publishing
+    thread, without being copied.
+
+    Args:
+        clock (VirtualClock, optional): Clock the loops run on.
+        max_time (float, optional): Time on ``clock`` after which
+            :py:meth:`is_shutdown` is true.
+
+    Attributes:
+        asynchronous (bool): Whether messages arrive on other threads
+            while a loop runs. Here they arrive while the loop sleeps.
+        subscribers (dict): Maps topics to their callbacks.
+    """
+
+    asynchronous = False
+
+    def __init__(self, clock=None, max_time=None):
+        self.clock = clock or VirtualClock()
+        self.max_time = max_time
+        self.subscribers = defaultdict(list)
+        self.latched = {}
+        self.lock = threading.Lock()
+        self.shutdown_requested = False
+
+    def init_node(self, name):
+        pass
+
+    def subscribe(self, topic, message_type, callback):
+        with self.lock:
+            self.subscribers[topic].append(callback)
+            message = self.latched.get(topic)
+        if message is not None:
+            callback(message)
+
+    def publisher(self, topic, message_type, queue_size=1, latch=False):
+        return LocalPublisher(self, topic, message_type, latch)
+
+    def deliver(self, topic, message, latch=False):
+        with self.lock:
+            if latch:
+                self.latched[topic] = message
+            callbacks = list(self.subscribers.get(topic, ()))
+        for callback in callbacks:
+            callback(message)
+
+    def now(self):
+        return Time(self.clock.time())
+
+    def rate(self, period, catch_up=False, name=None):
+        return PreciseRate(period,
+                           catch_up=catch_up,
+                           name=name,
+                           clock=self.clock)
+
+    def is_shutdown(self):
+        if self.shutdown_requested:
+            return True
+        return self.max_time is not None and self.clock.time() >= self.max_time
+
+    def shutdown(self):
+        self.shutdown_requested = True
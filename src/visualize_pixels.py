@@ -13,31 +13,76 @@ colorize the Voronoi diagram
 the Voronoi diagram is plotted using matplotlib
 """
 
-import cv2
-import matplotlib
-import matplotlib.pyplot as plt
+from __future__ import division
+
+import multiprocessing as mp
+
 import numpy as np
-import rospy
 
+from rate import PreciseRate
 import tools
 from tools import timing
 
 from state_representation import StateConstants
+from transport import RosTransport, loginfo
+
+
+def voronoi_labels(mask, chunk_rows=48):
+    """Labels each pixel with the index of the nearest chosen pixel.
+
+    Chosen pixels are indexed in the row-major order of ``mask``, the
+    same order as ``image[mask]``.
 
-# turn off toolbar
-matplotlib.rcParams['toolbar'] = 'None'
+    Args:
+        mask (numpy array of bool): Mask of the chosen pixels.
+        chunk_rows (int): Number of image rows labelled at a time, to
+            bound the memory used for distances.
+
+    Returns:
+        numpy array of int: Label of each pixel, shaped like ``mask``.
+    """
+    centers = np.transpose(np.nonzero(mask)).astype(float)
+    rows, cols = mask.shape
+    col_coords = np.arange(cols, dtype=float)
+    labels = np.empty(mask.shape, dtype=np.intp)
+
+    for start in range(0, rows, chunk_rows):
+        stop = min(start + chunk_rows, rows)
+        row_coords = np.arange(start, stop, dtype=float)
+        d_rows = (row_coords[:, np.newaxis] - centers[:, 0]) ** 2
+        d_cols = (col_coords[:, np.newaxis] - centers[:, 1]) ** 2
+        distances = d_rows[:, np.newaxis, :] + d_cols[np.newaxis, :, :]
+        labels[start:stop] = np.argmin(distances, axis=2)
+
+    return labels
 
 
 class Visualize:
+    """Shows the chosen pixels of each image as a Voronoi diagram.
+
+    The label map of the diagram is computed once, since the chosen
+    pixels never change, so drawing a frame is a single gather of the
+    chosen pixels' colours.
+
+    Args:
+        mask (numpy array of bool): Mask of the chosen pixels.
+        imsizex (int): Width of the image.
+        imsizey (int): Height of the image.
+        dpi (int): Resolution of the figure.
+    """
+
     def __init__(self, mask, imsizex, imsizey, dpi=100):
+        # matplotlib is slow to import, so only import it when needed
+        import matplotlib
+        import matplotlib.pyplot as plt
+
+        # turn off toolbar
+        matplotlib.rcParams['toolbar'] = 'None'
 
-        # convert mask to x,y points
-        points = map(list, zip(*reversed(map(list, np.where(mask)))))
+        self.mask = mask
 
-        # make subdivision 
-        rect = (0, 0, imsizex, imsizey)
-        self.subdiv = cv2.Subdiv2D(rect)
-        self.subdiv.insert(points)
+        # label map, flipped the way the image is displayed
+        self.label_map = voronoi_labels(mask)[::-1, ::-1].copy()
 
         # initialize figure
         self.fig = plt.figure("Image Stream",
@@ -60,21 +105,26 @@ class Visualize:
         self.fig.canvas.draw()
 
     @timing
-    def update_colours(self):
+    def update_colours(self, image=None):
+        """Draws the diagram coloured by ``image``, or by the last image
+        received by :py:meth:`update_image`.
+        """
+        if image is not None:
+            self.image = image
         if self.image is None:
             return None
 
-        (facets, centers) = self.subdiv.getVoronoiFacetList([])
-        img = np.zeros(self.image.shape, dtype=self.image.dtype)
+        self.draw(self.image[self.mask])
 
-        # color image
-        for i in range(len(facets)):
-            ifacet = np.array([f for f in facets[i]], np.int)
-            color = self.image[int(centers[i][1])][int(centers[i][0])].tolist()
-            cv2.fillConvexPoly(img, ifacet, color)
+    def draw(self, colors):
+        """Draws the diagram given the colours of the chosen pixels.
 
+        Args:
+            colors (numpy array of uint8): One row of channel values per
+                chosen pixel, as given by ``image[mask]``.
+        """
         # update image data
-        self.im.set_data(np.flipud(np.fliplr(img)))
+        self.im.set_data(colors[self.label_map])
 
         # draw image
         self.ax.draw_artist(self.im)
@@ -85,39 +135,100 @@ class Visualize:
         self.image = np.fromstring(image_data.data,
                           np.uint8).reshape(480, 640, 3) 
 
-if __name__ == "__main__":
 
-    rospy.init_node('visualizer', anonymous=True)
-    
+class VisualizeProcess:
+    """Runs a :py:class:`Visualize` in its own process.
+
+    The caller only copies the colours of the chosen pixels into shared
+    memory; the other process draws the newest ones at ``period``.
+
+    Args:
+        mask (numpy array of bool): Mask of the chosen pixels.
+        imsizex (int): Width of the image.
+        imsizey (int): Height of the image.
+        period (float): Seconds between redraws.
+    """
+
+    def __init__(self, mask, imsizex, imsizey, period=0.1):
+        self.mask = mask
+        num_values = int(mask.sum()) * StateConstants.CHANNELS
+        self.colors = mp.RawArray('B', num_values)
+        self.seq = mp.RawValue('l', 0)
+
+        self.process = mp.Process(target=self.run,
+                                  args=(imsizex, imsizey, period),
+                                  name='visualizer')
+        self.process.daemon = True
+        self.process.start()
+
+    def update_colours(self, image):
+        """Hands the colours of the chosen pixels of ``image`` over to the
+        visualizer process.
+        """
+        if image is None:
+            return
+        colors = np.frombuffer(self.colors, dtype=np.uint8)
+        colors[:] = image[self.mask].ravel()
+        self.seq.value += 1
+
+    def run(self, imsizex, imsizey, period):
+        visualization = Visualize(self.mask, imsizex, imsizey)
+        colors = np.frombuffer(self.colors, dtype=np.uint8).reshape(
+                -1, StateConstants.CHANNELS)
+
+        rate = PreciseRate(period)
+        last_seq = 0
+        while True:
+            seq = self.seq.value
+            if seq != last_seq:
+                last_seq = seq
+                visualization.draw(colors.copy())
+            rate.sleep()
+
+    def close(self):
+        self.process.terminate()
+
+
+def start_visualizer():
+    """Shows the camera stream of a ROS node, coloured by random chosen
+    pixels.
+    """
+    transport = RosTransport()
+    transport.init_node('visualizer')
+
     # setup visualization
     num_pixels = StateConstants.IMAGE_LI * StateConstants.IMAGE_CO
     num_chosen = StateConstants.NUM_RANDOM_POINTS
     chosen_indices = np.random.choice(a=num_pixels,
-                                           size=num_chosen,
-                                           replace=False)
+                                      size=num_chosen,
+                                      replace=False)
 
-    pixel_mask = np.zeros(num_pixels, dtype=np.bool)
+    pixel_mask = np.zeros(num_pixels, dtype=bool)
     pixel_mask[chosen_indices] = True
     pixel_mask = pixel_mask.reshape(StateConstants.IMAGE_LI,
                                     StateConstants.IMAGE_CO)
-    rospy.loginfo("Creating visualization.")
+    loginfo("Creating visualization.")
     visualization = Visualize(pixel_mask,
                               imsizex=640,
                               imsizey=480)
-    rospy.loginfo("Done creatiing visualization.")
-    
+    loginfo("Done creating visualization.")
+
     # setup image subscriber
-    rospy.Subscriber("/camera/rgb/image_rect_color",
-                     tools.topic_format["/camera/rgb/image_rect_color"],
-                     visualization.update_image)    
+    transport.subscribe("/camera/rgb/image_rect_color",
+                        tools.topic_format["/camera/rgb/image_rect_color"],
+                        visualization.update_image)
 
-    r = rospy.Rate(int(1.0 / 0.1))
+    r = transport.rate(0.1)
 
-    while not rospy.is_shutdown():
-        visualization.update_colours()    
+    while not transport.is_shutdown():
+        visualization.update_colours()
         r.sleep()
 
 
+if __name__ == "__main__":
+    start_visualizer()
+
+
 # if __name__ == "__main__":
 
 #     rospy.init_node('visualizer', anonymous=True)
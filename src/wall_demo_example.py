@@ -19,7 +19,6 @@ from multiprocessing import Value
 import random
 
 import numpy as np
-import rospy
 from geometry_msgs.msg import Twist, Vector3
 
 from action_manager import start_action_manager
@@ -29,6 +28,7 @@ from learning_foreground import start_learning_foreground
 from policy import Policy
 from state_representation import StateConstants
 import tools
+from transport import ROSInterruptException, loginfo
 
 
 class GoForward(Policy):
@@ -197,8 +197,8 @@ if __name__ == "__main__":
 
         foreground_process.start()
 
-    except rospy.ROSInterruptException as detail:
-        rospy.loginfo("Handling: {}".format(detail))
+    except ROSInterruptException as detail:
+        loginfo("Handling: {}".format(detail))
     finally:
         try:
             foreground_process.join()